@@ -0,0 +1,73 @@
+# Archivo de datos fríos: saca de las colecciones calientes lo que ya no se consulta
+#
+#   python archive_cold_data.py [--batch-size 1000] [--dry-run]
+#
+# Mueve a <coleccion>_archive los ingresos y gastos inactivos, las simulaciones
+# antiguas y los reportes SUNAT que nadie pidió en un tiempo, según las reglas de
+# filtros_archivo (ARCHIVE_*_DIAS). Cada lote se copia primero (upsert por _id)
+# y luego se borra del original, así que una ejecución interrumpida se puede
+# repetir sin perder documentos. Los datos archivados se leen con
+# ?incluir_archivo=true en los listados y en la descarga de reportes.
+import sys
+import os
+import argparse
+import asyncio
+import logging
+import time
+
+from pymongo import ReplaceOne
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("archive_cold_data")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.server import db, coleccion_archivo, filtros_archivo
+
+# Colecciones cuyo listado usa la versión de datos del usuario para el ETag
+CON_VERSION_DATOS = ("ingresos", "gastos")
+
+
+async def archivar_coleccion(nombre: str, filtro: dict, batch_size: int, dry_run: bool) -> int:
+    pendientes = await db[nombre].count_documents(filtro)
+    logger.info(f"{nombre}: {pendientes} documentos por archivar")
+    if dry_run or not pendientes:
+        return 0
+
+    archivo = coleccion_archivo(nombre)
+    archivados = 0
+    inicio = time.perf_counter()
+    while True:
+        lote = await db[nombre].find(filtro).limit(batch_size).to_list(batch_size)
+        if not lote:
+            break
+        await archivo.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in lote], ordered=False)
+        # Se repite el filtro: si un documento cambió entre la copia y el borrado se queda en la colección
+        resultado = await db[nombre].delete_many({"$and": [{"_id": {"$in": [doc["_id"] for doc in lote]}}, filtro]})
+        archivados += resultado.deleted_count
+        if nombre in CON_VERSION_DATOS:
+            # Los listados cambian: los ETag que tengan los clientes dejan de valer
+            user_ids = list({doc["user_id"] for doc in lote})
+            await db.users.update_many({"id": {"$in": user_ids}}, {"$inc": {"data_version": 1}})
+        logger.info(f"{nombre}: {archivados}/{pendientes} ({archivados / (time.perf_counter() - inicio):.0f} docs/s)")
+    return archivados
+
+
+async def archivar(batch_size: int, dry_run: bool):
+    if db is None:
+        raise RuntimeError("MONGO_URL no configurado")
+
+    resumen = {}
+    for nombre, filtro in filtros_archivo().items():
+        resumen[nombre] = await archivar_coleccion(nombre, filtro, batch_size, dry_run)
+    logger.info(f"Documentos archivados: {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mueve los documentos fríos a las colecciones *_archive")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar los documentos por archivar")
+    args = parser.parse_args()
+    asyncio.run(archivar(args.batch_size, args.dry_run))
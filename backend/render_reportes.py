@@ -0,0 +1,86 @@
+# Renderizado de reportes XLSX/PDF en el pool de procesos del servidor.
+#
+# Los workers del pool solo importan este módulo: no debe importar server.py,
+# así no abren clientes de Mongo/Redis ni arrancan sus hilos.
+from io import BytesIO
+from typing import Any, Dict, List
+
+try:
+    import openpyxl
+except ImportError:  # sin openpyxl no se ofrece el formato XLSX
+    openpyxl = None
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+except ImportError:  # sin reportlab no se ofrece el formato PDF
+    colors = None
+
+SECCIONES_REPORTE = {
+    "ingresos": {
+        "titulo": "DETALLE INGRESOS",
+        "cabecera": ["Tipo", "Descripción", "Monto", "Frecuencia"],
+        "campos": ["tipo", "descripcion", "monto", "frecuencia"]
+    },
+    "gastos": {
+        "titulo": "DETALLE GASTOS",
+        "cabecera": ["Categoría", "Descripción", "Monto", "Tipo", "Frecuencia"],
+        "campos": ["categoria", "descripcion", "monto", "tipo", "frecuencia"]
+    }
+}
+
+def filas_resumen(resumen: Dict[str, float]) -> List[list]:
+    return [
+        ["Ingresos Totales", resumen["ingresos_totales"]],
+        ["Gastos Totales", resumen["gastos_totales"]],
+        ["Flujo Neto", resumen["flujo_neto"]]
+    ]
+
+def renderizar_xlsx(datos: Dict[str, Any], secciones: Dict[str, List[list]]) -> bytes:
+    """Genera el reporte en XLSX con una hoja por sección"""
+    libro = openpyxl.Workbook(write_only=True)
+    if datos["tipo_reporte"] not in SECCIONES_REPORTE:
+        hoja = libro.create_sheet("Resumen")
+        hoja.append(["RESUMEN FINANCIERO"])
+        hoja.append(["Contribuyente", datos["nombre_completo"]])
+        hoja.append(["DNI", datos["dni"]])
+        hoja.append(["Periodo", datos["periodo"]])
+        for fila in filas_resumen(datos["resumen_financiero"]):
+            hoja.append(fila)
+    for seccion, filas in secciones.items():
+        hoja = libro.create_sheet(seccion.capitalize())
+        hoja.append(SECCIONES_REPORTE[seccion]["cabecera"])
+        for fila in filas:
+            hoja.append(fila)
+    salida = BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+def renderizar_pdf(datos: Dict[str, Any], secciones: Dict[str, List[list]]) -> bytes:
+    """Genera el reporte en PDF con una tabla por sección"""
+    estilos = getSampleStyleSheet()
+    estilo_tabla = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0284c7")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("ALIGN", (2, 1), (2, -1), "RIGHT"),
+        ("FONTSIZE", (0, 0), (-1, -1), 8)
+    ])
+    contenido = [
+        Paragraph(f"Reporte {datos['tipo_reporte']} - {datos['periodo']}", estilos["Title"]),
+        Paragraph(f"{datos['nombre_completo']} - DNI {datos['dni']}", estilos["Normal"]),
+        Spacer(1, 12)
+    ]
+    if datos["tipo_reporte"] not in SECCIONES_REPORTE:
+        contenido.append(Paragraph("RESUMEN FINANCIERO", estilos["Heading2"]))
+        contenido.append(Table(filas_resumen(datos["resumen_financiero"]), hAlign="LEFT"))
+    for seccion, filas in secciones.items():
+        contenido.append(Paragraph(SECCIONES_REPORTE[seccion]["titulo"], estilos["Heading2"]))
+        tabla = Table([SECCIONES_REPORTE[seccion]["cabecera"]] + filas, repeatRows=1, hAlign="LEFT")
+        tabla.setStyle(estilo_tabla)
+        contenido.append(tabla)
+    salida = BytesIO()
+    SimpleDocTemplate(salida, pagesize=A4, title=f"Reporte {datos['tipo_reporte']} {datos['periodo']}").build(contenido)
+    return salida.getvalue()
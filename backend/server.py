@@ -1,22 +1,62 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.datastructures import Headers, MutableHeaders
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from gridfs.errors import NoFile
 import os
 import ssl
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from contextvars import ContextVar
+from pydantic import BaseModel, Field, EmailStr, AfterValidator
+from typing import List, Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Literal, Annotated
 import uuid
-from datetime import datetime, timezone
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, timezone, timedelta
+import calendar
+import re
+import unicodedata
+import math
 import json
+import csv
 import jwt
+import numpy as np
 from passlib.context import CryptContext
-from io import BytesIO
 import base64
 import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se negocia gzip
+    brotli = None
+
+try:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # solo se usan en la exportación a Parquet
+    pd = pa = pq = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # sin redis la caché queda solo en memoria de cada worker
+    aioredis = None
+
+try:
+    from backend import render_reportes
+except ImportError:  # uvicorn server:app lanzado desde backend/
+    import render_reportes
 
 
 ROOT_DIR = Path(__file__).parent
@@ -38,6 +78,35 @@ else:
     db = None
     print("⚠️ MongoDB not connected - running in demo mode")
 
+# Enrutamiento de lecturas: las transaccionales (y las que releen lo recién escrito)
+# van al primario; las analíticas pueden ir a un secundario con desfase acotado
+LECTURA_TRANSACCIONAL = "transaccional"
+LECTURA_ANALITICA = "analitica"
+MODOS_LECTURA = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+ANALYTICS_READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.environ.get('ANALYTICS_MAX_STALENESS_SECONDS', '90'))  # MongoDB exige >= 90; 0 = sin límite
+
+if ANALYTICS_READ_PREFERENCE not in MODOS_LECTURA:
+    print(f"⚠️ ANALYTICS_READ_PREFERENCE desconocido ({ANALYTICS_READ_PREFERENCE}), usando secondaryPreferred")
+    ANALYTICS_READ_PREFERENCE = "secondaryPreferred"
+
+def preferencia_lectura(lectura: str):
+    if lectura != LECTURA_ANALITICA or ANALYTICS_READ_PREFERENCE == "primary":
+        return Primary()
+    return MODOS_LECTURA[ANALYTICS_READ_PREFERENCE](max_staleness=ANALYTICS_MAX_STALENESS_SECONDS or -1)
+
+def coleccion_lectura(nombre: str, lectura: str = LECTURA_TRANSACCIONAL):
+    """Colección con la preferencia de lectura que corresponde al tipo de consulta"""
+    if lectura == LECTURA_TRANSACCIONAL:
+        return db[nombre]
+    return db.get_collection(nombre, read_preference=preferencia_lectura(lectura))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -46,8 +115,33 @@ api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = "your-secret-key-change-in-production"
+SECRET_KEY = os.environ.get('SECRET_KEY', "your-secret-key-change-in-production")
+ACCESS_TOKEN_MINUTES = int(os.environ.get('ACCESS_TOKEN_MINUTES', '15'))
+REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', '7'))
+REVOCATION_SYNC_SECONDS = float(os.environ.get('REVOCATION_SYNC_SECONDS', '30'))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '1024'))
+
+def load_signing_keys() -> Dict[str, str]:
+    """Lee las claves de firma desde JWT_KEYS ("kid1:secreto1,kid2:secreto2").
+
+    Para rotar se agrega la clave nueva, se cambia JWT_ACTIVE_KID y se retira la
+    anterior cuando hayan expirado los tokens firmados con ella.
+    """
+    keys = {}
+    for entry in os.environ.get('JWT_KEYS', '').split(','):
+        kid, sep, secret = entry.strip().partition(':')
+        if sep and kid and secret:
+            keys[kid] = secret
+    if not keys:
+        keys["default"] = SECRET_KEY
+    return keys
+
+JWT_KEYS = load_signing_keys()
+JWT_ACTIVE_KID = os.environ.get('JWT_ACTIVE_KID', next(iter(JWT_KEYS)))
+if JWT_ACTIVE_KID not in JWT_KEYS:
+    raise RuntimeError(f"JWT_ACTIVE_KID '{JWT_ACTIVE_KID}' no está definido en JWT_KEYS")
 
 # Helper functions for MongoDB serialization
 def prepare_for_mongo(data):
@@ -73,29 +167,200 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def create_access_token(data: dict):
-    return jwt.encode(data, SECRET_KEY, algorithm="HS256")
+class RevocationCache:
+    """Conjunto en memoria de tokens revocados (jti -> expiración).
+
+    Se sincroniza periódicamente desde la colección revoked_tokens, así la
+    verificación de cada request no consulta Mongo.
+    """
+    def __init__(self):
+        self.revoked: Dict[str, float] = {}
+        self.last_sync: Optional[datetime] = None
+
+    def add(self, jti: str, exp: float):
+        self.revoked[jti] = exp
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self.revoked
+
+    def prune(self):
+        now = datetime.now(timezone.utc).timestamp()
+        self.revoked = {jti: exp for jti, exp in self.revoked.items() if exp > now}
+
+    async def sync(self):
+        now = datetime.now(timezone.utc)
+        query = {"expires_at": {"$gt": now}}
+        if self.last_sync is not None:
+            # Margen para no perder revocaciones escritas durante la sincronización anterior
+            query["revoked_at"] = {"$gte": self.last_sync - timedelta(seconds=REVOCATION_SYNC_SECONDS)}
+        async for doc in db.revoked_tokens.find(query, {"_id": 0, "jti": 1, "expires_at": 1}):
+            self.add(doc["jti"], doc["expires_at"].replace(tzinfo=timezone.utc).timestamp())
+        self.last_sync = now
+        self.prune()
+
+revocation_cache = RevocationCache()
+
+class TokenCache:
+    """LRU acotado de tokens ya verificados, indexado por el hash del token.
+
+    La firma HS256 se verifica una vez por token y worker; las entradas se
+    descartan al expirar el token. La revocación se comprueba en cada uso.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[bytes, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        payload = self.entries.get(key)
+        if payload is None or payload["exp"] <= time.time():
+            if payload is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, token: str, payload: dict):
+        if self.maxsize <= 0:
+            return
+        self.entries[self._key(token)] = payload
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
 
-def decode_access_token(token: str):
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+def _encode_token(claims: dict, expires_in: timedelta) -> str:
+    now = datetime.now(timezone.utc)
+    payload = {**claims, "jti": uuid.uuid4().hex, "iat": now, "exp": now + expires_in}
+    return jwt.encode(payload, JWT_KEYS[JWT_ACTIVE_KID], algorithm="HS256", headers={"kid": JWT_ACTIVE_KID})
+
+def create_access_token(user: "User") -> str:
+    """Access token de corta duración con las claims que usan las rutas, para no consultar Mongo"""
+    return _encode_token({
+        "type": "access",
+        "user_id": user.id,
+        "email": user.email,
+        "is_admin": user.is_admin,
+        "edad": user.edad,
+        "dependientes": user.dependientes,
+    }, timedelta(minutes=ACCESS_TOKEN_MINUTES))
+
+def create_refresh_token(user: "User") -> str:
+    return _encode_token({"type": "refresh", "user_id": user.id}, timedelta(days=REFRESH_TOKEN_DAYS))
+
+def create_token_pair(user: "User") -> Dict[str, Any]:
+    return {
+        "access_token": create_access_token(user),
+        "refresh_token": create_refresh_token(user),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_MINUTES * 60,
+    }
+
+def verify_token_signature(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload
+        kid = jwt.get_unverified_header(token).get("kid", JWT_ACTIVE_KID)
+        key = JWT_KEYS.get(kid)
+        if key is None:
+            return None
+        return jwt.decode(token, key, algorithms=["HS256"], options={"require": ["exp", "jti"]})
     except jwt.PyJWTError:
         return None
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_access_token(token)
+def decode_token(token: str, token_type: str = "access"):
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = verify_token_signature(token)
+        if payload is None:
+            return None
+        token_cache.put(token, payload)
+    if payload.get("type") != token_type or revocation_cache.is_revoked(payload["jti"]):
+        return None
+    return payload
+
+def decode_access_token(token: str):
+    return decode_token(token, "access")
+
+def token_vigente(payload: dict) -> bool:
+    """Para conexiones largas (SSE): el token no ha expirado ni se ha revocado desde que se abrió"""
+    return payload["exp"] > datetime.now(timezone.utc).timestamp() and not revocation_cache.is_revoked(payload["jti"])
+
+async def revoke_token(payload: dict):
+    """Revoca un token hasta su expiración; la colección tiene índice TTL sobre expires_at"""
+    revocation_cache.add(payload["jti"], payload["exp"])
+    await db.revoked_tokens.update_one(
+        {"jti": payload["jti"]},
+        {"$setOnInsert": {
+            "jti": payload["jti"],
+            # Fechas nativas (no ISO) para que funcione el índice TTL
+            "expires_at": datetime.fromtimestamp(payload["exp"], tz=timezone.utc),
+            "revoked_at": datetime.now(timezone.utc),
+        }},
+        upsert=True
+    )
+
+def token_user_from_payload(payload: Optional[dict]) -> "TokenUser":
     if payload is None:
         raise HTTPException(status_code=401, detail="Token inválido")
-    
-    user = await db.users.find_one({"id": payload.get("user_id")})
+    return TokenUser(
+        id=payload["user_id"],
+        email=payload["email"],
+        is_admin=payload.get("is_admin", False),
+        edad=payload["edad"],
+        dependientes=payload.get("dependientes", 0),
+    )
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Usuario autenticado a partir de las claims del token, sin consultar Mongo"""
+    return token_user_from_payload(decode_access_token(credentials.credentials))
+
+async def get_user_record(current_user: "TokenUser" = Depends(get_current_user)):
+    """Documento completo del usuario, para las rutas que necesitan datos personales"""
+    return await cache.obtener(f"usuario:{current_user.id}", lambda: cargar_usuario(current_user.id), User)
+
+async def cargar_usuario(user_id: str) -> "User":
+    # Sin password_hash: el registro puede quedar en la caché compartida
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0, "busqueda": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
     
     return User(**parse_from_mongo(user))
 
-async def get_admin_user(current_user: "User" = Depends(get_current_user)):
+async def get_stream_token(token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """EventSource no permite cabeceras propias: se acepta también ?token=
+
+    Devuelve las claims del token: el stream las vuelve a comprobar en cada heartbeat.
+    """
+    if credentials is not None:
+        token = credentials.credentials
+    if not token:
+        raise HTTPException(status_code=403, detail="Not authenticated")
+    payload = decode_access_token(token)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return payload
+
+async def get_admin_user(current_user: "TokenUser" = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Acceso denegado. Se requieren permisos de administrador")
     return current_user
@@ -115,8 +380,18 @@ class User(BaseModel):
     dependientes: int = 0
     password_hash: Optional[str] = None
     is_admin: bool = False
+    data_version: int = 0  # se incrementa en cada cambio de ingresos/gastos
+    score_actual: Optional[float] = None  # lo recalcula el proceso nocturno recompute_scores.py
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class TokenUser(BaseModel):
+    """Usuario reconstruido desde las claims del access token"""
+    id: str
+    email: EmailStr
+    is_admin: bool = False
+    edad: int
+    dependientes: int = 0
+
 class UserCreate(BaseModel):
     nombre: str
     apellido: str
@@ -134,6 +409,12 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
 class UserResponse(BaseModel):
     id: str
     nombre: str
@@ -146,8 +427,22 @@ class UserResponse(BaseModel):
     estado_civil: str
     dependientes: int
     is_admin: bool
+    score_actual: Optional[float] = None
     created_at: datetime
 
+# Valores válidos de las enumeraciones. En Mongo se guarda el código (la posición
+# en la tupla), así que los valores nuevos solo se agregan al final.
+FRECUENCIAS = ("mensual", "quincenal", "semanal", "anual")
+TIPOS_INGRESO = ("salario", "freelance", "inversion", "negocio", "otro")
+CATEGORIAS_GASTO = ("vivienda", "alimentacion", "transporte", "salud", "educacion", "entretenimiento", "otros")
+TIPOS_GASTO = ("fijo", "variable")
+
+def a_centimos(monto: float) -> int:
+    return int(round(monto * 100))
+
+# Montos de entrada redondeados a céntimos: la respuesta coincide con lo que se guarda en Mongo
+Monto = Annotated[float, AfterValidator(lambda monto: a_centimos(monto) / 100)]
+
 class Ingreso(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -159,10 +454,10 @@ class Ingreso(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class IngresoCreate(BaseModel):
-    tipo: str
+    tipo: Literal[TIPOS_INGRESO]
     descripcion: str
-    monto: float
-    frecuencia: str
+    monto: Monto
+    frecuencia: Literal[FRECUENCIAS]
     activo: bool = True
 
 class Gasto(BaseModel):
@@ -177,11 +472,11 @@ class Gasto(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class GastoCreate(BaseModel):
-    categoria: str
+    categoria: Literal[CATEGORIAS_GASTO]
     descripcion: str
-    monto: float
-    frecuencia: str
-    tipo: str
+    monto: Monto
+    frecuencia: Literal[FRECUENCIAS]
+    tipo: Literal[TIPOS_GASTO]
     activo: bool = True
 
 class SimulacionCredito(BaseModel):
@@ -200,9 +495,42 @@ class SimulacionCredito(BaseModel):
 
 class SimulacionCreditoCreate(BaseModel):
     tipo_credito: str
-    monto_solicitado: float
+    monto_solicitado: Monto
     plazo_meses: int
 
+class ResumenUsuarioAdmin(BaseModel):
+    ingresos_mensuales: float
+    gastos_mensuales: float
+    flujo_neto: float
+    cantidad_ingresos: int
+    cantidad_gastos: int
+    ultima_simulacion: Optional[SimulacionCredito] = None
+
+class UsuarioAdmin(UserResponse):
+    resumen: Optional[ResumenUsuarioAdmin] = None
+
+class MetricaBenchmark(BaseModel):
+    metrica: str
+    valor: Optional[float] = None  # None si el usuario no tiene dato para esta métrica
+    percentil: Optional[float] = None
+    p25: float
+    mediana: float
+    p75: float
+    muestras: int
+
+class BenchmarkPares(BaseModel):
+    cohorte: Dict[str, str]  # vacío = todos los usuarios
+    tamano_cohorte: int
+    generado_at: datetime
+    metricas: List[MetricaBenchmark]
+
+class FlujoMensual(BaseModel):
+    mes: str  # YYYY-MM
+    ingresos: float
+    gastos: float
+    flujo_neto: float
+    movimientos: int
+
 class FlujoDinero(BaseModel):
     user_id: str
     ingresos_totales: float
@@ -211,6 +539,10 @@ class FlujoDinero(BaseModel):
     capacidad_ahorro: float
     porcentaje_ahorro: float
     fecha_calculo: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Solo en consultas históricas (?desde=&hasta=); los totales son del rango completo
+    desde: Optional[str] = None
+    hasta: Optional[str] = None
+    meses: Optional[List[FlujoMensual]] = None
 
 class SugerenciaFinanciamiento(BaseModel):
     user_id: str
@@ -228,6 +560,7 @@ class CalculoTributario(BaseModel):
     impuesto_renta: float
     porcentaje_impuesto: float
     tramo_tributario: str
+    anio_fiscal: int = 2024
     fecha_calculo: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ReporteSunat(BaseModel):
@@ -238,10 +571,168 @@ class ReporteSunat(BaseModel):
     datos: Dict[str, Any]
     archivo_base64: Optional[str] = None
     nombre_archivo: str
+    formato: str = "csv"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ProyeccionCreate(BaseModel):
+    meses: int = Field(default=24, ge=12, le=60)
+    simulaciones: int = Field(default=5000, ge=100, le=20000)
+    volatilidad_gastos: float = Field(default=0.15, ge=0, le=2)  # desviación mensual de gastos variables
+    volatilidad_ingresos: float = Field(default=0.30, ge=0, le=2)  # desviación mensual de freelance/inversion
+    saldo_inicial: float = 0
+    semilla: Optional[int] = None
+    tipo_credito: Optional[str] = None  # si se indica, se evalúa el riesgo de impago de la cuota
+    monto_credito: Optional[float] = Field(default=None, gt=0)
+    plazo_meses: Optional[int] = Field(default=None, gt=0)
+
+class ProyeccionFlujo(BaseModel):
+    user_id: str
+    meses: int
+    simulaciones: int
+    semilla: int
+    flujo_mensual_esperado: float
+    percentiles_saldo: Dict[str, List[float]]  # p5, p25, p50, p75, p95 por mes
+    probabilidad_saldo_negativo: float
+    cuota_mensual: Optional[float] = None
+    probabilidad_impago: Optional[float] = None
+    fecha_calculo: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class MontoMaximoPlazo(BaseModel):
+    plazo_meses: int
+    monto_maximo: float
+    cuota_mensual: float
+
+class PlazoMinimoMonto(BaseModel):
+    monto: float
+    plazo_minimo: Optional[int] = None  # None si no es aprobable dentro de PLAZO_MAXIMO_MESES
+    cuota_mensual: Optional[float] = None
+
+class CapacidadTipoCredito(BaseModel):
+    tipo_credito: str
+    tasa_interes: float
+    montos_maximos: List[MontoMaximoPlazo]
+    plazos_minimos: List[PlazoMinimoMonto]
+
+class CapacidadCredito(BaseModel):
+    user_id: str
+    flujo_neto: float
+    capacidad_pago: float
+    score_crediticio: float
+    cumple_score: bool
+    creditos: List[CapacidadTipoCredito]
+
+class CambioEscenario(BaseModel):
+    accion: str  # escalar_categoria, agregar_ingreso, agregar_gasto, eliminar, cambiar_frecuencia
+    categoria: Optional[str] = None  # categoría de gasto o tipo de ingreso (escalar_categoria)
+    factor: Optional[float] = Field(default=None, ge=0)
+    id: Optional[str] = None  # ingreso o gasto existente (eliminar, cambiar_frecuencia)
+    monto: Optional[float] = Field(default=None, ge=0)
+    frecuencia: Optional[Literal[FRECUENCIAS]] = None
+
+class Escenario(BaseModel):
+    nombre: str
+    cambios: List[CambioEscenario] = []
+
+class EscenariosCreate(BaseModel):
+    escenarios: List[Escenario] = Field(max_length=500)
+    tipo_credito: Optional[str] = None
+    monto_credito: Optional[float] = Field(default=None, gt=0)
+    plazo_meses: Optional[int] = Field(default=None, gt=0)
+
+class ResultadoEscenario(BaseModel):
+    nombre: str
+    ingresos_totales: float
+    gastos_totales: float
+    flujo_neto: float
+    capacidad_ahorro: float
+    porcentaje_ahorro: float
+    diferencia_flujo: float  # respecto a la situación actual
+    impuesto_renta: float
+    tramo_tributario: str
+    score_crediticio: float
+    cuota_mensual: Optional[float] = None
+    aprobado: Optional[bool] = None
+    observaciones: Optional[str] = None
+
 
 # Utility functions
+# Tasas de interés por tipo de crédito (anuales)
+TASAS_CREDITO = {
+    "personal": 25.0,
+    "hipotecario": 8.5,
+    "vehicular": 15.0
+}
+TASA_CREDITO_DEFAULT = 20.0
+PORCENTAJE_CAPACIDAD_PAGO = 0.3
+SCORE_MINIMO_APROBACION = 500
+
+# Factores para llevar cada frecuencia a su equivalente mensual
+FACTORES_MENSUALES = {
+    "semanal": 4.33,
+    "quincenal": 2,
+    "mensual": 1,
+    "anual": 1 / 12
+}
+
+def convertir_a_mensual(monto: float, frecuencia: str) -> float:
+    return monto * FACTORES_MENSUALES.get(frecuencia, 1)
+
+# Formato compacto en Mongo: montos en céntimos (enteros) y enumeraciones como códigos
+CODIFICACION_MONGO = {
+    "ingresos": {"montos": ("monto",), "codigos": {"tipo": TIPOS_INGRESO, "frecuencia": FRECUENCIAS}},
+    "gastos": {"montos": ("monto",), "codigos": {"categoria": CATEGORIAS_GASTO, "tipo": TIPOS_GASTO, "frecuencia": FRECUENCIAS}},
+    "simulaciones": {"montos": ("monto_solicitado", "cuota_mensual", "total_pagar"), "codigos": {}},
+}
+
+def codificar_documento(coleccion: str, doc: dict) -> dict:
+    """Pasa un documento al formato de Mongo: monto -> monto_centimos y enumeraciones -> código"""
+    config = CODIFICACION_MONGO[coleccion]
+    for campo in config["montos"]:
+        if campo in doc:
+            doc[f"{campo}_centimos"] = a_centimos(doc.pop(campo))
+    for campo, valores in config["codigos"].items():
+        if doc.get(campo) in valores:
+            doc[campo] = valores.index(doc[campo])
+    return doc
+
+def decodificar_documento(coleccion: str, doc: dict) -> dict:
+    """Inverso de codificar_documento; los documentos sin migrar se devuelven tal cual"""
+    config = CODIFICACION_MONGO[coleccion]
+    for campo in config["montos"]:
+        centimos = doc.pop(f"{campo}_centimos", None)
+        if centimos is not None:
+            doc[campo] = centimos / 100
+    for campo, valores in config["codigos"].items():
+        codigo = doc.get(campo)
+        if type(codigo) is int and 0 <= codigo < len(valores):
+            doc[campo] = valores[codigo]
+    return doc
+
+def proyeccion_codificada(coleccion: str, campos: List[str]) -> Dict[str, int]:
+    """Proyección de Mongo que incluye el campo en céntimos de cada monto pedido"""
+    montos = CODIFICACION_MONGO[coleccion]["montos"]
+    proyeccion = {"_id": 0}
+    for campo in campos:
+        proyeccion[campo] = 1
+        if campo in montos:
+            proyeccion[f"{campo}_centimos"] = 1
+    return proyeccion
+
+def centimos_mensuales_mongo() -> dict:
+    """Expresión de agregación equivalente a convertir_a_mensual, en céntimos.
+
+    Acepta tanto documentos migrados (monto_centimos, frecuencia como código)
+    como los antiguos (monto en soles, frecuencia como texto).
+    """
+    centimos = {"$ifNull": ["$monto_centimos", {"$multiply": ["$monto", 100]}]}
+    return {"$multiply": [centimos, {"$switch": {
+        "branches": [
+            {"case": {"$in": ["$frecuencia", [FRECUENCIAS.index(frecuencia), frecuencia]]}, "then": factor}
+            for frecuencia, factor in FACTORES_MENSUALES.items()
+        ],
+        "default": 1
+    }}]}
+
 def calcular_cuota_mensual(monto: float, tasa_anual: float, plazo_meses: int) -> float:
     """Calcula la cuota mensual usando la fórmula de amortización francesa"""
     tasa_mensual = tasa_anual / 100 / 12
@@ -284,100 +775,667 @@ def calcular_score_crediticio(ingresos: float, gastos: float, edad: int, dependi
     
     return min(max(score, 300), 850)  # Score entre 300 y 850
 
-def calcular_impuesto_renta(ingresos_anuales: float, gastos_deducibles: float = 0) -> CalculoTributario:
-    """Calcula el impuesto a la renta según las tablas tributarias de Perú 2024"""
-    # UIT 2024 = S/ 5,150
-    UIT = 5150
+def calcular_scores_vectorizado(ingresos: np.ndarray, gastos: np.ndarray, edad: int, dependientes: int) -> np.ndarray:
+    """calcular_score_crediticio sobre arreglos de ingresos y gastos del mismo usuario"""
+    ingresos = np.asarray(ingresos, dtype=float)
+    gastos = np.asarray(gastos, dtype=float)
+    ratio_flujo = np.divide(ingresos - gastos, ingresos, out=np.zeros(len(ingresos)), where=ingresos != 0)
+    score = 500 + np.select([ratio_flujo > 0.3, ratio_flujo > 0.15, ratio_flujo > 0], [200, 100, 50], default=-100)
     
-    # Base imponible
-    base_imponible = max(0, ingresos_anuales - gastos_deducibles)
+    # Edad y dependientes son los mismos en todas las filas
+    if 25 <= edad <= 55:
+        score += 50
+    elif edad < 25 or edad > 65:
+        score -= 30
+    score += 30 if dependientes <= 2 else -dependientes * 10
     
-    # Tabla de impuesto a la renta para personas naturales 2024
-    impuesto = 0
-    porcentaje = 0
-    tramo = ""
-    
-    if base_imponible <= 5 * UIT:  # Hasta S/ 25,750
-        impuesto = 0
-        porcentaje = 0
-        tramo = "Exonerado (hasta 5 UIT)"
-    elif base_imponible <= 20 * UIT:  # Hasta S/ 103,000
-        exceso = base_imponible - (5 * UIT)
-        impuesto = exceso * 0.08
-        porcentaje = 8
-        tramo = "Primer tramo (8%)"
-    elif base_imponible <= 35 * UIT:  # Hasta S/ 180,250
-        base_8 = 15 * UIT * 0.08  # S/ 6,180
-        exceso = base_imponible - (20 * UIT)
-        impuesto = base_8 + (exceso * 0.14)
-        porcentaje = 14
-        tramo = "Segundo tramo (14%)"
-    elif base_imponible <= 45 * UIT:  # Hasta S/ 231,750
-        base_8 = 15 * UIT * 0.08
-        base_14 = 15 * UIT * 0.14
-        exceso = base_imponible - (35 * UIT)
-        impuesto = base_8 + base_14 + (exceso * 0.17)
-        porcentaje = 17
-        tramo = "Tercer tramo (17%)"
-    else:  # Más de S/ 231,750
-        base_8 = 15 * UIT * 0.08
-        base_14 = 15 * UIT * 0.14
-        base_17 = 10 * UIT * 0.17
-        exceso = base_imponible - (45 * UIT)
-        impuesto = base_8 + base_14 + base_17 + (exceso * 0.30)
-        porcentaje = 30
-        tramo = "Cuarto tramo (30%)"
+    return np.where(ingresos == 0, 0, np.clip(score, 300, 850))
+
+def evaluar_aprobacion(cuota_mensual: float, flujo_neto: float, score: float) -> tuple:
+    """Aplica las reglas de aprobación: cuota dentro del 30% del flujo neto y score mínimo"""
+    capacidad_pago = flujo_neto * PORCENTAJE_CAPACIDAD_PAGO  # Máximo 30% del flujo neto
+    aprobado = cuota_mensual <= capacidad_pago and score >= SCORE_MINIMO_APROBACION
+    
+    observaciones = ""
+    if not aprobado:
+        if cuota_mensual > capacidad_pago:
+            observaciones += "Cuota mensual excede capacidad de pago. "
+        if score < SCORE_MINIMO_APROBACION:
+            observaciones += "Score crediticio insuficiente. "
+    else:
+        observaciones = "Crédito pre-aprobado sujeto a verificación de documentos."
+    return aprobado, observaciones
+
+# Tablas del impuesto a la renta para personas naturales por año fiscal.
+# Los límites de cada tramo están expresados en UIT; el primer tramo queda exonerado.
+TABLAS_IMPUESTO_RENTA = {
+    anio: {
+        "uit": uit,
+        "limites_uit": [0, 5, 20, 35, 45],
+        "tasas": [0.0, 0.08, 0.14, 0.17, 0.30],
+        "tramos": [
+            "Exonerado (hasta 5 UIT)",
+            "Primer tramo (8%)",
+            "Segundo tramo (14%)",
+            "Tercer tramo (17%)",
+            "Cuarto tramo (30%)",
+        ],
+    }
+    for anio, uit in {2022: 4600, 2023: 4950, 2024: 5150, 2025: 5350}.items()
+}
+ANIO_FISCAL_DEFAULT = 2024
+PORCENTAJE_GASTOS_DEDUCIBLES = 0.2
+
+def obtener_tabla_impuesto(anio: int) -> Dict[str, Any]:
+    tabla = TABLAS_IMPUESTO_RENTA.get(anio)
+    if tabla is None:
+        raise HTTPException(status_code=400, detail=f"Año fiscal {anio} no soportado")
+    return tabla
+
+def calcular_impuestos_vectorizado(bases_imponibles: np.ndarray, anio: int = ANIO_FISCAL_DEFAULT):
+    """Calcula el impuesto de un arreglo de bases imponibles; devuelve (impuestos, índice de tramo)"""
+    tabla = obtener_tabla_impuesto(anio)
+    limites = np.array(tabla["limites_uit"], dtype=float) * tabla["uit"]
+    tasas = np.array(tabla["tasas"])
+    # Impuesto acumulado al inicio de cada tramo
+    acumulado = np.concatenate(([0.0], np.cumsum(np.diff(limites) * tasas[:-1])))
+    
+    bases = np.maximum(np.asarray(bases_imponibles, dtype=float), 0)
+    # Cada tramo cubre (límite_i, límite_i+1]
+    tramos = np.clip(np.searchsorted(limites, bases, side="left") - 1, 0, len(limites) - 1)
+    impuestos = acumulado[tramos] + (bases - limites[tramos]) * tasas[tramos]
+    return impuestos, tramos
+
+def calcular_impuesto_renta(ingresos_anuales: float, gastos_deducibles: float = 0, anio: int = ANIO_FISCAL_DEFAULT) -> dict:
+    """Calcula el impuesto a la renta según las tablas tributarias de Perú del año indicado"""
+    tabla = obtener_tabla_impuesto(anio)
+    base_imponible = max(0, ingresos_anuales - gastos_deducibles)
+    impuestos, tramos = calcular_impuestos_vectorizado(np.array([base_imponible]), anio)
+    tramo = int(tramos[0])
     
     return {
         "ingresos_anuales": round(ingresos_anuales, 2),
         "gastos_deducibles": round(gastos_deducibles, 2),
         "base_imponible": round(base_imponible, 2),
-        "impuesto_renta": round(impuesto, 2),
-        "porcentaje_impuesto": porcentaje,
-        "tramo_tributario": tramo
+        "impuesto_renta": round(float(impuestos[0]), 2),
+        "porcentaje_impuesto": round(tabla["tasas"][tramo] * 100),
+        "tramo_tributario": tabla["tramos"][tramo],
+        "anio_fiscal": anio
     }
 
-def generar_reporte_csv(datos: dict, tipo_reporte: str) -> str:
-    """Genera un reporte en formato CSV y lo convierte a base64"""
-    import csv
-    from io import StringIO
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    if tipo_reporte == "ingresos":
-        writer.writerow(["Tipo", "Descripción", "Monto", "Frecuencia"])
-        for ingreso in datos.get("detalle_ingresos", []):
-            writer.writerow([ingreso["tipo"], ingreso["descripcion"], ingreso["monto"], ingreso["frecuencia"]])
-    elif tipo_reporte == "gastos":
-        writer.writerow(["Categoría", "Descripción", "Monto", "Tipo", "Frecuencia"])
-        for gasto in datos.get("detalle_gastos", []):
-            writer.writerow([gasto["categoria"], gasto["descripcion"], gasto["monto"], gasto["tipo"], gasto.get("frecuencia", "mensual")])
-    else:  # completo
-        writer.writerow(["RESUMEN FINANCIERO"])
-        writer.writerow(["Ingresos Totales", datos["resumen_financiero"]["ingresos_totales"]])
-        writer.writerow(["Gastos Totales", datos["resumen_financiero"]["gastos_totales"]])
-        writer.writerow(["Flujo Neto", datos["resumen_financiero"]["flujo_neto"]])
-        writer.writerow([])
-        writer.writerow(["DETALLE INGRESOS"])
-        writer.writerow(["Tipo", "Descripción", "Monto", "Frecuencia"])
-        for ingreso in datos.get("detalle_ingresos", []):
-            writer.writerow([ingreso["tipo"], ingreso["descripcion"], ingreso["monto"], ingreso["frecuencia"]])
-        writer.writerow([])
-        writer.writerow(["DETALLE GASTOS"])
-        writer.writerow(["Categoría", "Descripción", "Monto", "Tipo", "Frecuencia"])
-        for gasto in datos.get("detalle_gastos", []):
-            writer.writerow([gasto["categoria"], gasto["descripcion"], gasto["monto"], gasto["tipo"], gasto.get("frecuencia", "mensual")])
-    
-    csv_content = output.getvalue()
-    output.close()
-    
-    # Convertir a base64
-    return base64.b64encode(csv_content.encode('utf-8')).decode('utf-8')
+# HTTP caching (ETag / If-None-Match)
+async def bump_data_version(user_id: str):
+    """Incrementa la versión de datos del usuario tras modificar ingresos o gastos y avisa a sus streams"""
+    await db.users.update_one({"id": user_id}, {"$inc": {"data_version": 1}})
+    await invalidar_usuario(user_id)
+    notify_data_changed(user_id)
+
+def compute_etag(user_id: str, data_version: int, recurso: str) -> str:
+    """Genera un ETag fuerte a partir del usuario, su versión de datos y el recurso"""
+    digest = hashlib.sha1(f"{user_id}:{data_version}:{recurso}".encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+async def get_data_version(user_id: str) -> int:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "data_version": 1})
+    if user is None:
+        raise HTTPException(status_code=401, detail="Usuario no encontrado")
+    return user.get("data_version", 0)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    candidatos = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidatos
+
+# Versión de datos ya leída en la request actual (la deja conditional_get para calculo_compartido)
+version_datos_request: ContextVar[Optional[tuple]] = ContextVar("version_datos_request", default=None)
+
+def conditional_get(recurso: str, consulta: Optional[Callable[[Request], str]] = None):
+    """Dependencia que responde 304 antes de leer ingresos/gastos si el cliente ya tiene la versión actual.
+
+    consulta normaliza los parámetros que forman el ETag; por defecto se usa la query string tal cual.
+    """
+    async def dependency(request: Request, response: Response, current_user: "TokenUser" = Depends(get_current_user)):
+        parametros = consulta(request) if consulta else request.url.query
+        clave = f"{recurso}?{parametros}" if parametros else recurso
+        data_version = await get_data_version(current_user.id)
+        version_datos_request.set((current_user.id, data_version))
+        etag = compute_etag(current_user.id, data_version, clave)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+    return dependency
+
+
+# Singleflight: cálculos concurrentes idénticos comparten una sola ejecución
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una única tarea.
+
+    La tarea sigue aunque se cancele quien la inició, para no cortar a los demás
+    que la esperan. El resultado se comparte entre todos: no debe mutarse.
+    """
+    def __init__(self):
+        self.in_flight: Dict[tuple, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.coalesced_by_computation: Dict[str, int] = {}
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            self.coalesced_by_computation[key[1]] = self.coalesced_by_computation.get(key[1], 0) + 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self.in_flight),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_by_computation": self.coalesced_by_computation,
+        }
+
+async def calculo_compartido(user_id: str, computacion: str, fn: Callable[[], Awaitable[Any]], modelo: type) -> Any:
+    """Ejecuta fn una sola vez por (usuario, cálculo, versión de datos) entre las requests concurrentes.
+
+    El resultado queda en la caché de dos niveles para esa versión de datos; las
+    cargas concurrentes de una misma clave se agrupan en su singleflight.
+    """
+    leida = version_datos_request.get()
+    data_version = leida[1] if leida and leida[0] == user_id else await get_data_version(user_id)
+    return await cache.obtener(f"{computacion}:{user_id}", fn, modelo, version=data_version)
+
+
+# Caché de dos niveles: LRU en memoria del worker delante de un Redis compartido
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', '300'))
+CACHE_LOCAL_SIZE = int(os.environ.get('CACHE_LOCAL_SIZE', '10000'))
+# Cota de desfase del nivel local si se pierde un aviso de invalidación
+CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('CACHE_LOCAL_TTL_SECONDS', '30'))
+CACHE_LOCK_MS = int(os.environ.get('CACHE_LOCK_MS', '2000'))
+CACHE_CHANNEL = "cache:invalidaciones"
+
+class CacheDosNiveles:
+    """Caché de lectura con un nivel local por worker y otro compartido en Redis.
+
+    - Una entrada puede llevar la versión de datos con que se calculó; si no coincide
+      con la pedida cuenta como fallo, así que nunca se sirve un cálculo obsoleto.
+    - invalidar() borra en ambos niveles y avisa por pub/sub a los demás workers.
+    - Contra la estampida: una sola carga por clave en el worker (singleflight) y un
+      lock SET NX en Redis para que entre workers cargue uno y el resto espere.
+    Sin Redis funciona solo con el nivel local.
+    """
+    def __init__(self, redis_client, local_size: int, local_ttl: float, ttl: int):
+        self.redis = redis_client
+        self.local: "OrderedDict[str, tuple]" = OrderedDict()
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.origen = uuid.uuid4().hex
+        self.cargas_en_curso = SingleFlight()
+        # Cambia con cada invalidación: una carga que empezó antes no se guarda
+        self.generacion = 0
+        self.local_hits = 0
+        self.local_misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        self.loads = 0
+        self.lock_waits = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    def _leer_local(self, clave: str, version: Optional[int]):
+        entrada = self.local.get(clave)
+        if entrada is None or entrada[0] <= time.monotonic() or entrada[1] != version:
+            return None
+        self.local.move_to_end(clave)
+        return entrada[2]
+
+    def _guardar_local(self, clave: str, version: Optional[int], valor: Any):
+        if self.local_size <= 0:
+            return
+        self.local[clave] = (time.monotonic() + self.local_ttl, version, valor)
+        self.local.move_to_end(clave)
+        while len(self.local) > self.local_size:
+            self.local.popitem(last=False)
+            self.evictions += 1
+
+    async def _leer_compartido(self, clave: str, version: Optional[int], modelo: type):
+        try:
+            crudo = await self.redis.get(clave)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Caché compartida no disponible: {e}")
+            return None
+        if crudo is None:
+            return None
+        entrada = json.loads(crudo)
+        return modelo(**entrada["valor"]) if entrada["version"] == version else None
+
+    async def _guardar_compartido(self, clave: str, version: Optional[int], valor: Any):
+        try:
+            await self.redis.set(clave, json.dumps({"version": version, "valor": valor.dict()}, default=str), ex=self.ttl)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"No se pudo guardar en la caché compartida: {e}")
+
+    async def obtener(self, clave: str, cargar: Callable[[], Awaitable[Any]], modelo: type, version: Optional[int] = None) -> Any:
+        """Valor de la caché o, si falta, el resultado de cargar(). No debe mutarse: se comparte"""
+        valor = self._leer_local(clave, version)
+        if valor is not None:
+            self.local_hits += 1
+            return valor
+        self.local_misses += 1
+        # El segundo elemento agrupa las métricas por tipo de cálculo (flujo, usuario, ...)
+        llave = (clave, clave.split(":", 1)[0], version)
+        return await self.cargas_en_curso.do(llave, lambda: self._obtener_compartido(clave, cargar, modelo, version))
+
+    async def _obtener_compartido(self, clave: str, cargar: Callable[[], Awaitable[Any]], modelo: type, version: Optional[int]) -> Any:
+        generacion = self.generacion
+        lock = None
+        if self.redis is not None:
+            valor = await self._leer_compartido(clave, version, modelo)
+            if valor is None:
+                lock = f"{clave}:lock"
+                try:
+                    if not await self.redis.set(lock, self.origen, nx=True, px=CACHE_LOCK_MS):
+                        # Otro worker está cargando: se espera su resultado antes de cargar también
+                        self.lock_waits += 1
+                        lock = None
+                        limite = time.monotonic() + CACHE_LOCK_MS / 1000
+                        while valor is None and time.monotonic() < limite:
+                            await asyncio.sleep(0.02)
+                            valor = await self._leer_compartido(clave, version, modelo)
+                except Exception as e:
+                    self.shared_errors += 1
+                    lock = None
+                    logger.warning(f"Caché compartida no disponible: {e}")
+            if valor is not None:
+                self.shared_hits += 1
+                self._guardar_local(clave, version, valor)
+                return valor
+            self.shared_misses += 1
+        
+        try:
+            valor = await cargar()
+            self.loads += 1
+            if self.generacion == generacion:
+                self._guardar_local(clave, version, valor)
+                if self.redis is not None:
+                    await self._guardar_compartido(clave, version, valor)
+            return valor
+        finally:
+            if lock is not None:
+                try:
+                    await self.redis.delete(lock)
+                except Exception:
+                    pass
+
+    def _invalidar_local(self, claves: List[str]):
+        self.generacion += 1
+        for clave in claves:
+            self.local.pop(clave, None)
+
+    async def invalidar(self, *claves: str):
+        """Borra las claves en ambos niveles y avisa a los demás workers"""
+        self._invalidar_local(list(claves))
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(*claves)
+            await self.redis.publish(CACHE_CHANNEL, json.dumps({"origen": self.origen, "claves": list(claves)}))
+            self.invalidations_sent += 1
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"No se pudo propagar la invalidación de {claves}: {e}")
+
+    async def escuchar_invalidaciones(self):
+        """Aplica al nivel local las invalidaciones publicadas por otros workers"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(CACHE_CHANNEL)
+                # Mientras no hubo suscripción pudieron perderse avisos
+                self.local.clear()
+                async for mensaje in pubsub.listen():
+                    if mensaje["type"] != "message":
+                        continue
+                    aviso = json.loads(mensaje["data"])
+                    if aviso["origen"] != self.origen:
+                        self._invalidar_local(aviso["claves"])
+                        self.invalidations_received += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Suscripción a invalidaciones interrumpida, reintentando: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        local_total = self.local_hits + self.local_misses
+        shared_total = self.shared_hits + self.shared_misses
+        return {
+            "backend": "redis" if self.redis is not None else "local",
+            "local": {
+                "size": len(self.local),
+                "maxsize": self.local_size,
+                "hits": self.local_hits,
+                "misses": self.local_misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.local_hits / local_total, 4) if local_total else 0.0,
+            },
+            "shared": {
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "errors": self.shared_errors,
+                "hit_rate": round(self.shared_hits / shared_total, 4) if shared_total else 0.0,
+            },
+            "loads": self.loads,
+            "coalesced": self.cargas_en_curso.coalesced,
+            "lock_waits": self.lock_waits,
+            "invalidations_sent": self.invalidations_sent,
+            "invalidations_received": self.invalidations_received,
+        }
+
+if REDIS_URL and aioredis is None:
+    print("⚠️ REDIS_URL configurado pero falta el paquete redis: caché solo local")
+cache = CacheDosNiveles(
+    aioredis.from_url(REDIS_URL) if REDIS_URL and aioredis is not None else None,
+    CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL_SECONDS, CACHE_TTL_SECONDS
+)
+
+def claves_usuario(user_id: str) -> List[str]:
+    return [f"usuario:{user_id}", f"flujo:{user_id}"]
+
+async def invalidar_usuario(user_id: str):
+    await cache.invalidar(*claves_usuario(user_id))
+
+
+# Rate limiting (token bucket)
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory | mongo
+RATE_LIMIT_CAPACITY = float(os.environ.get('RATE_LIMIT_CAPACITY', '30'))
+RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get('RATE_LIMIT_REFILL_PER_SECOND', '0.5'))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+
+# Fichas que consume cada ruta; las que no figuran cuestan 1
+COSTOS_RATE_LIMIT = {
+    "login": 5,
+    "register": 5,
+    "refresh": 1,
+    "reporte-sunat": 10,
+    "simulacion-credito": 3,
+    "proyeccion": 5,
+    "escenarios": 5
+}
+
+class MemoryRateLimitBackend:
+    """Buckets en memoria del worker, en un LRU acotado; cada consulta es O(1)"""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()  # clave -> (fichas, instante)
+
+    async def take(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        """Descuenta `cost` fichas si hay saldo. Devuelve 0 o los segundos a esperar"""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            self.buckets.move_to_end(key)
+        retry_after = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            retry_after = (cost - tokens) / refill_rate
+        self.buckets[key] = (tokens, now)
+        while len(self.buckets) > self.maxsize:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+    def size(self) -> int:
+        return len(self.buckets)
+
+class MongoRateLimitBackend:
+    """Buckets compartidos entre workers en la colección rate_limits.
+
+    Cada consulta es una única actualización atómica (pipeline) sobre el _id del
+    bucket; el índice TTL borra los buckets que ya se rellenaron por completo.
+    """
+    async def take(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        now = time.time()
+        disponibles = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, refill_rate]}
+        ]}]}
+        bucket = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": disponibles}},
+                {"$set": {"permitido": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$permitido", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "ts": now,
+                    "expira_at": datetime.now(timezone.utc) + timedelta(seconds=capacity / refill_rate)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return 0.0 if bucket["permitido"] else (cost - bucket["tokens"]) / refill_rate
+
+    def size(self) -> Optional[int]:
+        return None
+
+class RateLimiter:
+    def __init__(self, backend, capacity: float, refill_rate: float):
+        # refill_rate divide el tiempo de espera: con 0 cada 429 sería un ZeroDivisionError
+        if capacity <= 0 or refill_rate <= 0:
+            raise ValueError(f"El rate limiter requiere capacidad y reposición mayores que 0 (capacity={capacity}, refill_rate={refill_rate})")
+        self.backend = backend
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.allowed = 0
+        self.throttled = 0
+        self.errors = 0
+        self.throttled_by_route: Dict[str, int] = {}
+
+    async def hit(self, key: str, ruta: str) -> float:
+        cost = min(COSTOS_RATE_LIMIT.get(ruta, 1), self.capacity)
+        try:
+            retry_after = await self.backend.take(key, cost, self.capacity, self.refill_rate)
+        except Exception as e:
+            # Si el backend compartido falla se deja pasar la request
+            self.errors += 1
+            logger.warning(f"Rate limiter no disponible: {e}")
+            return 0.0
+        if retry_after > 0:
+            self.throttled += 1
+            self.throttled_by_route[ruta] = self.throttled_by_route.get(ruta, 0) + 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "backend": RATE_LIMIT_BACKEND,
+            "keys": self.backend.size(),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+            "throttled_by_route": self.throttled_by_route,
+            "errors": self.errors,
+        }
+
+rate_limiter = RateLimiter(
+    MongoRateLimitBackend() if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimitBackend(RATE_LIMIT_MAX_KEYS),
+    RATE_LIMIT_CAPACITY,
+    RATE_LIMIT_REFILL_PER_SECOND
+)
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "desconocido"
+
+async def aplicar_rate_limit(key: str, ruta: str):
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = await rate_limiter.hit(key, ruta)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas solicitudes, intenta nuevamente en unos segundos",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def rate_limit(ruta: str, por_usuario: bool = True):
+    """Dependencia que descuenta el costo de la ruta del bucket del usuario, o de la IP en rutas sin sesión"""
+    if por_usuario:
+        async def dependency(current_user: "TokenUser" = Depends(get_current_user)):
+            await aplicar_rate_limit(f"user:{current_user.id}", ruta)
+    else:
+        async def dependency(request: Request):
+            await aplicar_rate_limit(f"ip:{client_ip(request)}", ruta)
+    return dependency
+
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Devuelve las codificaciones aceptadas por el cliente con su peso q"""
+    aceptadas = {}
+    for parte in header.split(","):
+        token, _, params = parte.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        aceptadas[token.strip().lower()] = q
+    return aceptadas
+
+def accepts_encoding(header: str, encoding: str) -> bool:
+    aceptadas = parse_accept_encoding(header)
+    return aceptadas.get(encoding, aceptadas.get("*", 0)) > 0
+
+def negotiate_encoding(header: str) -> Optional[str]:
+    """Elige brotli si está disponible y el cliente lo acepta; si no, gzip"""
+    if brotli is not None and accepts_encoding(header, "br"):
+        return "br"
+    if accepts_encoding(header, "gzip"):
+        return "gzip"
+    return None
+
+class CompressionMiddleware:
+    """Comprime las respuestas con brotli o gzip a partir de un tamaño mínimo.
+
+    Las respuestas que ya traen Content-Encoding (reportes precomprimidos) y los
+    streams de eventos se envían sin tocar.
+    """
+    EXCLUDED_MEDIA_TYPES = (
+        "text/event-stream", "image/", "application/gzip", "application/zip", "application/pdf",
+        "application/vnd.openxmlformats-officedocument."
+    )
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _compressor(self, encoding: str):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.finish
+        # wbits=31 produce formato gzip (cabecera + CRC)
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "passthrough": False, "compress": None, "finish": None}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if state["start"] is not None:
+                start, state["start"] = state["start"], None
+                headers = MutableHeaders(raw=start["headers"])
+                media_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or media_type.startswith(self.EXCLUDED_MEDIA_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                state["compress"], state["finish"] = self._compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    # El cuerpo cambia según la codificación: el ETag pasa a ser débil
+                    headers["ETag"] = f"W/{etag}"
+                body = state["compress"](body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body += state["finish"]()
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                await send({**message, "body": body})
+                return
+
+            body = state["compress"](body)
+            if not more_body:
+                body += state["finish"]()
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
 
 
 # Authentication Routes
-@api_router.post("/register")
+@api_router.post("/register", dependencies=[Depends(rate_limit("register", por_usuario=False))])
 async def register_user(user: UserCreate):
     # Verificar si el email ya existe
     existing_user = await db.users.find_one({"email": user.email})
@@ -393,48 +1451,196 @@ async def register_user(user: UserCreate):
     
     user_obj = User(**user_dict)
     user_data = prepare_for_mongo(user_obj.dict())
+    user_data["busqueda"] = terminos_busqueda(user_data)
     await db.users.insert_one(user_data)
     
-    # Crear token
-    token = create_access_token({"user_id": user_obj.id, "email": user_obj.email})
-    
     return {
         "user": UserResponse(**user_obj.dict()),
-        "access_token": token,
-        "token_type": "bearer"
+        **create_token_pair(user_obj)
     }
 
-@api_router.post("/login")
+@api_router.post("/login", dependencies=[Depends(rate_limit("login", por_usuario=False))])
 async def login(user_login: UserLogin):
     user = await db.users.find_one({"email": user_login.email})
     if not user or not verify_password(user_login.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Email o contraseña incorrectos")
     
-    token = create_access_token({"user_id": user["id"], "email": user["email"]})
+    user_obj = User(**parse_from_mongo(user))
     
     return {
-        "user": UserResponse(**parse_from_mongo(user)),
-        "access_token": token,
-        "token_type": "bearer"
+        "user": UserResponse(**user_obj.dict()),
+        **create_token_pair(user_obj)
     }
 
+@api_router.post("/refresh", dependencies=[Depends(rate_limit("refresh", por_usuario=False))])
+async def refresh_token(refresh_request: RefreshRequest):
+    payload = decode_token(refresh_request.refresh_token, "refresh")
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Refresh token inválido")
+    
+    # Se vuelve a leer el usuario para emitir claims actualizadas
+    user = await db.users.find_one({"id": payload["user_id"]})
+    if user is None:
+        raise HTTPException(status_code=401, detail="Usuario no encontrado")
+    
+    # Rotación: cada refresh token se usa una sola vez
+    await revoke_token(payload)
+    return create_token_pair(User(**parse_from_mongo(user)))
+
+@api_router.post("/logout")
+async def logout(logout_request: Optional[LogoutRequest] = None, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = decode_access_token(credentials.credentials)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    await revoke_token(payload)
+    
+    if logout_request and logout_request.refresh_token:
+        refresh_payload = decode_token(logout_request.refresh_token, "refresh")
+        if refresh_payload and refresh_payload["user_id"] == payload["user_id"]:
+            await revoke_token(refresh_payload)
+    
+    return {"message": "Sesión cerrada"}
+
 @api_router.get("/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: User = Depends(get_user_record)):
     return UserResponse(**current_user.dict())
 
 
 # Admin Routes
-@api_router.get("/admin/users", response_model=List[UserResponse])
-async def get_all_users_admin(admin_user: User = Depends(get_admin_user)):
-    users = await db.users.find().to_list(1000)
-    return [UserResponse(**parse_from_mongo(user)) for user in users]
+ORDENES_ADMIN_USERS = ("created_at", "apellido", "edad")
+
+def normalizar_busqueda(texto: str) -> str:
+    """Minúsculas y sin tildes, para comparar por prefijo sin depender de mayúsculas"""
+    sin_tildes = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return sin_tildes.lower().strip()
+
+def terminos_busqueda(user: dict) -> List[str]:
+    """Términos indexados (campo busqueda) para buscar usuarios por prefijo"""
+    terminos = set(normalizar_busqueda(f"{user.get('nombre', '')} {user.get('apellido', '')}").split())
+    email = normalizar_busqueda(user.get("email", ""))
+    terminos.update([email, email.split("@")[0], normalizar_busqueda(user.get("dni", ""))])
+    terminos.discard("")
+    return sorted(terminos)
+
+def codificar_cursor(valor: Any, user_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([valor, user_id]).encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(cursor: str) -> tuple:
+    try:
+        valor, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return valor, user_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def resumen_lookups() -> List[dict]:
+    """Etapas $lookup con los totales mensuales y la última simulación de cada usuario.
+
+    Cada join usa el índice por user_id de la colección unida (MongoDB 5.0+).
+    """
+    totales = [
+        {"$match": {"activo": True}},
+        {"$group": {"_id": None, "centimos": {"$sum": centimos_mensuales_mongo()}, "cantidad": {"$sum": 1}}}
+    ]
+    return [
+        {"$lookup": {"from": "ingresos", "localField": "id", "foreignField": "user_id", "pipeline": totales, "as": "_ingresos"}},
+        {"$lookup": {"from": "gastos", "localField": "id", "foreignField": "user_id", "pipeline": totales, "as": "_gastos"}},
+        {"$lookup": {
+            "from": "simulaciones", "localField": "id", "foreignField": "user_id",
+            "pipeline": [{"$sort": {"created_at": -1}}, {"$limit": 1}, {"$project": {"_id": 0}}],
+            "as": "_simulaciones"
+        }}
+    ]
+
+def resumen_desde_lookups(doc: dict) -> ResumenUsuarioAdmin:
+    ingresos = doc.pop("_ingresos", None) or [{"centimos": 0, "cantidad": 0}]
+    gastos = doc.pop("_gastos", None) or [{"centimos": 0, "cantidad": 0}]
+    simulaciones = doc.pop("_simulaciones", None) or []
+    ingresos_mensuales = round(ingresos[0]["centimos"] / 100, 2)
+    gastos_mensuales = round(gastos[0]["centimos"] / 100, 2)
+    ultima = None
+    if simulaciones:
+        ultima = SimulacionCredito(**parse_from_mongo(decodificar_documento("simulaciones", simulaciones[0])))
+    return ResumenUsuarioAdmin(
+        ingresos_mensuales=ingresos_mensuales,
+        gastos_mensuales=gastos_mensuales,
+        flujo_neto=round(ingresos_mensuales - gastos_mensuales, 2),
+        cantidad_ingresos=ingresos[0]["cantidad"],
+        cantidad_gastos=gastos[0]["cantidad"],
+        ultima_simulacion=ultima
+    )
+
+@api_router.get("/admin/users", response_model=List[UsuarioAdmin])
+async def get_all_users_admin(
+    response: Response,
+    q: Optional[str] = None,
+    ocupacion: Optional[str] = None,
+    estado_civil: Optional[str] = None,
+    edad_min: Optional[int] = None,
+    edad_max: Optional[int] = None,
+    orden: str = "created_at",
+    descendente: bool = False,
+    limite: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    resumen: bool = False,
+    admin_user: TokenUser = Depends(get_admin_user)
+):
+    """Directorio de usuarios con búsqueda por prefijo, filtros y paginación por cursor (X-Next-Cursor)"""
+    if orden not in ORDENES_ADMIN_USERS:
+        raise HTTPException(status_code=400, detail=f"Orden no soportado. Use: {', '.join(ORDENES_ADMIN_USERS)}")
+    
+    filtro: Dict[str, Any] = {}
+    if q:
+        # Cada palabra debe ser prefijo de algún término: rango acotado sobre el índice busqueda
+        terminos = normalizar_busqueda(q).split()
+        if terminos:
+            filtro["$and"] = [{"busqueda": re.compile("^" + re.escape(termino))} for termino in terminos]
+    if ocupacion:
+        filtro["ocupacion"] = ocupacion
+    if estado_civil:
+        filtro["estado_civil"] = estado_civil
+    if edad_min is not None or edad_max is not None:
+        filtro["edad"] = {}
+        if edad_min is not None:
+            filtro["edad"]["$gte"] = edad_min
+        if edad_max is not None:
+            filtro["edad"]["$lte"] = edad_max
+    
+    direccion = -1 if descendente else 1
+    if cursor:
+        # Keyset: continuar después del último (orden, id) de la página anterior
+        valor, ultimo_id = decodificar_cursor(cursor)
+        comparador = "$lt" if descendente else "$gt"
+        filtro = {"$and": [filtro, {"$or": [
+            {orden: {comparador: valor}},
+            {orden: valor, "id": {comparador: ultimo_id}}
+        ]}]}
+    
+    pipeline = [
+        {"$match": filtro},
+        {"$sort": {orden: direccion, "id": direccion}},
+        {"$limit": limite + 1},
+        {"$project": {"_id": 0, "password_hash": 0, "busqueda": 0}}
+    ]
+    if resumen:
+        pipeline += resumen_lookups()
+    
+    users = await coleccion_lectura("users", LECTURA_ANALITICA).aggregate(pipeline).to_list(limite + 1)
+    if len(users) > limite:
+        users = users[:limite]
+        response.headers["X-Next-Cursor"] = codificar_cursor(users[-1].get(orden), users[-1]["id"])
+    
+    resultado = []
+    for user in users:
+        resumen_usuario = resumen_desde_lookups(user) if resumen else None
+        resultado.append(UsuarioAdmin(**parse_from_mongo(user), resumen=resumen_usuario))
+    return resultado
 
 @api_router.get("/admin/stats")
-async def get_admin_stats(admin_user: User = Depends(get_admin_user)):
-    total_users = await db.users.count_documents({})
-    total_ingresos = await db.ingresos.count_documents({})
-    total_gastos = await db.gastos.count_documents({})
-    total_simulaciones = await db.simulaciones.count_documents({})
+async def get_admin_stats(admin_user: TokenUser = Depends(get_admin_user)):
+    total_users = await coleccion_lectura("users", LECTURA_ANALITICA).count_documents({})
+    total_ingresos = await coleccion_lectura("ingresos", LECTURA_ANALITICA).count_documents({})
+    total_gastos = await coleccion_lectura("gastos", LECTURA_ANALITICA).count_documents({})
+    total_simulaciones = await coleccion_lectura("simulaciones", LECTURA_ANALITICA).count_documents({})
     
     return {
         "total_usuarios": total_users,
@@ -444,80 +1650,320 @@ async def get_admin_stats(admin_user: User = Depends(get_admin_user)):
     }
 
 
+@api_router.get("/admin/impuestos")
+async def get_admin_distribucion_impuestos(anio: int = ANIO_FISCAL_DEFAULT, admin_user: TokenUser = Depends(get_admin_user)):
+    """Distribución del impuesto a la renta de todos los usuarios en una sola pasada"""
+    tabla = obtener_tabla_impuesto(anio)
+    user_ids = [user["id"] async for user in coleccion_lectura("users", LECTURA_ANALITICA).find({}, {"_id": 0, "id": 1})]
+    totales = await totales_mensuales_por_usuario()
+    
+    ingresos = np.array([totales.get(user_id, {}).get("ingresos_totales", 0.0) for user_id in user_ids], dtype=float)
+    gastos = np.array([totales.get(user_id, {}).get("gastos_totales", 0.0) for user_id in user_ids], dtype=float)
+    bases_imponibles = ingresos * 12 - gastos * 12 * PORCENTAJE_GASTOS_DEDUCIBLES
+    impuestos, tramos = calcular_impuestos_vectorizado(bases_imponibles, anio)
+    impuestos = np.round(impuestos, 2)
+    
+    return {
+        "anio_fiscal": anio,
+        "uit": tabla["uit"],
+        "total_usuarios": len(user_ids),
+        "recaudacion_total": round(float(impuestos.sum()), 2),
+        "impuesto_promedio": round(float(impuestos.mean()), 2) if len(user_ids) else 0,
+        "percentiles": {
+            f"p{p}": round(float(np.percentile(impuestos, p)), 2) if len(user_ids) else 0
+            for p in (50, 75, 90, 99)
+        },
+        "por_tramo": [
+            {
+                "tramo_tributario": nombre,
+                "usuarios": int((tramos == k).sum()),
+                "impuesto_total": round(float(impuestos[tramos == k].sum()), 2)
+            } for k, nombre in enumerate(tabla["tramos"])
+        ]
+    }
+
+
+# Columnar export (Parquet)
+EXPORT_DIR = Path(os.environ.get('EXPORT_DIR', ROOT_DIR.parent / 'exports'))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '5000'))
+
+# Columnas exportadas por colección y su tipo. Los datos de contacto y
+# credenciales de los usuarios no se exportan.
+COLUMNAS_EXPORTACION = {
+    "users": {
+        "id": "string", "edad": "int32", "ocupacion": "string", "estado_civil": "string",
+        "dependientes": "int32", "is_admin": "bool", "score_actual": "float64", "created_at": "timestamp"
+    },
+    "ingresos": {
+        "id": "string", "user_id": "string", "tipo": "string", "descripcion": "string",
+        "monto": "float64", "frecuencia": "string", "activo": "bool", "created_at": "timestamp"
+    },
+    "gastos": {
+        "id": "string", "user_id": "string", "categoria": "string", "descripcion": "string",
+        "monto": "float64", "frecuencia": "string", "tipo": "string", "activo": "bool", "created_at": "timestamp"
+    },
+    "simulaciones": {
+        "id": "string", "user_id": "string", "tipo_credito": "string", "monto_solicitado": "float64",
+        "plazo_meses": "int32", "tasa_interes": "float64", "cuota_mensual": "float64", "total_pagar": "float64",
+        "score_crediticio": "float64", "aprobado": "bool", "observaciones": "string", "created_at": "timestamp"
+    },
+}
+
+def esquema_exportacion(coleccion: str):
+    tipos = {
+        "string": pa.string(), "int32": pa.int32(), "float64": pa.float64(),
+        "bool": pa.bool_(), "timestamp": pa.timestamp("us", tz="UTC")
+    }
+    return pa.schema([pa.field(nombre, tipos[tipo]) for nombre, tipo in COLUMNAS_EXPORTACION[coleccion].items()])
+
+class ParquetPartitionWriter:
+    """Escribe una colección en archivos Parquet particionados por mes (mes=YYYY-MM).
+
+    Mantiene un ParquetWriter abierto por partición y recibe los documentos por
+    lotes, así la memoria usada depende del tamaño de lote y no de la colección.
+    """
+    def __init__(self, coleccion: str, destino: Path):
+        self.coleccion = coleccion
+        self.destino = destino / coleccion
+        self.esquema = esquema_exportacion(coleccion)
+        self.columnas = COLUMNAS_EXPORTACION[coleccion]
+        self.writers: Dict[str, Any] = {}
+        self.filas = 0
+
+    def escribir_lote(self, documentos: List[dict]):
+        df = pd.DataFrame.from_records(documentos, columns=list(self.columnas))
+        for nombre, tipo in self.columnas.items():
+            if tipo == "timestamp":
+                df[nombre] = pd.to_datetime(df[nombre], utc=True, format="ISO8601", errors="coerce")
+            elif tipo == "int32":
+                df[nombre] = pd.to_numeric(df[nombre], errors="coerce").fillna(0).astype("int32")
+            elif tipo == "float64":
+                df[nombre] = pd.to_numeric(df[nombre], errors="coerce").astype("float64")
+            elif tipo == "bool":
+                df[nombre] = df[nombre].fillna(False).astype(bool)
+        # La columna mes solo forma parte de la ruta (particionado estilo Hive)
+        meses = df["created_at"].dt.strftime("%Y-%m").fillna("sin_fecha")
+        
+        for mes, grupo in df.groupby(meses, sort=False):
+            writer = self.writers.get(mes)
+            if writer is None:
+                carpeta = self.destino / f"mes={mes}"
+                carpeta.mkdir(parents=True, exist_ok=True)
+                writer = pq.ParquetWriter(carpeta / "part-00000.parquet", self.esquema, compression="zstd")
+                self.writers[mes] = writer
+            writer.write_table(pa.Table.from_pandas(grupo, schema=self.esquema, preserve_index=False))
+        self.filas += len(df)
+
+    def cerrar(self) -> Dict[str, Any]:
+        for writer in self.writers.values():
+            writer.close()
+        return {"filas": self.filas, "particiones": sorted(self.writers)}
+
+async def exportar_colecciones(colecciones: List[str], destino: Optional[Path] = None, export_id: Optional[str] = None) -> Dict[str, Any]:
+    """Exporta las colecciones indicadas a Parquet leyendo los cursores de Mongo por lotes"""
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado")
+    export_id = export_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    destino = (destino or EXPORT_DIR) / export_id
+    destino.mkdir(parents=True, exist_ok=True)
+    
+    manifiesto = {"export_id": export_id, "ruta": str(destino), "colecciones": {}}
+    for coleccion in colecciones:
+        writer = ParquetPartitionWriter(coleccion, destino)
+        campos = list(COLUMNAS_EXPORTACION[coleccion])
+        proyeccion = proyeccion_codificada(coleccion, campos) if coleccion in CODIFICACION_MONGO else {"_id": 0, **{campo: 1 for campo in campos}}
+        cursor = coleccion_lectura(coleccion, LECTURA_ANALITICA).find({}, proyeccion, batch_size=EXPORT_BATCH_SIZE)
+        try:
+            while True:
+                lote = await cursor.to_list(EXPORT_BATCH_SIZE)
+                if not lote:
+                    break
+                if coleccion in CODIFICACION_MONGO:
+                    lote = [decodificar_documento(coleccion, doc) for doc in lote]
+                # Convertir y comprimir es CPU: se hace fuera del event loop
+                await asyncio.to_thread(writer.escribir_lote, lote)
+        finally:
+            manifiesto["colecciones"][coleccion] = await asyncio.to_thread(writer.cerrar)
+    
+    manifiesto["completado_at"] = datetime.now(timezone.utc).isoformat()
+    (destino / "manifest.json").write_text(json.dumps(manifiesto, indent=2))
+    return manifiesto
+
+async def _exportar_en_segundo_plano(colecciones: List[str], export_id: str):
+    try:
+        await exportar_colecciones(colecciones, export_id=export_id)
+    except Exception as e:
+        logger.error(f"Exportación {export_id} fallida: {e}")
+        (EXPORT_DIR / export_id).mkdir(parents=True, exist_ok=True)
+        (EXPORT_DIR / export_id / "error.json").write_text(json.dumps({"error": str(e)}))
+
+@api_router.post("/admin/export", status_code=202)
+async def crear_exportacion(colecciones: List[str] = Query(list(COLUMNAS_EXPORTACION)), admin_user: TokenUser = Depends(get_admin_user)):
+    if pa is None:
+        raise HTTPException(status_code=503, detail="Exportación a Parquet no disponible (falta pyarrow)")
+    desconocidas = set(colecciones) - set(COLUMNAS_EXPORTACION)
+    if desconocidas:
+        raise HTTPException(status_code=400, detail=f"Colecciones no exportables: {', '.join(sorted(desconocidas))}")
+    
+    export_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + "-" + uuid.uuid4().hex[:6]
+    spawn_background(_exportar_en_segundo_plano(colecciones, export_id))
+    return {"export_id": export_id, "estado": "en_proceso"}
+
+@api_router.get("/admin/export/{export_id}")
+async def estado_exportacion(export_id: str, admin_user: TokenUser = Depends(get_admin_user)):
+    carpeta = EXPORT_DIR / export_id
+    if "/" in export_id or ".." in export_id or not carpeta.is_dir():
+        raise HTTPException(status_code=404, detail="Exportación no encontrada")
+    if (carpeta / "error.json").exists():
+        return {"export_id": export_id, "estado": "error", **json.loads((carpeta / "error.json").read_text())}
+    if (carpeta / "manifest.json").exists():
+        return {"estado": "completado", **json.loads((carpeta / "manifest.json").read_text())}
+    return {"export_id": export_id, "estado": "en_proceso"}
+
+
+# Datos fríos: archive_cold_data.py mueve a <coleccion>_archive lo que las consultas
+# por usuario ya no necesitan; solo se lee con ?incluir_archivo=true
+ARCHIVE_SUFFIX = "_archive"
+ARCHIVE_INACTIVOS_DIAS = int(os.environ.get('ARCHIVE_INACTIVOS_DIAS', '90'))
+ARCHIVE_SIMULACIONES_DIAS = int(os.environ.get('ARCHIVE_SIMULACIONES_DIAS', '180'))
+ARCHIVE_REPORTES_DIAS = int(os.environ.get('ARCHIVE_REPORTES_DIAS', '90'))
+
+def coleccion_archivo(nombre: str):
+    return db[f"{nombre}{ARCHIVE_SUFFIX}"]
+
+def filtros_archivo(ahora: Optional[datetime] = None) -> Dict[str, dict]:
+    """Documentos fríos por colección según la antigüedad configurada"""
+    ahora = ahora or datetime.now(timezone.utc)
+    def creado_antes(dias: int) -> dict:
+        return {"created_at": {"$lt": (ahora - timedelta(days=dias)).isoformat()}}
+    inactivos = {"activo": False, **creado_antes(ARCHIVE_INACTIVOS_DIAS)}
+    return {
+        "ingresos": inactivos,
+        "gastos": inactivos,
+        "simulaciones": creado_antes(ARCHIVE_SIMULACIONES_DIAS),
+        # Cada reutilización renueva expira_at: se archivan los que nadie pidió en ARCHIVE_REPORTES_DIAS
+        "reportes_sunat": {"$or": [
+            {"expira_at": {"$lt": ahora + timedelta(days=REPORT_RETENTION_DAYS - ARCHIVE_REPORTES_DIAS)}},
+            {"expira_at": {"$exists": False}, **creado_antes(ARCHIVE_REPORTES_DIAS)}
+        ]},
+    }
+
+async def buscar_con_archivo(nombre: str, filtro: dict, incluir_archivo: bool) -> List[dict]:
+    """Documentos de la colección y, si se piden, los archivados (sin repetir uno que se está moviendo)"""
+    docs = await db[nombre].find(filtro).to_list(1000)
+    if incluir_archivo:
+        ids = {doc["id"] for doc in docs}
+        docs += [doc for doc in await coleccion_archivo(nombre).find(filtro).to_list(1000) if doc["id"] not in ids]
+    return docs
+
+async def buscar_uno_con_archivo(nombre: str, filtro: dict, incluir_archivo: bool) -> Optional[dict]:
+    doc = await db[nombre].find_one(filtro)
+    if doc is None and incluir_archivo:
+        doc = await coleccion_archivo(nombre).find_one(filtro)
+    return doc
+
+
 # Routes for Ingresos
 @api_router.post("/ingresos", response_model=Ingreso)
-async def create_ingreso(ingreso: IngresoCreate, current_user: User = Depends(get_current_user)):
+async def create_ingreso(ingreso: IngresoCreate, current_user: TokenUser = Depends(get_current_user)):
     ingreso_dict = ingreso.dict()
     ingreso_dict["user_id"] = current_user.id
     ingreso_obj = Ingreso(**ingreso_dict)
-    ingreso_data = prepare_for_mongo(ingreso_obj.dict())
+    ingreso_data = codificar_documento("ingresos", prepare_for_mongo(ingreso_obj.dict()))
     await db.ingresos.insert_one(ingreso_data)
+    await bump_data_version(current_user.id)
     return ingreso_obj
 
-@api_router.get("/ingresos", response_model=List[Ingreso])
-async def get_ingresos(current_user: User = Depends(get_current_user)):
-    ingresos = await db.ingresos.find({"user_id": current_user.id}).to_list(1000)
-    return [Ingreso(**parse_from_mongo(ingreso)) for ingreso in ingresos]
+@api_router.get("/ingresos", response_model=List[Ingreso], dependencies=[Depends(conditional_get("ingresos"))])
+async def get_ingresos(incluir_archivo: bool = False, current_user: TokenUser = Depends(get_current_user)):
+    ingresos = await buscar_con_archivo("ingresos", {"user_id": current_user.id}, incluir_archivo)
+    return [Ingreso(**parse_from_mongo(decodificar_documento("ingresos", ingreso))) for ingreso in ingresos]
 
 @api_router.delete("/ingresos/{ingreso_id}")
-async def delete_ingreso(ingreso_id: str, current_user: User = Depends(get_current_user)):
+async def delete_ingreso(ingreso_id: str, current_user: TokenUser = Depends(get_current_user)):
     result = await db.ingresos.delete_one({"id": ingreso_id, "user_id": current_user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+    await bump_data_version(current_user.id)
     return {"message": "Ingreso eliminado"}
 
 
 # Routes for Gastos
 @api_router.post("/gastos", response_model=Gasto)
-async def create_gasto(gasto: GastoCreate, current_user: User = Depends(get_current_user)):
+async def create_gasto(gasto: GastoCreate, current_user: TokenUser = Depends(get_current_user)):
     gasto_dict = gasto.dict()
     gasto_dict["user_id"] = current_user.id
     gasto_obj = Gasto(**gasto_dict)
-    gasto_data = prepare_for_mongo(gasto_obj.dict())
+    gasto_data = codificar_documento("gastos", prepare_for_mongo(gasto_obj.dict()))
     await db.gastos.insert_one(gasto_data)
+    await bump_data_version(current_user.id)
     return gasto_obj
 
-@api_router.get("/gastos", response_model=List[Gasto])
-async def get_gastos(current_user: User = Depends(get_current_user)):
-    gastos = await db.gastos.find({"user_id": current_user.id}).to_list(1000)
-    return [Gasto(**parse_from_mongo(gasto)) for gasto in gastos]
+@api_router.get("/gastos", response_model=List[Gasto], dependencies=[Depends(conditional_get("gastos"))])
+async def get_gastos(incluir_archivo: bool = False, current_user: TokenUser = Depends(get_current_user)):
+    gastos = await buscar_con_archivo("gastos", {"user_id": current_user.id}, incluir_archivo)
+    return [Gasto(**parse_from_mongo(decodificar_documento("gastos", gasto))) for gasto in gastos]
 
 @api_router.delete("/gastos/{gasto_id}")
-async def delete_gasto(gasto_id: str, current_user: User = Depends(get_current_user)):
+async def delete_gasto(gasto_id: str, current_user: TokenUser = Depends(get_current_user)):
     result = await db.gastos.delete_one({"id": gasto_id, "user_id": current_user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
+    await bump_data_version(current_user.id)
     return {"message": "Gasto eliminado"}
 
 
 # Routes for Flujo de Dinero
-@api_router.get("/flujo-dinero", response_model=FlujoDinero)
-async def calcular_flujo_dinero(current_user: User = Depends(get_current_user)):
+def consulta_rango_meses(request: Request) -> str:
+    """Rango del ETag ya resuelto, para que ?desde= sin hasta cambie al pasar de mes"""
+    desde, hasta = request.query_params.get("desde"), request.query_params.get("hasta")
+    if desde is None and hasta is None:
+        return ""
+    inicio, fin = resolver_rango_meses(desde, hasta)
+    return f"desde={inicio:%Y-%m}&hasta={fin:%Y-%m}"
+
+@api_router.get("/flujo-dinero", response_model=FlujoDinero, response_model_exclude_none=True, dependencies=[Depends(conditional_get("flujo-dinero", consulta_rango_meses))])
+async def calcular_flujo_dinero(current_user: TokenUser = Depends(get_current_user), desde: Optional[str] = None, hasta: Optional[str] = None):
+    if desde is None and hasta is None:
+        return await calcular_flujo_usuario(current_user.id)
+    inicio, fin = resolver_rango_meses(desde, hasta)
+    return await calculo_compartido(
+        current_user.id,
+        f"flujo-historico:{inicio:%Y-%m}:{fin:%Y-%m}",
+        lambda: calcular_flujo_historico(current_user.id, inicio, fin),
+        FlujoDinero
+    )
+
+async def calcular_flujo_usuario(user_id: str) -> FlujoDinero:
+    return await calculo_compartido(user_id, "flujo", lambda: _calcular_flujo_usuario(user_id), FlujoDinero)
+
+async def listar_activos(coleccion: str, user_id: str) -> List[dict]:
+    """Ingresos o gastos activos del usuario, ya decodificados al formato de la API"""
+    docs = await db[coleccion].find({"user_id": user_id, "activo": True}).to_list(1000)
+    return [decodificar_documento(coleccion, doc) for doc in docs]
+
+async def _calcular_flujo_usuario(user_id: str) -> FlujoDinero:
     # Obtener ingresos activos
-    ingresos = await db.ingresos.find({"user_id": current_user.id, "activo": True}).to_list(1000)
+    ingresos = await listar_activos("ingresos", user_id)
     
     # Obtener gastos activos
-    gastos = await db.gastos.find({"user_id": current_user.id, "activo": True}).to_list(1000)
+    gastos = await listar_activos("gastos", user_id)
     
+    return flujo_desde_activos(user_id, ingresos, gastos)
+
+def flujo_desde_activos(user_id: str, ingresos: List[dict], gastos: List[dict]) -> FlujoDinero:
     # Convertir todo a mensual
-    def convertir_a_mensual(monto: float, frecuencia: str) -> float:
-        conversiones = {
-            "semanal": monto * 4.33,
-            "quincenal": monto * 2,
-            "mensual": monto,
-            "anual": monto / 12
-        }
-        return conversiones.get(frecuencia, monto)
-    
     ingresos_totales = sum(convertir_a_mensual(i["monto"], i["frecuencia"]) for i in ingresos)
     gastos_totales = sum(convertir_a_mensual(g["monto"], g["frecuencia"]) for g in gastos)
-    
+    return flujo_desde_totales(user_id, ingresos_totales, gastos_totales)
+
+def flujo_desde_totales(user_id: str, ingresos_totales: float, gastos_totales: float) -> FlujoDinero:
     flujo_neto = ingresos_totales - gastos_totales
     capacidad_ahorro = max(0, flujo_neto)
     porcentaje_ahorro = (capacidad_ahorro / ingresos_totales * 100) if ingresos_totales > 0 else 0
     
     return FlujoDinero(
-        user_id=current_user.id,
+        user_id=user_id,
         ingresos_totales=round(ingresos_totales, 2),
         gastos_totales=round(gastos_totales, 2),
         flujo_neto=round(flujo_neto, 2),
@@ -526,22 +1972,437 @@ async def calcular_flujo_dinero(current_user: User = Depends(get_current_user)):
     )
 
 
+async def totales_mensuales_por_usuario(user_ids: Optional[List[str]] = None, lectura: str = LECTURA_ANALITICA) -> Dict[str, Dict[str, float]]:
+    """Ingresos y gastos activos mensualizados por usuario, con una agregación por colección"""
+    match = {"activo": True}
+    if user_ids is not None:
+        match["user_id"] = {"$in": user_ids}
+    
+    totales = {}
+    for nombre, campo in (("ingresos", "ingresos_totales"), ("gastos", "gastos_totales")):
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": "$user_id", "total": {"$sum": centimos_mensuales_mongo()}}}
+        ]
+        async for doc in coleccion_lectura(nombre, lectura).aggregate(pipeline):
+            usuario = totales.setdefault(doc["_id"], {"ingresos_totales": 0.0, "gastos_totales": 0.0})
+            usuario[campo] = round(doc["total"] / 100, 2)
+    return totales
+
+
+# Benchmark de pares: rollup_benchmarks.py guarda un histograma de bordes fijos
+# por cohorte y métrica; el endpoint solo busca la cohorte e interpola
+BENCHMARK_MIN_COHORTE = int(os.environ.get('BENCHMARK_MIN_COHORTE', '20'))
+BANDAS_EDAD = ((18, 24), (25, 34), (35, 44), (45, 54), (55, 64))
+# De la cohorte más específica a la más general (la última es todos los usuarios)
+NIVELES_COHORTE = (("ocupacion", "edad", "dependientes"), ("ocupacion", "edad"), ("edad",), ())
+
+# Si cambian los bordes hay que subir la versión: los histogramas guardados dejan de servir
+VERSION_BORDES_BENCHMARK = 1
+BORDES_BENCHMARK = {
+    "porcentaje_ahorro": np.linspace(0, 100, 51),
+    "score": np.linspace(300, 850, 56),
+    # Primer bin [0, 1) para quien no gasta en la categoría, luego bins geométricos hasta S/ 100k
+    **{f"gasto_{categoria}": np.concatenate(([0.0], np.geomspace(1, 100000, 51))) for categoria in CATEGORIAS_GASTO},
+}
+
+def banda_edad(edad: int) -> str:
+    for desde, hasta in BANDAS_EDAD:
+        if desde <= edad <= hasta:
+            return f"{desde}-{hasta}"
+    return "65+" if edad > BANDAS_EDAD[-1][1] else f"<{BANDAS_EDAD[0][0]}"
+
+def claves_cohorte(ocupacion: Optional[str], edad: int, dependientes: int) -> List[tuple]:
+    """(clave, cohorte) de cada nivel de NIVELES_COHORTE para un usuario"""
+    atributos = {
+        "ocupacion": normalizar_busqueda(ocupacion or "") or "sin_dato",
+        "edad": banda_edad(edad),
+        "dependientes": "3+" if dependientes >= 3 else str(dependientes),
+    }
+    resultado = []
+    for nivel in NIVELES_COHORTE:
+        cohorte = {campo: atributos[campo] for campo in nivel}
+        resultado.append(("|".join(f"{campo}={valor}" for campo, valor in cohorte.items()) or "todos", cohorte))
+    return resultado
+
+def metricas_benchmark(ingresos: float, gastos: float, gastos_categoria: Dict[str, float], score: Optional[float]) -> Dict[str, Optional[float]]:
+    """Valores del usuario para cada métrica de BORDES_BENCHMARK (None = sin dato)"""
+    metricas = {
+        "porcentaje_ahorro": max(0, ingresos - gastos) / ingresos * 100 if ingresos > 0 else None,
+        # score 0 significa que no tiene ingresos registrados
+        "score": score or None,
+    }
+    for categoria in CATEGORIAS_GASTO:
+        metricas[f"gasto_{categoria}"] = gastos_categoria.get(categoria, 0.0) if gastos > 0 else None
+    return metricas
+
+def indices_bin(bordes: np.ndarray, valores) -> np.ndarray:
+    return np.clip(np.searchsorted(bordes, valores, side="right") - 1, 0, len(bordes) - 2)
+
+def percentil_en_histograma(conteos: np.ndarray, bordes: np.ndarray, valor: float) -> float:
+    """Porcentaje de la cohorte por debajo de valor, interpolando dentro del bin"""
+    i = int(indices_bin(bordes, valor))
+    fraccion = (min(max(valor, bordes[i]), bordes[i + 1]) - bordes[i]) / (bordes[i + 1] - bordes[i])
+    return float((conteos[:i].sum() + conteos[i] * fraccion) / conteos.sum() * 100)
+
+def cuantil_de_histograma(conteos: np.ndarray, bordes: np.ndarray, q: float) -> float:
+    """Valor en el cuantil q (0-1), suponiendo los valores repartidos uniformemente en cada bin"""
+    acumulado = np.cumsum(conteos)
+    objetivo = q * acumulado[-1]
+    i = min(int(np.searchsorted(acumulado, objetivo, side="left")), len(conteos) - 1)
+    previo = acumulado[i - 1] if i else 0
+    fraccion = (objetivo - previo) / conteos[i] if conteos[i] else 0
+    return float(bordes[i] + (bordes[i + 1] - bordes[i]) * fraccion)
+
+async def gastos_por_categoria_por_usuario(user_ids: List[str]) -> Dict[str, Dict[str, float]]:
+    """Gasto mensual activo por usuario y categoría, en una sola agregación"""
+    pipeline = [
+        {"$match": {"activo": True, "user_id": {"$in": user_ids}}},
+        {"$group": {"_id": {"user_id": "$user_id", "categoria": "$categoria"}, "total": {"$sum": centimos_mensuales_mongo()}}}
+    ]
+    resultado: Dict[str, Dict[str, float]] = {}
+    async for doc in coleccion_lectura("gastos", LECTURA_ANALITICA).aggregate(pipeline):
+        categoria = decodificar_documento("gastos", {"categoria": doc["_id"].get("categoria")})["categoria"]
+        por_categoria = resultado.setdefault(doc["_id"]["user_id"], {})
+        por_categoria[categoria] = por_categoria.get(categoria, 0.0) + doc["total"] / 100
+    return resultado
+
+@api_router.get("/benchmark", response_model=BenchmarkPares)
+async def get_benchmark(current_user: User = Depends(get_user_record)):
+    """Percentil del usuario frente a su cohorte de pares, con el último rollup_benchmarks.py"""
+    claves = claves_cohorte(current_user.ocupacion, current_user.edad, current_user.dependientes)
+    docs = {
+        doc["_id"]: doc async for doc in coleccion_lectura("benchmarks", LECTURA_ANALITICA).find(
+            {"_id": {"$in": [clave for clave, _ in claves]}, "version_bordes": VERSION_BORDES_BENCHMARK}
+        )
+    }
+    # Si la cohorte exacta es muy chica se sube de nivel: no se exponen grupos identificables
+    elegido = next((docs[clave] for clave, _ in claves if docs.get(clave, {}).get("n", 0) >= BENCHMARK_MIN_COHORTE), None)
+    if elegido is None:
+        raise HTTPException(status_code=404, detail="Aún no hay suficientes datos para comparar")
+
+    flujo = await calcular_flujo_usuario(current_user.id)
+    gastos_categoria: Dict[str, float] = {}
+    for gasto in await listar_activos("gastos", current_user.id):
+        gastos_categoria[gasto["categoria"]] = gastos_categoria.get(gasto["categoria"], 0.0) + convertir_a_mensual(gasto["monto"], gasto["frecuencia"])
+    valores = metricas_benchmark(flujo.ingresos_totales, flujo.gastos_totales, gastos_categoria, current_user.score_actual)
+
+    metricas = []
+    for metrica, bordes in BORDES_BENCHMARK.items():
+        conteos = np.array(elegido["metricas"].get(metrica, []), dtype=float)
+        if conteos.sum() < BENCHMARK_MIN_COHORTE:
+            continue
+        valor = valores[metrica]
+        metricas.append(MetricaBenchmark(
+            metrica=metrica,
+            valor=round(valor, 2) if valor is not None else None,
+            percentil=round(percentil_en_histograma(conteos, bordes, valor), 1) if valor is not None else None,
+            p25=round(cuantil_de_histograma(conteos, bordes, 0.25), 2),
+            mediana=round(cuantil_de_histograma(conteos, bordes, 0.5), 2),
+            p75=round(cuantil_de_histograma(conteos, bordes, 0.75), 2),
+            muestras=int(conteos.sum())
+        ))
+
+    return BenchmarkPares(
+        cohorte=elegido["cohorte"],
+        tamano_cohorte=elegido["n"],
+        generado_at=elegido["generado_at"],
+        metricas=metricas
+    )
+
+
+# Ledger de movimientos: un bucket por usuario y mes con las ocurrencias fechadas
+MAX_MESES_LEDGER = 120
+
+def parse_mes(valor: str, campo: str) -> date:
+    try:
+        return datetime.strptime(valor, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{campo} debe tener el formato YYYY-MM")
+
+def resolver_rango_meses(desde: Optional[str], hasta: Optional[str]) -> tuple:
+    """Primer día de los meses inicial y final; sin hasta, el rango llega al mes en curso"""
+    inicio = parse_mes(desde or hasta, "desde")
+    fin = parse_mes(hasta, "hasta") if hasta else date.today().replace(day=1)
+    if inicio > fin:
+        raise HTTPException(status_code=400, detail="desde no puede ser posterior a hasta")
+    if (fin.year - inicio.year) * 12 + fin.month - inicio.month >= MAX_MESES_LEDGER:
+        raise HTTPException(status_code=400, detail=f"El rango no puede superar {MAX_MESES_LEDGER} meses")
+    return inicio, fin
+
+def iter_meses(desde: date, hasta: date):
+    anio, mes = desde.year, desde.month
+    while (anio, mes) <= (hasta.year, hasta.month):
+        yield anio, mes
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+
+def fin_de_mes(anio: int, mes: int) -> date:
+    return date(anio, mes, calendar.monthrange(anio, mes)[1])
+
+def fechas_ocurrencia(frecuencia: str, inicio: date, desde: date, hasta: date) -> List[date]:
+    """Fechas en que ocurre un movimiento recurrente dentro de [desde, hasta], a partir de su alta"""
+    if inicio > hasta:
+        return []
+    if frecuencia == "semanal":
+        primera = inicio if inicio >= desde else desde + timedelta(days=-(desde - inicio).days % 7)
+        return [primera + timedelta(days=7 * k) for k in range((hasta - primera).days // 7 + 1)]
+    
+    fechas = []
+    for anio, mes in iter_meses(desde, hasta):
+        ultimo = fin_de_mes(anio, mes)
+        if frecuencia == "quincenal":
+            candidatas = [date(anio, mes, 15), ultimo]
+        elif frecuencia == "anual":
+            candidatas = [date(anio, mes, min(inicio.day, ultimo.day))] if mes == inicio.month else []
+        else:  # mensual y frecuencias desconocidas, como en convertir_a_mensual
+            candidatas = [date(anio, mes, min(inicio.day, ultimo.day))]
+        fechas.extend(f for f in candidatas if inicio <= f and desde <= f <= hasta)
+    return fechas
+
+def fecha_alta(definicion: dict) -> date:
+    creado = definicion.get("created_at")
+    if isinstance(creado, str):
+        creado = datetime.fromisoformat(creado.replace('Z', '+00:00'))
+    return creado.date() if creado else date.min
+
+def expandir_movimientos(ingresos: List[dict], gastos: List[dict], desde: date, hasta: date) -> Dict[str, List[dict]]:
+    """Expande las definiciones recurrentes en movimientos fechados, agrupados por mes YYYY-MM"""
+    por_mes = {f"{anio:04d}-{mes:02d}": [] for anio, mes in iter_meses(desde, hasta)}
+    for tipo, definiciones in (("ingreso", ingresos), ("gasto", gastos)):
+        for definicion in definiciones:
+            for fecha in fechas_ocurrencia(definicion["frecuencia"], fecha_alta(definicion), desde, hasta):
+                por_mes[fecha.strftime("%Y-%m")].append({
+                    "dia": fecha.day,
+                    "tipo": tipo,
+                    "monto_centimos": a_centimos(definicion["monto"]),
+                    "origen": definicion["id"]
+                })
+    for movimientos in por_mes.values():
+        movimientos.sort(key=lambda m: m["dia"])
+    return por_mes
+
+async def sincronizar_ledger(user_id: str, meses: List[str]) -> Dict[str, dict]:
+    """Devuelve los buckets de los meses pedidos, regenerando los que faltan o quedaron viejos.
+
+    Un bucket abierto se regenera cuando cambia data_version. Los meses ya
+    terminados se cierran y no vuelven a cambiar, así el historial conserva los
+    movimientos de definiciones que luego se eliminaron.
+    """
+    data_version = await get_data_version(user_id)
+    mes_actual = datetime.now(timezone.utc).strftime("%Y-%m")
+    buckets = {
+        bucket["mes"]: bucket
+        async for bucket in db.movimientos.find(
+            {"user_id": user_id, "mes": {"$gte": meses[0], "$lte": meses[-1]}},
+            {"_id": 0, "movimientos": 0}
+        )
+    }
+    pendientes = [
+        mes for mes in meses
+        if mes not in buckets
+        or "ingresos_centimos" not in buckets[mes]
+        or (not buckets[mes]["cerrado"] and buckets[mes]["data_version"] != data_version)
+    ]
+    por_cerrar = [mes for mes in meses if mes not in pendientes and not buckets[mes]["cerrado"] and mes < mes_actual]
+    
+    if pendientes:
+        campos = ["id", "monto", "frecuencia", "created_at"]
+        ingresos = [
+            decodificar_documento("ingresos", doc)
+            async for doc in db.ingresos.find({"user_id": user_id, "activo": True}, proyeccion_codificada("ingresos", campos))
+        ]
+        gastos = [
+            decodificar_documento("gastos", doc)
+            async for doc in db.gastos.find({"user_id": user_id, "activo": True}, proyeccion_codificada("gastos", campos))
+        ]
+        ultimo = parse_mes(pendientes[-1], "hasta")
+        movimientos = expandir_movimientos(ingresos, gastos, parse_mes(pendientes[0], "desde"), fin_de_mes(ultimo.year, ultimo.month))
+        operaciones = []
+        for mes in pendientes:
+            del_mes = movimientos[mes]
+            bucket = {
+                "user_id": user_id,
+                "mes": mes,
+                "ingresos_centimos": sum(m["monto_centimos"] for m in del_mes if m["tipo"] == "ingreso"),
+                "gastos_centimos": sum(m["monto_centimos"] for m in del_mes if m["tipo"] == "gasto"),
+                "cantidad": len(del_mes),
+                "data_version": data_version,
+                "cerrado": mes < mes_actual
+            }
+            operaciones.append(ReplaceOne({"user_id": user_id, "mes": mes}, {**bucket, "movimientos": del_mes}, upsert=True))
+            buckets[mes] = bucket
+        await db.movimientos.bulk_write(operaciones, ordered=False)
+    
+    if por_cerrar:
+        await db.movimientos.update_many({"user_id": user_id, "mes": {"$in": por_cerrar}}, {"$set": {"cerrado": True}})
+    return buckets
+
+async def calcular_flujo_historico(user_id: str, inicio: date, fin: date) -> FlujoDinero:
+    """Flujo real por mes a partir del ledger de movimientos, para un rango ya resuelto"""
+    meses = [f"{anio:04d}-{mes:02d}" for anio, mes in iter_meses(inicio, fin)]
+    
+    buckets = await sincronizar_ledger(user_id, meses)
+    detalle = [
+        FlujoMensual(
+            mes=mes,
+            ingresos=buckets[mes]["ingresos_centimos"] / 100,
+            gastos=buckets[mes]["gastos_centimos"] / 100,
+            flujo_neto=(buckets[mes]["ingresos_centimos"] - buckets[mes]["gastos_centimos"]) / 100,
+            movimientos=buckets[mes]["cantidad"]
+        ) for mes in meses
+    ]
+    ingresos_totales = sum(m.ingresos for m in detalle)
+    gastos_totales = sum(m.gastos for m in detalle)
+    flujo_neto = ingresos_totales - gastos_totales
+    capacidad_ahorro = max(0, flujo_neto)
+    porcentaje_ahorro = (capacidad_ahorro / ingresos_totales * 100) if ingresos_totales > 0 else 0
+    
+    return FlujoDinero(
+        user_id=user_id,
+        ingresos_totales=round(ingresos_totales, 2),
+        gastos_totales=round(gastos_totales, 2),
+        flujo_neto=round(flujo_neto, 2),
+        capacidad_ahorro=round(capacidad_ahorro, 2),
+        porcentaje_ahorro=round(porcentaje_ahorro, 2),
+        desde=meses[0],
+        hasta=meses[-1],
+        meses=detalle
+    )
+
+
+# Write-behind del historial de simulaciones
+SIMULACIONES_FLUSH_SIZE = int(os.environ.get('SIMULACIONES_FLUSH_SIZE', '100'))
+SIMULACIONES_FLUSH_MS = int(os.environ.get('SIMULACIONES_FLUSH_MS', '500'))
+SIMULACIONES_BUFFER_MAX = int(os.environ.get('SIMULACIONES_BUFFER_MAX', '10000'))
+
+class WriteBehindBuffer:
+    """Acumula documentos en memoria y los inserta en lote con insert_many.
+
+    Se vacía al juntar `flush_size` documentos o cada `flush_ms`. Si la cola
+    está llena, `add` devuelve False y el llamador inserta directamente. Los
+    documentos que Mongo rechaza van a <coleccion>_dead_letter con el error.
+    """
+    def __init__(self, coleccion: str, flush_size: int, flush_ms: int, maxsize: int):
+        self.coleccion = coleccion
+        self.flush_size = flush_size
+        self.flush_interval = flush_ms / 1000
+        self.maxsize = maxsize
+        self.pending: List[dict] = []
+        self.flushing: List[dict] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.buffered = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.overflow = 0
+        self.errors = 0
+        self.duplicates = 0
+        self.dead_lettered = 0
+
+    def add(self, doc: dict) -> bool:
+        if len(self.pending) + len(self.flushing) >= self.maxsize:
+            self.overflow += 1
+            return False
+        self.pending.append(doc)
+        self.buffered += 1
+        if len(self.pending) >= self.flush_size and self.wakeup is not None:
+            self.wakeup.set()
+        return True
+
+    def pendientes(self) -> List[dict]:
+        """Documentos aún no confirmados en Mongo, para leer lo propio escrito en este worker"""
+        return self.flushing + self.pending
+
+    async def flush(self):
+        while self.pending:
+            self.flushing, self.pending = self.pending[:self.flush_size], self.pending[self.flush_size:]
+            rechazados = []
+            try:
+                await db[self.coleccion].insert_many(self.flushing, ordered=False)
+                insertados = len(self.flushing)
+            except BulkWriteError as e:
+                insertados = e.details.get("nInserted", 0)
+                rechazados = await self._rechazados(e.details.get("writeErrors", []))
+            except BaseException:
+                # Se devuelve el lote a la cola para reintentarlo en el próximo ciclo
+                self.pending = self.flushing + self.pending
+                self.flushing = []
+                raise
+            self.flushed += insertados
+            self.flushes += 1
+            self.flushing = []
+            if rechazados:
+                self.errors += 1
+                await self._dead_letter(rechazados)
+
+    async def _rechazados(self, errores: List[dict]) -> List[tuple]:
+        """(documento, error) de los que no quedaron guardados.
+
+        Un reintento de un lote insertado en parte choca con sus propios _id:
+        esos documentos ya están en la colección y no cuentan como rechazados.
+        """
+        fallidos = [(self.flushing[error["index"]], error) for error in errores]
+        guardados = {
+            doc["_id"] async for doc in db[self.coleccion].find({"_id": {"$in": [doc["_id"] for doc, _ in fallidos]}}, {"_id": 1})
+        }
+        self.duplicates += len(guardados)
+        return [(doc, error) for doc, error in fallidos if doc["_id"] not in guardados]
+
+    async def _dead_letter(self, rechazados: List[tuple]):
+        logger.warning(f"{len(rechazados)} documentos rechazados en {self.coleccion}: {[error.get('errmsg') for _, error in rechazados[:3]]}")
+        ahora = datetime.now(timezone.utc)
+        try:
+            await db[f"{self.coleccion}_dead_letter"].insert_many([
+                {"documento": doc, "error": {"code": error.get("code"), "errmsg": error.get("errmsg")}, "rechazado_at": ahora}
+                for doc, error in rechazados
+            ], ordered=False)
+            self.dead_lettered += len(rechazados)
+        except Exception as e:
+            # Último recurso: el documento completo queda en el log para recuperarlo a mano
+            for doc, _ in rechazados:
+                logger.error(f"No se pudo guardar en {self.coleccion}_dead_letter ({e}): {json.dumps(doc, default=str)}")
+
+    async def run(self):
+        # El evento se crea aquí para quedar ligado al loop que ejecuta el worker
+        self.wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"No se pudo vaciar el buffer de {self.coleccion}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self.pending) + len(self.flushing),
+            "maxsize": self.maxsize,
+            "buffered": self.buffered,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "overflow": self.overflow,
+            "errors": self.errors,
+            "duplicates": self.duplicates,
+            "dead_lettered": self.dead_lettered,
+        }
+
+simulaciones_buffer = WriteBehindBuffer("simulaciones", SIMULACIONES_FLUSH_SIZE, SIMULACIONES_FLUSH_MS, SIMULACIONES_BUFFER_MAX)
+
+
 # Routes for Simulación de Crédito
-@api_router.post("/simulacion-credito", response_model=SimulacionCredito)
-async def simular_credito(simulacion: SimulacionCreditoCreate, current_user: User = Depends(get_current_user)):
+@api_router.post("/simulacion-credito", response_model=SimulacionCredito, dependencies=[Depends(rate_limit("simulacion-credito"))])
+async def simular_credito(simulacion: SimulacionCreditoCreate, current_user: TokenUser = Depends(get_current_user)):
     # Obtener flujo de dinero
     flujo_response = await calcular_flujo_dinero(current_user)
     
-    # Tasas de interés por tipo de crédito (anuales)
-    tasas = {
-        "personal": 25.0,
-        "hipotecario": 8.5,
-        "vehicular": 15.0
-    }
-    
-    tasa_interes = tasas.get(simulacion.tipo_credito, 20.0)
+    tasa_interes = TASAS_CREDITO.get(simulacion.tipo_credito, TASA_CREDITO_DEFAULT)
     cuota_mensual = calcular_cuota_mensual(simulacion.monto_solicitado, tasa_interes, simulacion.plazo_meses)
-    total_pagar = cuota_mensual * simulacion.plazo_meses
+    total_pagar = round(cuota_mensual * simulacion.plazo_meses, 2)
     
     # Calcular score crediticio
     score = calcular_score_crediticio(
@@ -552,17 +2413,7 @@ async def simular_credito(simulacion: SimulacionCreditoCreate, current_user: Use
     )
     
     # Determinar aprobación
-    capacidad_pago = flujo_response.flujo_neto * 0.3  # Máximo 30% del flujo neto
-    aprobado = cuota_mensual <= capacidad_pago and score >= 500
-    
-    observaciones = ""
-    if not aprobado:
-        if cuota_mensual > capacidad_pago:
-            observaciones += "Cuota mensual excede capacidad de pago. "
-        if score < 500:
-            observaciones += "Score crediticio insuficiente. "
-    else:
-        observaciones = "Crédito pre-aprobado sujeto a verificación de documentos."
+    aprobado, observaciones = evaluar_aprobacion(cuota_mensual, flujo_response.flujo_neto, score)
     
     simulacion_obj = SimulacionCredito(
         user_id=current_user.id,
@@ -577,41 +2428,309 @@ async def simular_credito(simulacion: SimulacionCreditoCreate, current_user: Use
         observaciones=observaciones
     )
     
-    simulacion_data = prepare_for_mongo(simulacion_obj.dict())
-    await db.simulaciones.insert_one(simulacion_data)
+    simulacion_data = codificar_documento("simulaciones", prepare_for_mongo(simulacion_obj.dict()))
+    if not simulaciones_buffer.add(simulacion_data):
+        # Buffer lleno: se guarda en la misma request
+        await db.simulaciones.insert_one(simulacion_data)
     return simulacion_obj
 
+PLAZO_MAXIMO_MESES = 360
+
+def montos_maximos_aprobables(capacidad_pago: float, tasa_anual: float, plazos: np.ndarray) -> np.ndarray:
+    """Invierte la fórmula de amortización francesa: mayor monto cuya cuota cabe en la capacidad de pago"""
+    if capacidad_pago <= 0:
+        return np.zeros(len(plazos))
+    tasa_mensual = tasa_anual / 100 / 12
+    if tasa_mensual == 0:
+        montos = capacidad_pago * plazos
+    else:
+        factor = (1 + tasa_mensual) ** plazos
+        montos = capacidad_pago * (factor - 1) / (tasa_mensual * factor)
+    montos = np.floor(montos * 100) / 100
+    # calcular_cuota_mensual redondea la cuota: se ajusta al céntimo para que la regla se cumpla exactamente
+    for k, plazo in enumerate(plazos):
+        while montos[k] > 0 and calcular_cuota_mensual(montos[k], tasa_anual, int(plazo)) > capacidad_pago:
+            montos[k] = round(montos[k] - 0.01, 2)
+        while calcular_cuota_mensual(round(montos[k] + 0.01, 2), tasa_anual, int(plazo)) <= capacidad_pago:
+            montos[k] = round(montos[k] + 0.01, 2)
+    return montos
+
+def plazos_minimos_aprobables(capacidad_pago: float, tasa_anual: float, montos: np.ndarray) -> List[Optional[int]]:
+    """Menor plazo en meses cuya cuota cabe en la capacidad de pago (None si no existe)"""
+    if capacidad_pago <= 0:
+        return [None] * len(montos)
+    tasa_mensual = tasa_anual / 100 / 12
+    if tasa_mensual == 0:
+        plazos = np.ceil(montos / capacidad_pago)
+    else:
+        # cuota <= capacidad  <=>  n >= -ln(1 - r*M/capacidad) / ln(1 + r)
+        ratio = tasa_mensual * montos / capacidad_pago
+        with np.errstate(divide="ignore", invalid="ignore"):
+            plazos = np.where(ratio < 1, np.ceil(-np.log1p(-ratio) / np.log1p(tasa_mensual)), np.inf)
+    resultado = []
+    for monto, plazo in zip(montos, plazos):
+        if not np.isfinite(plazo):
+            resultado.append(None)
+            continue
+        plazo = max(int(plazo), 1)
+        while plazo <= PLAZO_MAXIMO_MESES and calcular_cuota_mensual(float(monto), tasa_anual, plazo) > capacidad_pago:
+            plazo += 1
+        resultado.append(plazo if plazo <= PLAZO_MAXIMO_MESES else None)
+    return resultado
+
+@api_router.get("/credito/capacidad", response_model=CapacidadCredito)
+async def calcular_capacidad_credito(
+    plazos: List[int] = Query([12, 24, 36, 48, 60]),
+    montos: List[float] = Query([]),
+    tipo_credito: Optional[str] = None,
+    current_user: TokenUser = Depends(get_current_user)
+):
+    if any(plazo <= 0 or plazo > PLAZO_MAXIMO_MESES for plazo in plazos) or any(monto <= 0 for monto in montos):
+        raise HTTPException(status_code=400, detail="Plazos o montos fuera de rango")
+    
+    flujo = await calcular_flujo_dinero(current_user)
+    score = calcular_score_crediticio(flujo.ingresos_totales, flujo.gastos_totales, current_user.edad, current_user.dependientes)
+    cumple_score = score >= SCORE_MINIMO_APROBACION
+    # Sin score suficiente ningún monto es aprobable
+    capacidad_pago = flujo.flujo_neto * PORCENTAJE_CAPACIDAD_PAGO if cumple_score else 0
+    
+    tipos = [tipo_credito] if tipo_credito else list(TASAS_CREDITO)
+    plazos_array = np.array(plazos, dtype=float)
+    montos_array = np.array(montos, dtype=float)
+    creditos = []
+    for tipo in tipos:
+        tasa = TASAS_CREDITO.get(tipo, TASA_CREDITO_DEFAULT)
+        maximos = montos_maximos_aprobables(capacidad_pago, tasa, plazos_array)
+        minimos = plazos_minimos_aprobables(capacidad_pago, tasa, montos_array)
+        creditos.append(CapacidadTipoCredito(
+            tipo_credito=tipo,
+            tasa_interes=tasa,
+            montos_maximos=[
+                MontoMaximoPlazo(
+                    plazo_meses=plazo,
+                    monto_maximo=float(monto),
+                    cuota_mensual=calcular_cuota_mensual(float(monto), tasa, plazo) if monto > 0 else 0
+                ) for plazo, monto in zip(plazos, maximos)
+            ],
+            plazos_minimos=[
+                PlazoMinimoMonto(
+                    monto=monto,
+                    plazo_minimo=plazo,
+                    cuota_mensual=calcular_cuota_mensual(monto, tasa, plazo) if plazo else None
+                ) for monto, plazo in zip(montos, minimos)
+            ]
+        ))
+    
+    return CapacidadCredito(
+        user_id=current_user.id,
+        flujo_neto=flujo.flujo_neto,
+        capacidad_pago=round(capacidad_pago, 2),
+        score_crediticio=score,
+        cumple_score=cumple_score,
+        creditos=creditos
+    )
+
 @api_router.get("/simulaciones", response_model=List[SimulacionCredito])
-async def get_simulaciones(current_user: User = Depends(get_current_user)):
-    simulaciones = await db.simulaciones.find({"user_id": current_user.id}).to_list(1000)
-    return [SimulacionCredito(**parse_from_mongo(sim)) for sim in simulaciones]
+async def get_simulaciones(incluir_archivo: bool = False, current_user: TokenUser = Depends(get_current_user)):
+    simulaciones = await buscar_con_archivo("simulaciones", {"user_id": current_user.id}, incluir_archivo)
+    # Incluir las simulaciones de este worker que aún esperan en el buffer
+    guardadas = {sim["id"] for sim in simulaciones}
+    simulaciones += [
+        dict(sim) for sim in simulaciones_buffer.pendientes()
+        if sim["user_id"] == current_user.id and sim["id"] not in guardadas
+    ]
+    return [SimulacionCredito(**parse_from_mongo(decodificar_documento("simulaciones", sim))) for sim in simulaciones]
+
+
+# Routes for Proyección de flujo (Monte Carlo)
+INGRESOS_VARIABLES = ("freelance", "inversion")
+PERCENTILES_PROYECCION = (5, 25, 50, 75, 95)
+
+def proyectar_flujo(ingresos: List[dict], gastos: List[dict], params: ProyeccionCreate, semilla: int) -> Dict[str, Any]:
+    """Simula trayectorias mensuales del saldo con NumPy.
+
+    Los ingresos freelance/inversion y los gastos variables se multiplican por un
+    factor lognormal de media 1; el resto se mantiene fijo. Devuelve bandas de
+    percentiles del saldo y, si hay crédito, la probabilidad de no poder pagar la cuota.
+    """
+    rng = np.random.default_rng(semilla)
+    n, meses = params.simulaciones, params.meses
+    
+    ingreso_fijo = sum(convertir_a_mensual(i["monto"], i["frecuencia"]) for i in ingresos if i["tipo"] not in INGRESOS_VARIABLES)
+    ingreso_variable = sum(convertir_a_mensual(i["monto"], i["frecuencia"]) for i in ingresos if i["tipo"] in INGRESOS_VARIABLES)
+    gasto_fijo = sum(convertir_a_mensual(g["monto"], g["frecuencia"]) for g in gastos if g.get("tipo") != "variable")
+    gasto_variable = sum(convertir_a_mensual(g["monto"], g["frecuencia"]) for g in gastos if g.get("tipo") == "variable")
+    
+    def factor_lognormal(sigma: float) -> np.ndarray:
+        if sigma == 0:
+            return np.ones((n, meses))
+        return np.exp(sigma * rng.standard_normal((n, meses)) - sigma ** 2 / 2)
+    
+    flujo = (
+        ingreso_fijo + ingreso_variable * factor_lognormal(params.volatilidad_ingresos)
+        - gasto_fijo - gasto_variable * factor_lognormal(params.volatilidad_gastos)
+    )
+    
+    cuota_mensual = None
+    if params.tipo_credito and params.monto_credito and params.plazo_meses:
+        tasa = TASAS_CREDITO.get(params.tipo_credito, TASA_CREDITO_DEFAULT)
+        cuota_mensual = calcular_cuota_mensual(params.monto_credito, tasa, params.plazo_meses)
+        meses_credito = min(params.plazo_meses, meses)
+        flujo[:, :meses_credito] -= cuota_mensual
+    
+    saldo = params.saldo_inicial + np.cumsum(flujo, axis=1)
+    bandas = np.percentile(saldo, PERCENTILES_PROYECCION, axis=0)
+    
+    resultado = {
+        "flujo_mensual_esperado": round(float(ingreso_fijo + ingreso_variable - gasto_fijo - gasto_variable), 2),
+        "percentiles_saldo": {f"p{p}": np.round(banda, 2).tolist() for p, banda in zip(PERCENTILES_PROYECCION, bandas)},
+        "probabilidad_saldo_negativo": round(float(np.mean(saldo[:, -1] < 0)), 4),
+        "cuota_mensual": cuota_mensual,
+        "probabilidad_impago": None,
+    }
+    if cuota_mensual is not None:
+        # Impago: en algún mes del crédito el saldo no alcanza para cubrir la cuota
+        resultado["probabilidad_impago"] = round(float(np.mean((saldo[:, :meses_credito] < 0).any(axis=1))), 4)
+    return resultado
+
+@api_router.post("/proyeccion", response_model=ProyeccionFlujo, dependencies=[Depends(rate_limit("proyeccion"))])
+async def proyectar_flujo_dinero(params: ProyeccionCreate, current_user: TokenUser = Depends(get_current_user)):
+    ingresos = await listar_activos("ingresos", current_user.id)
+    gastos = await listar_activos("gastos", current_user.id)
+    
+    semilla = params.semilla if params.semilla is not None else int(np.random.SeedSequence().entropy % 2**32)
+    resultado = proyectar_flujo(ingresos, gastos, params, semilla)
+    
+    return ProyeccionFlujo(
+        user_id=current_user.id,
+        meses=params.meses,
+        simulaciones=params.simulaciones,
+        semilla=semilla,
+        **resultado
+    )
+
+
+# Routes for Escenarios (what-if)
+def evaluar_escenarios(ingresos: List[dict], gastos: List[dict], request: EscenariosCreate, edad: int, dependientes: int) -> List[ResultadoEscenario]:
+    """Evalúa todos los escenarios sobre una misma foto de ingresos y gastos, sin escribir nada.
+
+    Cada escenario es una fila de pesos sobre los elementos existentes más montos
+    agregados; los totales salen de un producto matricial.
+    """
+    elementos = ingresos + gastos
+    montos = np.array([convertir_a_mensual(e["monto"], e["frecuencia"]) for e in elementos], dtype=float)
+    es_ingreso = np.arange(len(elementos)) < len(ingresos)
+    categorias = np.array([e["tipo"] for e in ingresos] + [e["categoria"] for e in gastos], dtype=object)
+    indice_por_id = {e["id"]: k for k, e in enumerate(elementos)}
+    
+    escenarios = [Escenario(nombre="actual")] + request.escenarios
+    pesos = np.ones((len(escenarios), len(elementos)))
+    ingresos_agregados = np.zeros(len(escenarios))
+    gastos_agregados = np.zeros(len(escenarios))
+    
+    for fila, escenario in enumerate(escenarios):
+        for cambio in escenario.cambios:
+            if cambio.accion == "escalar_categoria":
+                if cambio.categoria is None or cambio.factor is None:
+                    raise HTTPException(status_code=400, detail=f"Escenario '{escenario.nombre}': escalar_categoria requiere categoria y factor")
+                pesos[fila, categorias == cambio.categoria] *= cambio.factor
+            elif cambio.accion in ("agregar_ingreso", "agregar_gasto"):
+                if cambio.monto is None:
+                    raise HTTPException(status_code=400, detail=f"Escenario '{escenario.nombre}': {cambio.accion} requiere monto")
+                monto_mensual = convertir_a_mensual(cambio.monto, cambio.frecuencia or "mensual")
+                if cambio.accion == "agregar_ingreso":
+                    ingresos_agregados[fila] += monto_mensual
+                else:
+                    gastos_agregados[fila] += monto_mensual
+            elif cambio.accion in ("eliminar", "cambiar_frecuencia"):
+                if cambio.id not in indice_por_id:
+                    raise HTTPException(status_code=400, detail=f"Escenario '{escenario.nombre}': elemento no encontrado")
+                k = indice_por_id[cambio.id]
+                if cambio.accion == "eliminar":
+                    pesos[fila, k] = 0
+                else:
+                    if cambio.frecuencia is None:
+                        raise HTTPException(status_code=400, detail=f"Escenario '{escenario.nombre}': cambiar_frecuencia requiere frecuencia")
+                    pesos[fila, k] *= convertir_a_mensual(1, cambio.frecuencia) / convertir_a_mensual(1, elementos[k]["frecuencia"])
+            else:
+                raise HTTPException(status_code=400, detail=f"Escenario '{escenario.nombre}': acción '{cambio.accion}' no soportada")
+    
+    ingresos_totales = np.round(pesos[:, es_ingreso] @ montos[es_ingreso] + ingresos_agregados, 2)
+    gastos_totales = np.round(pesos[:, ~es_ingreso] @ montos[~es_ingreso] + gastos_agregados, 2)
+    flujo_neto = ingresos_totales - gastos_totales
+    capacidad_ahorro = np.maximum(flujo_neto, 0)
+    porcentaje_ahorro = np.divide(capacidad_ahorro * 100, ingresos_totales, out=np.zeros(len(escenarios)), where=ingresos_totales > 0)
+    
+    cuota_mensual = None
+    if request.tipo_credito and request.monto_credito and request.plazo_meses:
+        tasa = TASAS_CREDITO.get(request.tipo_credito, TASA_CREDITO_DEFAULT)
+        cuota_mensual = calcular_cuota_mensual(request.monto_credito, tasa, request.plazo_meses)
+    
+    tabla = obtener_tabla_impuesto(ANIO_FISCAL_DEFAULT)
+    bases_imponibles = ingresos_totales * 12 - gastos_totales * 12 * PORCENTAJE_GASTOS_DEDUCIBLES
+    impuestos, tramos = calcular_impuestos_vectorizado(bases_imponibles)
+    scores = calcular_scores_vectorizado(ingresos_totales, gastos_totales, edad, dependientes)
+    
+    resultados = []
+    for fila, escenario in enumerate(escenarios):
+        score = int(scores[fila])
+        resultado = ResultadoEscenario(
+            nombre=escenario.nombre,
+            ingresos_totales=float(ingresos_totales[fila]),
+            gastos_totales=float(gastos_totales[fila]),
+            flujo_neto=round(float(flujo_neto[fila]), 2),
+            capacidad_ahorro=round(float(capacidad_ahorro[fila]), 2),
+            porcentaje_ahorro=round(float(porcentaje_ahorro[fila]), 2),
+            diferencia_flujo=round(float(flujo_neto[fila] - flujo_neto[0]), 2),
+            impuesto_renta=round(float(impuestos[fila]), 2),
+            tramo_tributario=tabla["tramos"][tramos[fila]],
+            score_crediticio=score
+        )
+        if cuota_mensual is not None:
+            resultado.cuota_mensual = cuota_mensual
+            resultado.aprobado, resultado.observaciones = evaluar_aprobacion(cuota_mensual, float(flujo_neto[fila]), score)
+        resultados.append(resultado)
+    return resultados
+
+@api_router.post("/escenarios", response_model=List[ResultadoEscenario], dependencies=[Depends(rate_limit("escenarios"))])
+async def evaluar_escenarios_usuario(request: EscenariosCreate, current_user: TokenUser = Depends(get_current_user)):
+    ingresos = await listar_activos("ingresos", current_user.id)
+    gastos = await listar_activos("gastos", current_user.id)
+    return evaluar_escenarios(ingresos, gastos, request, current_user.edad, current_user.dependientes)
 
 
 # Routes for Cálculo Tributario
-@api_router.get("/calculo-tributario")
-async def calcular_tributario(current_user: User = Depends(get_current_user)):
+@api_router.get("/calculo-tributario", dependencies=[Depends(conditional_get("calculo-tributario"))])
+async def calcular_tributario(anio: int = ANIO_FISCAL_DEFAULT, current_user: TokenUser = Depends(get_current_user)):
     # Obtener flujo de dinero
     flujo_response = await calcular_flujo_dinero(current_user)
-    
+    return calculo_tributario_desde_flujo(flujo_response, current_user.id, anio)
+
+@api_router.get("/calculo-tributario/anios", response_model=List[CalculoTributario])
+async def calcular_tributario_anios(anios: List[int] = Query(list(TABLAS_IMPUESTO_RENTA)), current_user: TokenUser = Depends(get_current_user)):
+    flujo_response = await calcular_flujo_dinero(current_user)
+    return [calculo_tributario_desde_flujo(flujo_response, current_user.id, anio) for anio in anios]
+
+def calculo_tributario_desde_flujo(flujo_response: FlujoDinero, user_id: str, anio: int = ANIO_FISCAL_DEFAULT) -> CalculoTributario:
     # Calcular ingresos anuales
     ingresos_anuales = flujo_response.ingresos_totales * 12
     
     # Gastos deducibles (asumimos 20% de los gastos totales como deducibles)
-    gastos_deducibles = (flujo_response.gastos_totales * 12) * 0.2
+    gastos_deducibles = (flujo_response.gastos_totales * 12) * PORCENTAJE_GASTOS_DEDUCIBLES
     
     # Calcular impuesto
-    calculo = calcular_impuesto_renta(ingresos_anuales, gastos_deducibles)
+    calculo = calcular_impuesto_renta(ingresos_anuales, gastos_deducibles, anio)
     
     # Agregar datos del usuario
-    calculo["user_id"] = current_user.id
+    calculo["user_id"] = user_id
     calculo["fecha_calculo"] = datetime.now(timezone.utc)
     
     return CalculoTributario(**calculo)
 
 
 # Routes for Sugerencias
-@api_router.get("/sugerencias", response_model=List[SugerenciaFinanciamiento])
-async def get_sugerencias(current_user: User = Depends(get_current_user)):
+@api_router.get("/sugerencias", response_model=List[SugerenciaFinanciamiento], dependencies=[Depends(conditional_get("sugerencias"))])
+async def get_sugerencias(current_user: TokenUser = Depends(get_current_user)):
     flujo = await calcular_flujo_dinero(current_user)
     sugerencias = []
     
@@ -648,77 +2767,482 @@ async def get_sugerencias(current_user: User = Depends(get_current_user)):
     return sugerencias
 
 
+# Live updates (Server-Sent Events)
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', '8'))
+SSE_MAX_CONNECTIONS_PER_USER = int(os.environ.get('SSE_MAX_CONNECTIONS_PER_USER', '5'))
+# Con varios workers, los cambios se detectan con un change stream de Mongo (requiere replica set)
+SSE_CHANGE_STREAMS = os.environ.get('SSE_CHANGE_STREAMS', 'false').lower() == 'true'
+
+class EventBroker:
+    """Fan-out en memoria de eventos por usuario hacia sus conexiones SSE abiertas.
+
+    Cada conexión tiene una cola acotada; si el cliente no consume, se descarta el
+    evento más antiguo (cada evento trae el estado completo, así que no se pierde nada).
+    """
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, set] = {}
+        self.last_snapshot: Dict[str, Dict[str, float]] = {}
+        self.dropped_events = 0
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[user_id]
+            self.last_snapshot.pop(user_id, None)
+
+    def has_subscribers(self, user_id: str) -> bool:
+        return user_id in self.subscribers
+
+    def connection_count(self, user_id: str) -> int:
+        return len(self.subscribers.get(user_id, ()))
+
+    def _put(self, queue: asyncio.Queue, event):
+        if queue.full():
+            queue.get_nowait()
+            self.dropped_events += 1
+        queue.put_nowait(event)
+
+    def publish(self, user_id: str, event: Dict[str, Any]):
+        for queue in self.subscribers.get(user_id, ()):
+            self._put(queue, event)
+
+    def close(self):
+        """Cierra todos los streams (se usa al apagar el servidor)"""
+        for queues in self.subscribers.values():
+            for queue in queues:
+                self._put(queue, None)
+
+event_broker = EventBroker(SSE_QUEUE_SIZE)
+_background_tasks = set()
+
+def spawn_background(coro):
+    """Lanza una tarea en segundo plano manteniendo una referencia hasta que termine"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def build_flujo_event(user_id: str, data_version: int) -> Dict[str, Any]:
+    """Recalcula flujo e impuesto del usuario y devuelve el evento con las diferencias respecto al último enviado"""
+    flujo = await calcular_flujo_usuario(user_id)
+    impuesto = calculo_tributario_desde_flujo(flujo, user_id)
+    snapshot = {
+        "ingresos_totales": flujo.ingresos_totales,
+        "gastos_totales": flujo.gastos_totales,
+        "flujo_neto": flujo.flujo_neto,
+        "capacidad_ahorro": flujo.capacidad_ahorro,
+        "porcentaje_ahorro": flujo.porcentaje_ahorro,
+        "impuesto_renta": impuesto.impuesto_renta,
+    }
+    anterior = event_broker.last_snapshot.get(user_id, snapshot)
+    event_broker.last_snapshot[user_id] = snapshot
+    return {
+        "event": "flujo",
+        "id": data_version,
+        "data": {
+            "flujo": flujo.dict(),
+            "calculo_tributario": impuesto.dict(),
+            "delta": {key: round(value - anterior[key], 2) for key, value in snapshot.items()},
+        },
+    }
+
+async def publish_flujo_update(user_id: str):
+    if not event_broker.has_subscribers(user_id):
+        return
+    data_version = await get_data_version(user_id)
+    event_broker.publish(user_id, await build_flujo_event(user_id, data_version))
+
+def notify_data_changed(user_id: str):
+    # En modo change stream el aviso llega desde Mongo a todos los workers
+    if not SSE_CHANGE_STREAMS and event_broker.has_subscribers(user_id):
+        spawn_background(publish_flujo_update(user_id))
+
+async def watch_data_changes():
+    """Escucha cambios de data_version en Mongo para avisar a los streams de este worker"""
+    pipeline = [
+        {"$match": {"operationType": "update", "updateDescription.updatedFields.data_version": {"$exists": True}}},
+        {"$project": {"fullDocument.id": 1}},
+    ]
+    while True:
+        try:
+            async with db.users.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    user_id = (change.get("fullDocument") or {}).get("id")
+                    if user_id and event_broker.has_subscribers(user_id):
+                        await publish_flujo_update(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Change stream interrumpido, reintentando: {e}")
+            await asyncio.sleep(5)
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = json.dumps(event["data"], default=lambda o: o.isoformat() if isinstance(o, datetime) else str(o))
+    return f"event: {event['event']}\nid: {event['id']}\ndata: {data}\n\n"
+
+@api_router.get("/stream")
+async def stream_updates(request: Request, token: dict = Depends(get_stream_token)):
+    current_user = token_user_from_payload(token)
+    if event_broker.connection_count(current_user.id) >= SSE_MAX_CONNECTIONS_PER_USER:
+        raise HTTPException(status_code=429, detail="Demasiadas conexiones abiertas")
+    
+    queue = event_broker.subscribe(current_user.id)
+    
+    async def event_generator():
+        try:
+            yield f"retry: {int(SSE_HEARTBEAT_SECONDS * 1000)}\n\n"
+            data_version = await get_data_version(current_user.id)
+            yield format_sse(await build_flujo_event(current_user.id, data_version))
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected() or not token_vigente(token):
+                        break
+                    yield ": ping\n\n"
+                    continue
+                # Un token expirado o revocado (logout) cierra el stream; el cliente
+                # reconecta con el access token renovado
+                if event is None or not token_vigente(token):
+                    break
+                yield format_sse(event)
+        finally:
+            event_broker.unsubscribe(current_user.id, queue)
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # Routes for Reportes SUNAT
-@api_router.post("/reporte-sunat")
-async def generar_reporte_sunat(tipo_reporte: str, periodo: str, current_user: User = Depends(get_current_user)):
-    flujo = await calcular_flujo_dinero(current_user)
-    ingresos = await db.ingresos.find({"user_id": current_user.id, "activo": True}).to_list(1000)
-    gastos = await db.gastos.find({"user_id": current_user.id, "activo": True}).to_list(1000)
+REPORT_CHUNK_SIZE = 64 * 1024
+REPORT_BUCKET = "reportes"
+REPORT_RENDER_WORKERS = int(os.environ.get('REPORT_RENDER_WORKERS', '2'))
+REPORT_RETENTION_DAYS = int(os.environ.get('REPORT_RETENTION_DAYS', '365'))
+REPORT_CLEANUP_SECONDS = float(os.environ.get('REPORT_CLEANUP_SECONDS', '3600'))
+
+# Definidos junto a los renderizadores, que se ejecutan en workers sin este módulo
+SECCIONES_REPORTE = render_reportes.SECCIONES_REPORTE
+filas_resumen = render_reportes.filas_resumen
+
+def secciones_de_reporte(tipo_reporte: str) -> List[str]:
+    if tipo_reporte in SECCIONES_REPORTE:
+        return [tipo_reporte]
+    return ["ingresos", "gastos"]  # completo
+
+async def flujo_reporte(user_id: str) -> FlujoDinero:
+    """Flujo del resumen con una agregación por colección, sin cargar los documentos del detalle"""
+    totales = (await totales_mensuales_por_usuario([user_id], LECTURA_TRANSACCIONAL)).get(user_id, {})
+    return flujo_desde_totales(user_id, totales.get("ingresos_totales", 0.0), totales.get("gastos_totales", 0.0))
+
+async def iter_filas_reporte(user_id: str, seccion: str) -> AsyncIterator[list]:
+    """Recorre el cursor de la sección devolviendo una fila por documento"""
+    campos = SECCIONES_REPORTE[seccion]["campos"]
+    cursor = db[seccion].find({"user_id": user_id, "activo": True}, proyeccion_codificada(seccion, campos))
+    async for doc in cursor:
+        doc = decodificar_documento(seccion, doc)
+        yield [doc.get(campo, "mensual" if campo == "frecuencia" else "") for campo in campos]
+
+class ChunkBuffer:
+    """Destino de csv.writer que acumula filas hasta completar un bloque"""
+    def __init__(self):
+        self.partes = []
+        self.tamano = 0
+
+    def write(self, texto: str):
+        self.partes.append(texto)
+        self.tamano += len(texto)
+
+    def vaciar(self) -> bytes:
+        bloque = "".join(self.partes).encode('utf-8')
+        self.partes = []
+        self.tamano = 0
+        return bloque
+
+async def iter_reporte_csv(user_id: str, tipo_reporte: str, resumen: Dict[str, float], conteo: Optional[Dict[str, int]] = None) -> AsyncIterator[bytes]:
+    """Genera el reporte CSV en bloques UTF-8 mientras recorre los cursores de ingresos y gastos.
+
+    La memoria usada es la de un bloque, sin importar cuántas filas tenga el reporte.
+    Si se pasa `conteo`, al terminar contiene cantidad_ingresos y cantidad_gastos.
+    """
+    buffer = ChunkBuffer()
+    writer = csv.writer(buffer)
+    conteo = conteo if conteo is not None else {}
+    completo = tipo_reporte not in SECCIONES_REPORTE
+    
+    if completo:
+        writer.writerow(["RESUMEN FINANCIERO"])
+        writer.writerows(filas_resumen(resumen))
+    
+    for seccion in secciones_de_reporte(tipo_reporte):
+        if completo:
+            writer.writerow([])
+            writer.writerow([SECCIONES_REPORTE[seccion]["titulo"]])
+        writer.writerow(SECCIONES_REPORTE[seccion]["cabecera"])
+        conteo[f"cantidad_{seccion}"] = 0
+        async for fila in iter_filas_reporte(user_id, seccion):
+            writer.writerow(fila)
+            conteo[f"cantidad_{seccion}"] += 1
+            if buffer.tamano >= REPORT_CHUNK_SIZE:
+                yield buffer.vaciar()
+    
+    if buffer.tamano:
+        yield buffer.vaciar()
+
+# El CSV se genera en streaming; el resto se renderiza completo en el pool de procesos
+FORMATOS_REPORTE = {
+    "csv": {
+        "media_type": "text/csv",
+        "renderizador": None,
+        "disponible": True
+    },
+    "xlsx": {
+        "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "renderizador": render_reportes.renderizar_xlsx,
+        "disponible": render_reportes.openpyxl is not None
+    },
+    "pdf": {
+        "media_type": "application/pdf",
+        "renderizador": render_reportes.renderizar_pdf,
+        "disponible": render_reportes.colors is not None
+    }
+}
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        # Sin fork: copiar un proceso con hilos de Motor/Redis puede dejar al hijo
+        # bloqueado en un lock. El forkserver solo precarga el módulo de renderizado,
+        # así los workers no importan el servidor ni abren conexiones.
+        contexto = multiprocessing.get_context("forkserver")
+        contexto.set_forkserver_preload([render_reportes.__name__])
+        _render_pool = ProcessPoolExecutor(max_workers=REPORT_RENDER_WORKERS, mp_context=contexto)
+    return _render_pool
+
+def validar_formato_reporte(formato: str) -> Dict[str, Any]:
+    config = FORMATOS_REPORTE.get(formato)
+    if config is None:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado. Use: {', '.join(FORMATOS_REPORTE)}")
+    if not config["disponible"]:
+        raise HTTPException(status_code=501, detail=f"El formato {formato} no está disponible en este servidor")
+    return config
+
+async def renderizar_reporte(formato: str, datos: Dict[str, Any], user_id: str) -> tuple:
+    """Carga las filas y renderiza el reporte fuera del event loop. Devuelve (bytes, conteo)"""
+    secciones = {}
+    for seccion in secciones_de_reporte(datos["tipo_reporte"]):
+        secciones[seccion] = [fila async for fila in iter_filas_reporte(user_id, seccion)]
+    loop = asyncio.get_running_loop()
+    contenido = await loop.run_in_executor(get_render_pool(), FORMATOS_REPORTE[formato]["renderizador"], datos, secciones)
+    return contenido, {f"cantidad_{seccion}": len(filas) for seccion, filas in secciones.items()}
+
+def hash_reporte(datos_reporte: Dict[str, Any]) -> str:
+    """Hash de contenido de los datos del reporte, usado como clave de caché del archivo"""
+    serializado = json.dumps(datos_reporte, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+async def iter_bytes(contenido: bytes) -> AsyncIterator[bytes]:
+    for inicio in range(0, len(contenido), REPORT_CHUNK_SIZE):
+        yield contenido[inicio:inicio + REPORT_CHUNK_SIZE]
+
+async def guardar_reporte(nombre_archivo: str, bloques: AsyncIterator[bytes], metadata: Dict[str, Any], comprimir: bool = True) -> Dict[str, Any]:
+    """Guarda el reporte en GridFS bloque a bloque, comprimido con gzip si se pide"""
+    bucket = AsyncIOMotorGridFSBucket(db, bucket_name=REPORT_BUCKET)
+    upload = bucket.open_upload_stream(nombre_archivo, metadata=metadata)
+    compresor = zlib.compressobj(9, zlib.DEFLATED, 31) if comprimir else None
+    sha256 = hashlib.sha256()
+    tamano = 0
+    try:
+        async for bloque in bloques:
+            sha256.update(bloque)
+            tamano += len(bloque)
+            datos = compresor.compress(bloque) if compresor else bloque
+            if datos:
+                await upload.write(datos)
+        if compresor:
+            await upload.write(compresor.flush())
+        await upload.close()
+    except BaseException:
+        await upload.abort()
+        raise
+    return {
+        "archivo_id": upload._id,
+        "sha256": sha256.hexdigest(),
+        "tamano_bytes": tamano,
+        "content_encoding": "gzip" if comprimir else None
+    }
+
+async def iter_archivo_reporte(archivo_id, descomprimir: bool) -> AsyncIterator[bytes]:
+    bucket = AsyncIOMotorGridFSBucket(db, bucket_name=REPORT_BUCKET)
+    grid_out = await bucket.open_download_stream(archivo_id)
+    descompresor = zlib.decompressobj(31) if descomprimir else None
+    while True:
+        bloque = await grid_out.readchunk()
+        if not bloque:
+            break
+        yield descompresor.decompress(bloque) if descompresor else bloque
+    if descompresor:
+        yield descompresor.flush()
+
+def resumen_reporte(flujo: FlujoDinero) -> Dict[str, float]:
+    return {
+        "ingresos_totales": flujo.ingresos_totales,
+        "gastos_totales": flujo.gastos_totales,
+        "flujo_neto": flujo.flujo_neto
+    }
+
+async def eliminar_archivo_reporte(archivo_id):
+    bucket = AsyncIOMotorGridFSBucket(db, bucket_name=REPORT_BUCKET)
+    try:
+        await bucket.delete(archivo_id)
+    except NoFile:
+        pass
+
+def expiracion_reporte() -> datetime:
+    # Fecha nativa (no ISO) para que funcione el índice TTL
+    return datetime.now(timezone.utc) + timedelta(days=REPORT_RETENTION_DAYS)
+
+async def buscar_reporte_existente(filtro: Dict[str, Any]) -> Optional[ReporteSunat]:
+    """Devuelve el reporte ya generado que cumple el filtro y renueva su retención"""
+    reporte = await db.reportes_sunat.find_one_and_update(filtro, {"$set": {"expira_at": expiracion_reporte()}})
+    return ReporteSunat(**parse_from_mongo(reporte)) if reporte else None
+
+@api_router.post("/reporte-sunat", dependencies=[Depends(rate_limit("reporte-sunat"))])
+async def generar_reporte_sunat(tipo_reporte: str, periodo: str, formato: str = "csv", current_user: User = Depends(get_user_record)):
+    config = validar_formato_reporte(formato)
+    clave = {"user_id": current_user.id, "tipo_reporte": tipo_reporte, "periodo": periodo}
+    version_datos = await get_data_version(current_user.id)
     
-    # Generar datos del reporte
+    # Sin cambios en los datos desde el último reporte igual: se devuelve antes de leer nada más
+    existente = await buscar_reporte_existente({**clave, "formato": formato, "datos.version_datos": version_datos})
+    if existente:
+        return existente
+    
+    flujo = await flujo_reporte(current_user.id)
+    
+    # Generar datos del reporte (el detalle va solo en el archivo)
     datos_reporte = {
         "dni": current_user.dni,
         "nombre_completo": f"{current_user.nombre} {current_user.apellido}",
         "periodo": periodo,
         "tipo_reporte": tipo_reporte,
-        "resumen_financiero": {
-            "ingresos_totales": flujo.ingresos_totales,
-            "gastos_totales": flujo.gastos_totales,
-            "flujo_neto": flujo.flujo_neto
-        },
-        "detalle_ingresos": [
-            {
-                "tipo": ing["tipo"],
-                "descripcion": ing["descripcion"],
-                "monto": ing["monto"],
-                "frecuencia": ing["frecuencia"]
-            } for ing in ingresos
-        ],
-        "detalle_gastos": [
-            {
-                "categoria": gasto["categoria"],
-                "descripcion": gasto["descripcion"],
-                "monto": gasto["monto"],
-                "tipo": gasto["tipo"]
-            } for gasto in gastos
-        ]
+        "formato": formato,
+        "version_datos": version_datos,
+        "resumen_financiero": resumen_reporte(flujo)
     }
+    nombre_archivo = f"reporte_{tipo_reporte}_{periodo}_{current_user.dni}.{formato}"
+    hash_contenido = hash_reporte(datos_reporte)
     
-    # Generar archivo CSV
-    archivo_base64 = generar_reporte_csv(datos_reporte, tipo_reporte)
-    nombre_archivo = f"reporte_{tipo_reporte}_{periodo}_{current_user.dni}.csv"
+    metadata = {"user_id": current_user.id, "hash": hash_contenido, "content_type": config["media_type"]}
+    if config["renderizador"] is None:
+        # Generar archivo CSV directamente hacia GridFS
+        conteo = {}
+        archivo = await guardar_reporte(
+            nombre_archivo,
+            iter_reporte_csv(current_user.id, tipo_reporte, datos_reporte["resumen_financiero"], conteo),
+            metadata
+        )
+    else:
+        contenido, conteo = await renderizar_reporte(formato, datos_reporte, current_user.id)
+        archivo = await guardar_reporte(nombre_archivo, iter_bytes(contenido), metadata, comprimir=False)
+    datos_reporte.update(conteo)
     
     reporte_obj = ReporteSunat(
         user_id=current_user.id,
         tipo_reporte=tipo_reporte,
         periodo=periodo,
         datos=datos_reporte,
-        archivo_base64=archivo_base64,
-        nombre_archivo=nombre_archivo
+        nombre_archivo=nombre_archivo,
+        formato=formato
     )
     
     reporte_data = prepare_for_mongo(reporte_obj.dict())
-    await db.reportes_sunat.insert_one(reporte_data)
+    reporte_data.update(archivo)
+    reporte_data["hash"] = hash_contenido
+    reporte_data["content_type"] = config["media_type"]
+    reporte_data["expira_at"] = expiracion_reporte()
+    try:
+        await db.reportes_sunat.insert_one(reporte_data)
+    except DuplicateKeyError:
+        # Otra petición concurrente guardó el mismo reporte primero
+        await eliminar_archivo_reporte(archivo["archivo_id"])
+        existente = await buscar_reporte_existente({**clave, "hash": hash_contenido})
+        if existente:
+            return existente
+        raise
     return reporte_obj
 
+@api_router.get("/reporte-sunat/stream", dependencies=[Depends(rate_limit("reporte-sunat"))])
+async def stream_reporte_sunat(tipo_reporte: str, periodo: str, formato: str = "csv", current_user: User = Depends(get_user_record)):
+    """Descarga directa del reporte sin guardarlo"""
+    config = validar_formato_reporte(formato)
+    flujo = await flujo_reporte(current_user.id)
+    nombre_archivo = f"reporte_{tipo_reporte}_{periodo}_{current_user.dni}.{formato}"
+    headers = {"Content-Disposition": f"attachment; filename={nombre_archivo}"}
+    if config["renderizador"] is None:
+        return StreamingResponse(
+            iter_reporte_csv(current_user.id, tipo_reporte, resumen_reporte(flujo)),
+            media_type=config["media_type"],
+            headers=headers
+        )
+    
+    datos_reporte = {
+        "dni": current_user.dni,
+        "nombre_completo": f"{current_user.nombre} {current_user.apellido}",
+        "periodo": periodo,
+        "tipo_reporte": tipo_reporte,
+        "resumen_financiero": resumen_reporte(flujo)
+    }
+    contenido, _ = await renderizar_reporte(formato, datos_reporte, current_user.id)
+    return Response(content=contenido, media_type=config["media_type"], headers=headers)
+
 @api_router.get("/reportes-sunat", response_model=List[ReporteSunat])
-async def get_reportes_sunat(current_user: User = Depends(get_current_user)):
-    reportes = await db.reportes_sunat.find({"user_id": current_user.id}).to_list(1000)
+async def get_reportes_sunat(incluir_archivo: bool = False, current_user: TokenUser = Depends(get_current_user)):
+    reportes = await buscar_con_archivo("reportes_sunat", {"user_id": current_user.id}, incluir_archivo)
     return [ReporteSunat(**parse_from_mongo(reporte)) for reporte in reportes]
 
 @api_router.get("/reportes-sunat/{reporte_id}/download")
-async def download_reporte(reporte_id: str, current_user: User = Depends(get_current_user)):
-    reporte = await db.reportes_sunat.find_one({"id": reporte_id, "user_id": current_user.id})
+async def download_reporte(reporte_id: str, request: Request, incluir_archivo: bool = False, current_user: TokenUser = Depends(get_current_user)):
+    reporte = await buscar_uno_con_archivo("reportes_sunat", {"id": reporte_id, "user_id": current_user.id}, incluir_archivo)
     if not reporte:
         raise HTTPException(status_code=404, detail="Reporte no encontrado")
     
-    # Decodificar el archivo base64
-    archivo_content = base64.b64decode(reporte["archivo_base64"])
+    headers = {"Content-Disposition": f"attachment; filename={reporte['nombre_archivo']}"}
+    acepta_gzip = accepts_encoding(request.headers.get("accept-encoding", ""), "gzip")
     
+    if reporte.get("archivo_id") is not None:
+        media_type = reporte.get("content_type", "text/csv")
+        if reporte.get("content_encoding", "gzip") != "gzip":
+            return StreamingResponse(iter_archivo_reporte(reporte["archivo_id"], descomprimir=False), media_type=media_type, headers=headers)
+        # Servir el archivo precomprimido sin recomprimir
+        headers["Vary"] = "Accept-Encoding"
+        if acepta_gzip:
+            headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(
+            iter_archivo_reporte(reporte["archivo_id"], descomprimir=not acepta_gzip),
+            media_type=media_type,
+            headers=headers
+        )
+    
+    # Reportes antiguos guardados en base64
     return Response(
-        content=archivo_content,
+        content=base64.b64decode(reporte["archivo_base64"]),
         media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={reporte['nombre_archivo']}"}
+        headers=headers
     )
 
 
@@ -740,6 +3264,27 @@ async def health_check():
         }
     }
 
+# Debug endpoint with in-process cache and runtime metrics
+@app.get("/debug/metrics")
+async def debug_metrics():
+    return {
+        "token_cache": token_cache.stats(),
+        "revoked_tokens": len(revocation_cache.revoked),
+        "rate_limit": rate_limiter.stats(),
+        "singleflight": cache.cargas_en_curso.stats(),
+        "cache": cache.stats(),
+        "read_routing": {
+            "analytics_read_preference": ANALYTICS_READ_PREFERENCE,
+            "analytics_max_staleness_seconds": ANALYTICS_MAX_STALENESS_SECONDS,
+        },
+        "simulaciones_buffer": simulaciones_buffer.stats(),
+        "sse": {
+            "users": len(event_broker.subscribers),
+            "connections": sum(len(queues) for queues in event_broker.subscribers.values()),
+            "dropped_events": event_broker.dropped_events,
+        },
+    }
+
 # Debug endpoint to see database collections and counts
 @app.get("/debug/db")
 async def debug_database():
@@ -751,7 +3296,7 @@ async def debug_database():
         await db.admin.command('ping')
         
         # Get database stats
-        stats = await db.command("dbStats")
+        stats = await db.command("dbStats", read_preference=preferencia_lectura(LECTURA_ANALITICA))
         
         # Try to get collections with error handling
         try:
@@ -782,7 +3327,7 @@ async def debug_database():
         # Try to count users specifically
         try:
             if "users" in collections:
-                users_count = await db.users.count_documents({})
+                users_count = await coleccion_lectura("users", LECTURA_ANALITICA).count_documents({})
                 result["users_count"] = users_count
             else:
                 result["users_count"] = 0
@@ -803,12 +3348,15 @@ async def debug_database():
 async def root():
     return {"message": "API de Finanzas Personales funcionando correctamente"}
 
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -818,6 +3366,141 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    if db is None:
+        return
+    await db.revoked_tokens.create_index("jti", unique=True)
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.users.create_index("id", unique=True)
+    await db.users.create_index("busqueda")
+    for orden in ORDENES_ADMIN_USERS:
+        await db.users.create_index([(orden, 1), ("id", 1)])
+    await db.users.create_index([("ocupacion", 1), ("created_at", 1), ("id", 1)])
+    await db.users.create_index([("estado_civil", 1), ("created_at", 1), ("id", 1)])
+    await db.simulaciones.create_index([("user_id", 1), ("created_at", -1)])
+    await db.ingresos.create_index([("user_id", 1), ("activo", 1)])
+    await db.gastos.create_index([("user_id", 1), ("activo", 1)])
+    await db.scores_historial.create_index([("user_id", 1), ("run_id", 1)], unique=True)
+    await db.scores_historial.create_index([("user_id", 1), ("calculado_at", -1)])
+    # Un reporte por contenido; los reportes antiguos sin hash quedan fuera del índice
+    await db.reportes_sunat.create_index(
+        [("user_id", 1), ("tipo_reporte", 1), ("periodo", 1), ("hash", 1)],
+        unique=True,
+        partialFilterExpression={"hash": {"$exists": True}}
+    )
+    await db.reportes_sunat.create_index([
+        ("user_id", 1), ("tipo_reporte", 1), ("periodo", 1), ("formato", 1), ("datos.version_datos", 1)
+    ])
+    await db.reportes_sunat.create_index("expira_at", expireAfterSeconds=0)
+    await db.reportes_sunat.create_index("archivo_id")
+    await db.movimientos.create_index([("user_id", 1), ("mes", 1)], unique=True)
+    for nombre in ("ingresos", "gastos", "simulaciones", "reportes_sunat"):
+        await coleccion_archivo(nombre).create_index("user_id")
+    # Los reportes archivados siguen venciendo y sus archivos de GridFS se siguen encontrando
+    await coleccion_archivo("reportes_sunat").create_index("expira_at", expireAfterSeconds=0)
+    await coleccion_archivo("reportes_sunat").create_index("archivo_id")
+    if RATE_LIMIT_BACKEND == "mongo":
+        await db.rate_limits.create_index("expira_at", expireAfterSeconds=0)
+
+async def revocation_sync_loop():
+    while True:
+        try:
+            await revocation_cache.sync()
+        except Exception as e:
+            logger.warning(f"No se pudo sincronizar la lista de tokens revocados: {e}")
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+
+@app.on_event("startup")
+async def start_revocation_sync():
+    app.state.revocation_sync_task = None
+    if db is not None:
+        app.state.revocation_sync_task = spawn_background(revocation_sync_loop())
+
+@app.on_event("startup")
+async def start_change_stream():
+    app.state.change_stream_task = None
+    if SSE_CHANGE_STREAMS and db is not None:
+        app.state.change_stream_task = spawn_background(watch_data_changes())
+
+async def limpiar_archivos_reporte() -> int:
+    """Borra de GridFS los archivos cuyo reporte (activo o archivado) ya eliminó el índice TTL"""
+    limite = datetime.now(timezone.utc) - timedelta(seconds=REPORT_CLEANUP_SECONDS)
+    # Solo archivos con cierta antigüedad, para no tocar uno que aún se está guardando
+    candidatos = {
+        archivo["_id"]
+        async for archivo in db[f"{REPORT_BUCKET}.files"].find({"uploadDate": {"$lt": limite}}, {"_id": 1})
+    }
+    if not candidatos:
+        return 0
+    # Referencias leídas después de listar los candidatos: un reporte ya guardado siempre aparece
+    referenciados = set()
+    for coleccion in (db.reportes_sunat, coleccion_archivo("reportes_sunat")):
+        referenciados.update(await coleccion.distinct("archivo_id", {"archivo_id": {"$ne": None}}))
+    huerfanos = candidatos - referenciados
+    for archivo_id in huerfanos:
+        await eliminar_archivo_reporte(archivo_id)
+    return len(huerfanos)
+
+async def report_cleanup_loop():
+    while True:
+        try:
+            eliminados = await limpiar_archivos_reporte()
+            if eliminados:
+                logger.info(f"Archivos de reportes vencidos eliminados: {eliminados}")
+        except Exception as e:
+            logger.warning(f"No se pudo limpiar los archivos de reportes: {e}")
+        await asyncio.sleep(REPORT_CLEANUP_SECONDS)
+
+@app.on_event("startup")
+async def start_report_cleanup():
+    app.state.report_cleanup_task = None
+    if db is not None:
+        app.state.report_cleanup_task = spawn_background(report_cleanup_loop())
+
+async def completar_busqueda_usuarios():
+    """Calcula el campo busqueda de los usuarios creados antes de que existiera"""
+    async for user in db.users.find({"busqueda": {"$exists": False}}, {"_id": 1, "nombre": 1, "apellido": 1, "email": 1, "dni": 1}):
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"busqueda": terminos_busqueda(user)}})
+
+@app.on_event("startup")
+async def start_busqueda_backfill():
+    if db is not None:
+        spawn_background(completar_busqueda_usuarios())
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    app.state.cache_invalidation_task = None
+    if cache.redis is not None:
+        app.state.cache_invalidation_task = spawn_background(cache.escuchar_invalidaciones())
+
+@app.on_event("startup")
+async def start_simulaciones_buffer():
+    app.state.simulaciones_flush_task = None
+    if db is not None:
+        app.state.simulaciones_flush_task = spawn_background(simulaciones_buffer.run())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    global _render_pool
+    event_broker.close()
+    for task in (app.state.change_stream_task, app.state.revocation_sync_task, app.state.report_cleanup_task, app.state.cache_invalidation_task):
+        if task is not None:
+            task.cancel()
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+    if app.state.simulaciones_flush_task is not None:
+        app.state.simulaciones_flush_task.cancel()
+        try:
+            await app.state.simulaciones_flush_task
+        except asyncio.CancelledError:
+            pass
+        # Guardar lo que quede en el buffer antes de cerrar la conexión
+        try:
+            await simulaciones_buffer.flush()
+        except Exception as e:
+            logger.error(f"Simulaciones sin guardar al cerrar: {simulaciones_buffer.stats()['pending']} ({e})")
+    if cache.redis is not None:
+        await cache.redis.aclose()
     client.close()
\ No newline at end of file
@@ -0,0 +1,30 @@
+# Exporta users, ingresos, gastos y simulaciones a Parquet particionado por mes
+#
+#   python export_parquet.py [--colecciones ingresos gastos] [--destino ./exports]
+import sys
+import os
+import argparse
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("export_parquet")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.server import db, exportar_colecciones, COLUMNAS_EXPORTACION, EXPORT_DIR
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta las colecciones de Mongo a Parquet")
+    parser.add_argument("--colecciones", nargs="+", default=list(COLUMNAS_EXPORTACION), choices=list(COLUMNAS_EXPORTACION))
+    parser.add_argument("--destino", type=Path, default=EXPORT_DIR)
+    args = parser.parse_args()
+
+    if db is None:
+        raise SystemExit("MONGO_URL no configurado")
+    manifiesto = asyncio.run(exportar_colecciones(args.colecciones, args.destino))
+    logger.info(json.dumps(manifiesto, indent=2))
@@ -59,6 +59,33 @@ const AuthProvider = ({ children }) => {
     }
   }, [token]);
 
+  // Renovar el access token (corta duración) con el refresh token al recibir 401
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refresh_token');
+        if (error.response?.status !== 401 || !refreshToken || original._retry || original.url?.endsWith('/refresh')) {
+          return Promise.reject(error);
+        }
+        original._retry = true;
+        try {
+          const response = await axios.post(`${API}/refresh`, { refresh_token: refreshToken });
+          localStorage.setItem('token', response.data.access_token);
+          localStorage.setItem('refresh_token', response.data.refresh_token);
+          axios.defaults.headers.common['Authorization'] = `Bearer ${response.data.access_token}`;
+          original.headers['Authorization'] = `Bearer ${response.data.access_token}`;
+          setToken(response.data.access_token);
+          return axios(original);
+        } catch (refreshError) {
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   const fetchCurrentUser = async () => {
     try {
       const response = await axios.get(`${API}/me`);
@@ -70,22 +97,30 @@ const AuthProvider = ({ children }) => {
     }
   };
 
-  const login = (userData, accessToken) => {
+  const login = (userData, accessToken, refreshToken) => {
     setUser(userData);
     setToken(accessToken);
     localStorage.setItem('token', accessToken);
+    if (refreshToken) {
+      localStorage.setItem('refresh_token', refreshToken);
+    }
     axios.defaults.headers.common['Authorization'] = `Bearer ${accessToken}`;
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (axios.defaults.headers.common['Authorization']) {
+      axios.post(`${API}/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
     setUser(null);
     setToken(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     delete axios.defaults.headers.common['Authorization'];
   };
 
   return (
-    <AuthContext.Provider value={{ user, login, logout, loading }}>
+    <AuthContext.Provider value={{ user, token, login, logout, loading }}>
       {children}
     </AuthContext.Provider>
   );
@@ -137,7 +172,7 @@ const LoginForm = () => {
         });
       }
 
-      login(response.data.user, response.data.access_token);
+      login(response.data.user, response.data.access_token, response.data.refresh_token);
       toast.success(isLogin ? 'Bienvenido' : 'Cuenta creada exitosamente');
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Error en la autenticación');
@@ -363,7 +398,7 @@ const Header = () => {
 
 // Dashboard principal
 const Dashboard = () => {
-  const { user } = useAuth();
+  const { user, token } = useAuth();
   const [flujoDinero, setFlujoDinero] = useState(null);
   const [ingresos, setIngresos] = useState([]);
   const [gastos, setGastos] = useState([]);
@@ -382,6 +417,26 @@ const Dashboard = () => {
     }
   }, [user]);
 
+  // Actualizaciones en vivo de flujo e impuesto (SSE)
+  // Se reabre con cada access token nuevo: el servidor cierra el stream cuando el token expira
+  useEffect(() => {
+    if (!user || !token || typeof EventSource === 'undefined') return;
+
+    const source = new EventSource(`${API}/stream?token=${encodeURIComponent(token)}`);
+    source.addEventListener('flujo', (event) => {
+      const data = JSON.parse(event.data);
+      setFlujoDinero(data.flujo);
+      setCalculoTributario(data.calculo_tributario);
+    });
+    source.onerror = () => {
+      // Reconexión rechazada (401): una petición normal dispara la renovación del token
+      if (source.readyState === EventSource.CLOSED) {
+        axios.get(`${API}/me`).catch(() => {});
+      }
+    };
+    return () => source.close();
+  }, [user, token]);
+
   const fetchFlujoDinero = async () => {
     try {
       const response = await axios.get(`${API}/flujo-dinero`);
@@ -1204,6 +1259,7 @@ const SugerenciasSection = ({ sugerencias }) => {
 const ReportesSection = () => {
   const [reportes, setReportes] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [formato, setFormato] = useState('csv');
 
   useEffect(() => {
     fetchReportes();
@@ -1222,7 +1278,7 @@ const ReportesSection = () => {
     setLoading(true);
     try {
       await axios.post(`${API}/reporte-sunat`, null, {
-        params: { tipo_reporte: tipo, periodo }
+        params: { tipo_reporte: tipo, periodo, formato }
       });
       toast.success('Reporte generado exitosamente');
       fetchReportes();
@@ -1267,6 +1323,20 @@ const ReportesSection = () => {
         </CardDescription>
       </CardHeader>
       <CardContent className="space-y-6">
+        <div className="space-y-2 max-w-xs">
+          <Label>Formato</Label>
+          <Select value={formato} onValueChange={setFormato}>
+            <SelectTrigger>
+              <SelectValue />
+            </SelectTrigger>
+            <SelectContent>
+              <SelectItem value="csv">CSV</SelectItem>
+              <SelectItem value="xlsx">Excel (XLSX)</SelectItem>
+              <SelectItem value="pdf">PDF</SelectItem>
+            </SelectContent>
+          </Select>
+        </div>
+
         <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
           <Button 
             onClick={() => generateReport('ingresos', '2024')} 
@@ -1315,7 +1385,7 @@ const ReportesSection = () => {
                     className="bg-sky-600 hover:bg-sky-700"
                   >
                     <Download className="w-4 h-4 mr-2" />
-                    Descargar CSV
+                    Descargar {(reporte.formato || 'csv').toUpperCase()}
                   </Button>
                 </div>
               </CardContent>
@@ -1335,17 +1405,23 @@ const AdminSection = () => {
   const [users, setUsers] = useState([]);
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [busqueda, setBusqueda] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchUsers();
     fetchStats();
   }, []);
 
-  const fetchUsers = async () => {
+  const fetchUsers = async (cursor = null) => {
     setLoading(true);
     try {
-      const response = await axios.get(`${API}/admin/users`);
-      setUsers(response.data);
+      const params = { resumen: true, limite: 50 };
+      if (busqueda) params.q = busqueda;
+      if (cursor) params.cursor = cursor;
+      const response = await axios.get(`${API}/admin/users`, { params });
+      setUsers(cursor ? [...users, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Error al cargar usuarios');
     } finally {
@@ -1415,7 +1491,18 @@ const AdminSection = () => {
           </CardTitle>
         </CardHeader>
         <CardContent>
-          {loading ? (
+          <form
+            className="flex gap-2 mb-4"
+            onSubmit={(e) => { e.preventDefault(); fetchUsers(); }}
+          >
+            <Input
+              placeholder="Buscar por nombre, email o DNI"
+              value={busqueda}
+              onChange={(e) => setBusqueda(e.target.value)}
+            />
+            <Button type="submit" className="bg-sky-600 hover:bg-sky-700">Buscar</Button>
+          </form>
+          {loading && users.length === 0 ? (
             <p className="text-center py-8">Cargando usuarios...</p>
           ) : (
             <div className="space-y-3">
@@ -1435,6 +1522,11 @@ const AdminSection = () => {
                         </div>
                         <p className="text-sm text-slate-600">{user.email}</p>
                         <p className="text-xs text-slate-500">DNI: {user.dni} | Ocupación: {user.ocupacion}</p>
+                        {user.resumen && (
+                          <p className="text-xs text-slate-500">
+                            Flujo neto: S/ {user.resumen.flujo_neto.toLocaleString()} | {user.resumen.cantidad_ingresos} ingresos, {user.resumen.cantidad_gastos} gastos
+                          </p>
+                        )}
                       </div>
                       <div className="text-right">
                         <p className="text-sm text-slate-600">Registrado</p>
@@ -1449,6 +1541,11 @@ const AdminSection = () => {
               {users.length === 0 && (
                 <p className="text-center text-slate-500 py-8">No hay usuarios registrados</p>
               )}
+              {nextCursor && (
+                <Button variant="outline" className="w-full" disabled={loading} onClick={() => fetchUsers(nextCursor)}>
+                  {loading ? 'Cargando...' : 'Cargar más'}
+                </Button>
+              )}
             </div>
           )}
         </CardContent>
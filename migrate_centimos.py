@@ -0,0 +1,111 @@
+# Migración: montos a céntimos enteros y enumeraciones a códigos
+#
+#   python migrate_centimos.py [--batch-size 1000] [--dry-run]
+#
+# Convierte ingresos, gastos y simulaciones al formato que escribe
+# codificar_documento (monto -> monto_centimos, categoria/frecuencia/tipo ->
+# código) y los buckets de movimientos a céntimos. Solo toca documentos que aún
+# están en el formato anterior, así que se puede interrumpir y repetir. El
+# servidor lee ambos formatos: primero se despliega el código y luego se migra.
+# Los montos nulos o no numéricos se dejan como están.
+import sys
+import os
+import argparse
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from pymongo import UpdateOne
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("migrate_centimos")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.server import db, CODIFICACION_MONGO, codificar_documento, a_centimos
+
+
+def filtro_sin_migrar(coleccion: str) -> dict:
+    config = CODIFICACION_MONGO[coleccion]
+    condiciones = [{campo: {"$type": "number"}} for campo in config["montos"]]
+    condiciones += [{campo: {"$in": list(valores)}} for campo, valores in config["codigos"].items()]
+    return {"$or": condiciones}
+
+
+def actualizacion(coleccion: str, doc: dict) -> Optional[UpdateOne]:
+    """UpdateOne que migra el documento, o None si no hay nada que cambiar"""
+    config = CODIFICACION_MONGO[coleccion]
+    originales = {campo: doc[campo] for campo in config["montos"] if isinstance(doc.get(campo), (int, float))}
+    originales.update({campo: doc[campo] for campo in config["codigos"] if campo in doc})
+    nuevos = codificar_documento(coleccion, dict(originales))
+    asignar = {campo: valor for campo, valor in nuevos.items() if originales.get(campo) != valor}
+    quitar = {campo: "" for campo in config["montos"] if campo in originales}
+    cambios = {}
+    if asignar:
+        cambios["$set"] = asignar
+    if quitar:
+        cambios["$unset"] = quitar
+    return UpdateOne({"_id": doc["_id"]}, cambios) if cambios else None
+
+
+def actualizacion_bucket(bucket: dict) -> UpdateOne:
+    movimientos = [
+        {**{k: v for k, v in m.items() if k != "monto"}, "monto_centimos": a_centimos(m["monto"])}
+        for m in bucket.get("movimientos", [])
+    ]
+    return UpdateOne({"_id": bucket["_id"]}, {
+        "$set": {
+            "ingresos_centimos": a_centimos(bucket.get("ingresos", 0)),
+            "gastos_centimos": a_centimos(bucket.get("gastos", 0)),
+            "movimientos": movimientos
+        },
+        "$unset": {"ingresos": "", "gastos": ""}
+    })
+
+
+async def migrar_coleccion(nombre: str, filtro: dict, construir, batch_size: int, dry_run: bool) -> int:
+    pendientes = await db[nombre].count_documents(filtro)
+    logger.info(f"{nombre}: {pendientes} documentos por migrar")
+    if dry_run or not pendientes:
+        return 0
+
+    migrados = 0
+    inicio = time.perf_counter()
+    while True:
+        # Los documentos migrados dejan de cumplir el filtro: cada vuelta toma los siguientes
+        lote = await db[nombre].find(filtro).limit(batch_size).to_list(batch_size)
+        operaciones = [operacion for operacion in map(construir, lote) if operacion is not None]
+        if not operaciones:
+            break
+        resultado = await db[nombre].bulk_write(operaciones, ordered=False)
+        migrados += resultado.modified_count
+        logger.info(f"{nombre}: {migrados}/{pendientes} ({migrados / (time.perf_counter() - inicio):.0f} docs/s)")
+    return migrados
+
+
+async def migrar(batch_size: int, dry_run: bool):
+    if db is None:
+        raise RuntimeError("MONGO_URL no configurado")
+
+    resumen = {}
+    for coleccion in CODIFICACION_MONGO:
+        resumen[coleccion] = await migrar_coleccion(
+            coleccion, filtro_sin_migrar(coleccion),
+            lambda doc, coleccion=coleccion: actualizacion(coleccion, doc),
+            batch_size, dry_run
+        )
+    resumen["movimientos"] = await migrar_coleccion(
+        "movimientos", {"ingresos_centimos": {"$exists": False}}, actualizacion_bucket, batch_size, dry_run
+    )
+    logger.info(f"Documentos migrados: {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convierte montos a céntimos y enumeraciones a códigos")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar los documentos pendientes")
+    args = parser.parse_args()
+    asyncio.run(migrar(args.batch_size, args.dry_run))
@@ -0,0 +1,158 @@
+# Nightly batch job: recalcula el score crediticio de todos los usuarios
+#
+#   python recompute_scores.py [--chunk-size 500] [--workers 4] [--resume]
+#
+# Recorre los usuarios por id en bloques, agrega su flujo mensual en Mongo,
+# calcula los scores en un pool de procesos y guarda score_actual en users y
+# una entrada por ejecución en scores_historial. El avance se guarda en
+# batch_checkpoints para poder retomar una ejecución interrumpida con --resume.
+import sys
+import os
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("recompute_scores")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.server import db, cache, calcular_score_crediticio, totales_mensuales_por_usuario
+
+JOB_NAME = "recompute_scores"
+
+
+def puntuar_lote(filas):
+    """Se ejecuta en un proceso del pool: filas = [(user_id, ingresos, gastos, edad, dependientes)]"""
+    return [
+        (user_id, calcular_score_crediticio(ingresos, gastos, edad, dependientes))
+        for user_id, ingresos, gastos, edad, dependientes in filas
+    ]
+
+
+def dividir(filas, partes):
+    tamano = max(1, -(-len(filas) // partes))
+    return [filas[i:i + tamano] for i in range(0, len(filas), tamano)]
+
+
+async def leer_checkpoint(resume: bool):
+    checkpoint = await db.batch_checkpoints.find_one({"_id": JOB_NAME})
+    if resume and checkpoint and not checkpoint.get("completado"):
+        logger.info(f"Retomando ejecución {checkpoint['run_id']} después de {checkpoint['ultimo_user_id']}")
+        return checkpoint["run_id"], checkpoint["ultimo_user_id"], checkpoint.get("procesados", 0)
+    return uuid.uuid4().hex, None, 0
+
+
+async def guardar_checkpoint(run_id: str, ultimo_user_id, procesados: int, completado: bool = False):
+    await db.batch_checkpoints.update_one(
+        {"_id": JOB_NAME},
+        {"$set": {
+            "run_id": run_id,
+            "ultimo_user_id": ultimo_user_id,
+            "procesados": procesados,
+            "completado": completado,
+            "updated_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+
+async def procesar_bloque(pool, usuarios, run_id: str, workers: int) -> int:
+    user_ids = [u["id"] for u in usuarios]
+    totales = await totales_mensuales_por_usuario(user_ids)
+    filas = [
+        (
+            u["id"],
+            totales.get(u["id"], {}).get("ingresos_totales", 0.0),
+            totales.get(u["id"], {}).get("gastos_totales", 0.0),
+            u.get("edad", 0),
+            u.get("dependientes", 0)
+        ) for u in usuarios
+    ]
+
+    loop = asyncio.get_running_loop()
+    partes = await asyncio.gather(*[
+        loop.run_in_executor(pool, puntuar_lote, parte) for parte in dividir(filas, workers)
+    ])
+
+    ahora = datetime.now(timezone.utc)
+    updates_usuarios = []
+    updates_historial = []
+    for parte in partes:
+        for user_id, score in parte:
+            updates_usuarios.append(UpdateOne(
+                {"id": user_id},
+                {"$set": {"score_actual": score, "score_actualizado_at": ahora.isoformat()}}
+            ))
+            # Upsert por (user_id, run_id): repetir un bloque al retomar no duplica historial
+            updates_historial.append(UpdateOne(
+                {"user_id": user_id, "run_id": run_id},
+                {"$set": {"score": score, "calculado_at": ahora.isoformat()}},
+                upsert=True
+            ))
+    if updates_usuarios:
+        await db.users.bulk_write(updates_usuarios, ordered=False)
+        await db.scores_historial.bulk_write(updates_historial, ordered=False)
+        # score_actual es parte del registro de usuario que cachean los workers
+        await cache.invalidar(*(f"usuario:{user_id}" for parte in partes for user_id, _ in parte))
+    return len(updates_usuarios)
+
+
+async def recompute_scores(chunk_size: int, workers: int, resume: bool):
+    if db is None:
+        raise RuntimeError("MONGO_URL no configurado")
+
+    run_id, ultimo_user_id, procesados = await leer_checkpoint(resume)
+    pendientes = await db.users.count_documents({"id": {"$gt": ultimo_user_id}} if ultimo_user_id else {})
+    logger.info(f"Ejecución {run_id}: {pendientes} usuarios por procesar")
+
+    inicio = time.perf_counter()
+    procesados_ejecucion = 0
+    # Sin fork: el proceso ya tiene hilos de Motor con I/O en curso (ver get_render_pool)
+    contexto = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as pool:
+        while True:
+            query = {"id": {"$gt": ultimo_user_id}} if ultimo_user_id else {}
+            usuarios = await db.users.find(
+                query, {"_id": 0, "id": 1, "edad": 1, "dependientes": 1}
+            ).sort("id", 1).limit(chunk_size).to_list(chunk_size)
+            if not usuarios:
+                break
+
+            procesados_ejecucion += await procesar_bloque(pool, usuarios, run_id, workers)
+            ultimo_user_id = usuarios[-1]["id"]
+            await guardar_checkpoint(run_id, ultimo_user_id, procesados + procesados_ejecucion)
+
+            transcurrido = time.perf_counter() - inicio
+            logger.info(
+                f"{procesados_ejecucion}/{pendientes} usuarios "
+                f"({procesados_ejecucion / transcurrido:.0f} usuarios/s)"
+            )
+
+    await guardar_checkpoint(run_id, ultimo_user_id, procesados + procesados_ejecucion, completado=True)
+    transcurrido = time.perf_counter() - inicio
+    resumen = {
+        "run_id": run_id,
+        "usuarios": procesados_ejecucion,
+        "segundos": round(transcurrido, 2),
+        "usuarios_por_segundo": round(procesados_ejecucion / transcurrido, 1) if transcurrido else 0
+    }
+    logger.info(f"Scores recalculados: {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula el score crediticio de todos los usuarios")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--resume", action="store_true", help="Retomar la última ejecución incompleta")
+    args = parser.parse_args()
+    asyncio.run(recompute_scores(args.chunk_size, args.workers, args.resume))
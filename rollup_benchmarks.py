@@ -0,0 +1,142 @@
+# Rollup de benchmarks de pares para GET /api/benchmark
+#
+#   python rollup_benchmarks.py [--chunk-size 1000]
+#
+# Agrupa a los usuarios en cohortes (ocupación, banda de edad, dependientes y
+# los niveles más generales que usa el endpoint cuando una cohorte es chica) y
+# guarda en benchmarks, por cohorte, un histograma de bordes fijos de la tasa de
+# ahorro, el gasto mensual por categoría y el score crediticio. Los histogramas
+# de cada bloque de usuarios se suman, así que el trabajo se reparte por bloques
+# y todas las lecturas van a la réplica analítica. Conviene ejecutarlo después
+# de recompute_scores.py para usar los scores del día.
+import sys
+import os
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import ReplaceOne
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("rollup_benchmarks")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.server import (
+    db, coleccion_lectura, LECTURA_ANALITICA, BENCHMARK_MIN_COHORTE, BORDES_BENCHMARK, NIVELES_COHORTE,
+    VERSION_BORDES_BENCHMARK, claves_cohorte, metricas_benchmark, indices_bin,
+    totales_mensuales_por_usuario, gastos_por_categoria_por_usuario
+)
+
+WRITE_BATCH_SIZE = 1000
+
+
+def nueva_cohorte(cohorte: dict) -> dict:
+    return {
+        "cohorte": cohorte,
+        "n": 0,
+        "metricas": {metrica: np.zeros(len(bordes) - 1, dtype=np.int64) for metrica, bordes in BORDES_BENCHMARK.items()}
+    }
+
+
+def acumular(histogramas: dict, usuarios, totales, gastos_categoria):
+    """Suma un bloque de usuarios a los histogramas de todas sus cohortes"""
+    filas = []
+    for u in usuarios:
+        total = totales.get(u["id"])
+        if not total:  # sin ingresos ni gastos activos
+            continue
+        filas.append((
+            claves_cohorte(u.get("ocupacion"), u.get("edad", 0), u.get("dependientes", 0)),
+            metricas_benchmark(total["ingresos_totales"], total["gastos_totales"], gastos_categoria.get(u["id"], {}), u.get("score_actual"))
+        ))
+    if not filas:
+        return 0
+
+    bins = {}
+    for metrica, bordes in BORDES_BENCHMARK.items():
+        valores = np.array([np.nan if m[metrica] is None else m[metrica] for _, m in filas], dtype=float)
+        validos = ~np.isnan(valores)
+        bins[metrica] = (validos, indices_bin(bordes, valores[validos]))
+
+    for nivel in range(len(NIVELES_COHORTE)):
+        claves = [por_nivel[nivel] for por_nivel, _ in filas]
+        etiquetas, inversa = np.unique([clave for clave, _ in claves], return_inverse=True)
+        cohortes = dict(claves)
+        tamanos = np.bincount(inversa, minlength=len(etiquetas))
+        conteos = {}
+        for metrica, (validos, indices) in bins.items():
+            matriz = np.zeros((len(etiquetas), len(BORDES_BENCHMARK[metrica]) - 1), dtype=np.int64)
+            np.add.at(matriz, (inversa[validos], indices), 1)
+            conteos[metrica] = matriz
+        for fila, clave in enumerate(map(str, etiquetas)):
+            if clave not in histogramas:
+                histogramas[clave] = nueva_cohorte(cohortes[clave])
+            acumulado = histogramas[clave]
+            acumulado["n"] += int(tamanos[fila])
+            for metrica, matriz in conteos.items():
+                acumulado["metricas"][metrica] += matriz[fila]
+    return len(filas)
+
+
+async def guardar(histogramas: dict, run_id: str, generado_at: datetime) -> int:
+    # Solo se publican cohortes con tamaño suficiente; el resto queda cubierto por los niveles generales
+    operaciones = [
+        ReplaceOne({"_id": clave}, {
+            "cohorte": acumulado["cohorte"],
+            "n": acumulado["n"],
+            "metricas": {metrica: conteos.tolist() for metrica, conteos in acumulado["metricas"].items()},
+            "version_bordes": VERSION_BORDES_BENCHMARK,
+            "run_id": run_id,
+            "generado_at": generado_at
+        }, upsert=True)
+        for clave, acumulado in histogramas.items() if acumulado["n"] >= BENCHMARK_MIN_COHORTE
+    ]
+    for i in range(0, len(operaciones), WRITE_BATCH_SIZE):
+        await db.benchmarks.bulk_write(operaciones[i:i + WRITE_BATCH_SIZE], ordered=False)
+    # Las cohortes que ya no alcanzan el mínimo (o desaparecieron) no deben seguir sirviéndose
+    await db.benchmarks.delete_many({"run_id": {"$ne": run_id}})
+    return len(operaciones)
+
+
+async def rollup(chunk_size: int):
+    if db is None:
+        raise RuntimeError("MONGO_URL no configurado")
+
+    run_id = uuid.uuid4().hex
+    generado_at = datetime.now(timezone.utc)
+    usuarios_col = coleccion_lectura("users", LECTURA_ANALITICA)
+    proyeccion = {"_id": 0, "id": 1, "ocupacion": 1, "edad": 1, "dependientes": 1, "score_actual": 1}
+    histogramas = {}
+    ultimo_user_id = None
+    procesados = 0
+    inicio = time.perf_counter()
+
+    while True:
+        filtro = {"id": {"$gt": ultimo_user_id}} if ultimo_user_id else {}
+        usuarios = await usuarios_col.find(filtro, proyeccion).sort("id", 1).limit(chunk_size).to_list(chunk_size)
+        if not usuarios:
+            break
+        user_ids = [u["id"] for u in usuarios]
+        totales, gastos_categoria = await asyncio.gather(
+            totales_mensuales_por_usuario(user_ids), gastos_por_categoria_por_usuario(user_ids)
+        )
+        procesados += acumular(histogramas, usuarios, totales, gastos_categoria)
+        ultimo_user_id = user_ids[-1]
+        logger.info(f"{procesados} usuarios con datos, {len(histogramas)} cohortes ({procesados / (time.perf_counter() - inicio):.0f} usuarios/s)")
+
+    publicadas = await guardar(histogramas, run_id, generado_at)
+    logger.info(f"Ejecución {run_id}: {publicadas} de {len(histogramas)} cohortes publicadas")
+    return publicadas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula los histogramas de benchmark por cohorte")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(rollup(args.chunk_size))
@@ -0,0 +1,149 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+from pymongo import MongoClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.monitor_mongo import MonitorMongo  # noqa: E402
+
+
+# Datos de registro válidos; cada prueba cambia solo los campos que le importan
+USUARIO = {
+    "nombre": "Ana", "apellido": "Quispe", "email": "ana@example.com", "telefono": "999888777",
+    "dni": "12345678", "edad": 30, "ocupacion": "Ingeniera", "estado_civil": "soltero",
+    "dependientes": 1, "password": "secreto123",
+}
+
+
+def datos_usuario(**campos) -> dict:
+    return {**USUARIO, **campos}
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def puerto_libre() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mongo_replica_set(tmp_path_factory):
+    """URL de un replica set de un nodo: TEST_MONGO_URL o un mongod local arrancado aquí"""
+    if os.environ.get("TEST_MONGO_URL"):
+        yield os.environ["TEST_MONGO_URL"]
+        return
+
+    mongod = shutil.which("mongod")
+    if mongod is None:
+        pytest.skip("mongod no está instalado (o defina TEST_MONGO_URL)")
+
+    puerto = puerto_libre()
+    proceso = subprocess.Popen(
+        [mongod, "--replSet", "rs0", "--port", str(puerto), "--bind_ip", "127.0.0.1",
+         "--dbpath", str(tmp_path_factory.mktemp("rs0"))],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        directo = MongoClient("127.0.0.1", puerto, directConnection=True, serverSelectionTimeoutMS=20000)
+        directo.admin.command("ping")
+        directo.admin.command("replSetInitiate", {"_id": "rs0", "members": [{"_id": 0, "host": f"127.0.0.1:{puerto}"}]})
+        limite = time.monotonic() + 30
+        while not directo.admin.command("hello").get("isWritablePrimary"):
+            if time.monotonic() > limite:
+                pytest.fail("El replica set no eligió primario")
+            time.sleep(0.2)
+        directo.close()
+        yield f"mongodb://127.0.0.1:{puerto}/?replicaSet=rs0"
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+
+
+@pytest.fixture
+def mongo_en_memoria(monkeypatch):
+    """server.db apuntando a una base nueva de mongomock (sin rate limiting)"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import mongomock.gridfs
+    from backend import server
+
+    mongomock.gridfs.enable_gridfs_integration()
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client[f"test_{uuid.uuid4().hex[:8]}"])
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", False)
+    return server.db
+
+
+@pytest.fixture
+def api(mongo_en_memoria):
+    """App en proceso contra un Mongo en memoria (mongomock), con los procesos de fondo activos"""
+    from fastapi.testclient import TestClient
+    from backend import server
+
+    with TestClient(server.app) as cliente:
+        yield cliente
+
+
+@pytest.fixture
+def registrar(api):
+    """Registra datos_usuario(**campos) y devuelve sus tokens"""
+    def registrar(**campos) -> dict:
+        respuesta = api.post("/api/register", json=datos_usuario(**campos))
+        assert respuesta.status_code == 200, respuesta.text
+        return respuesta.json()
+    return registrar
+
+
+@pytest.fixture
+def headers(registrar):
+    """Authorization del usuario por defecto, recién registrado"""
+    return bearer(registrar()["access_token"])
+
+
+@pytest.fixture
+def mongo_real(mongo_replica_set, monkeypatch):
+    """server.db apuntando a una base temporal del replica set, para lo que mongomock no soporta"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from backend import server
+
+    client = AsyncIOMotorClient(mongo_replica_set)
+    nombre = f"test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client[nombre])
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", False)
+    yield server.db
+    client.close()
+    with MongoClient(mongo_replica_set) as directo:
+        directo.drop_database(nombre)
+
+
+@pytest.fixture
+def api_mongo_real(mongo_real):
+    """Como api, pero contra el replica set"""
+    from fastapi.testclient import TestClient
+    from backend import server
+
+    with TestClient(server.app) as cliente:
+        yield cliente
+
+
+@pytest.fixture
+def monitor_mongo():
+    from backend import server
+
+    monitor = MonitorMongo(tareas_excluidas=server._background_tasks)
+    monitor.instalar()
+    try:
+        yield monitor
+    finally:
+        monitor.desinstalar()
@@ -0,0 +1,163 @@
+"""Monitor de comandos para el stand-in de Mongo (mongomock).
+
+mongomock no publica eventos de pymongo.monitoring, así que se instrumenta su
+Collection: cada operación de nivel superior cuenta como un round trip y se anota
+cuántos documentos examinaría con el índice adecuado (los que cumplen el filtro,
+respetando skip/limit) y cuántos bytes BSON devuelve.
+"""
+import asyncio
+import functools
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import bson
+from mongomock.collection import Collection, Cursor
+from mongomock.command_cursor import CommandCursor
+
+# Operaciones que implican un viaje al servidor
+OPERACIONES = (
+    "find", "find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "count_documents", "estimated_document_count",
+    "distinct", "aggregate", "bulk_write",
+)
+UNA_SOLA = ("find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+            "update_one", "replace_one", "delete_one")
+
+
+@dataclass
+class Operacion:
+    coleccion: str
+    comando: str
+    examinados: int = 0
+    devueltos: int = 0
+    bytes: int = 0
+
+    def __str__(self):
+        return f"{self.coleccion}.{self.comando} examinados={self.examinados} devueltos={self.devueltos} bytes={self.bytes}"
+
+
+@dataclass
+class Medicion:
+    operaciones: List[Operacion] = field(default_factory=list)
+
+    @property
+    def round_trips(self) -> int:
+        return len(self.operaciones)
+
+    @property
+    def examinados(self) -> int:
+        return sum(op.examinados for op in self.operaciones)
+
+    @property
+    def bytes(self) -> int:
+        return sum(op.bytes for op in self.operaciones)
+
+    def detalle(self) -> str:
+        return "\n".join(f"  {op}" for op in self.operaciones)
+
+
+def tamano_bson(doc) -> int:
+    try:
+        return len(bson.encode(doc))
+    except Exception:
+        return len(repr(doc))
+
+
+class MonitorMongo:
+    def __init__(self, tareas_excluidas=()):
+        # Las tareas de fondo (bucles de limpieza, buffers) no cuentan para el endpoint
+        self.tareas_excluidas = tareas_excluidas
+        self.medicion: Optional[Medicion] = None
+        self.profundidad = 0
+        self.originales = {}
+
+    def _registrable(self) -> bool:
+        if self.medicion is None or self.profundidad:
+            return False
+        try:
+            tarea = asyncio.current_task()
+        except RuntimeError:  # hilo del executor (GridFS)
+            tarea = None
+        return tarea is None or tarea not in self.tareas_excluidas
+
+    def _coincidentes(self, coleccion: Collection, filtro) -> int:
+        return len(list(self.originales["find"](coleccion, filtro or {})))
+
+    def _envolver(self, nombre: str):
+        original = getattr(Collection, nombre)
+        self.originales[nombre] = original
+        monitor = self
+
+        @functools.wraps(original)
+        def envoltura(coleccion, *args, **kwargs):
+            if not monitor._registrable():
+                return original(coleccion, *args, **kwargs)
+            op = Operacion(coleccion.name, nombre)
+            monitor.medicion.operaciones.append(op)
+            monitor.profundidad += 1
+            try:
+                if nombre == "aggregate":
+                    pipeline = args[0] if args else kwargs["pipeline"]
+                    primera = pipeline[0] if pipeline else {}
+                    op.examinados = monitor._coincidentes(coleccion, primera.get("$match"))
+                elif nombre not in ("insert_one", "insert_many", "bulk_write", "find", "estimated_document_count"):
+                    filtro = args[0] if args else kwargs.get("filter")
+                    coincidentes = monitor._coincidentes(coleccion, filtro)
+                    op.examinados = min(coincidentes, 1) if nombre in UNA_SOLA else coincidentes
+                resultado = original(coleccion, *args, **kwargs)
+            finally:
+                monitor.profundidad -= 1
+            if isinstance(resultado, (Cursor, CommandCursor)):
+                resultado._operacion = op  # los documentos se cuentan al iterar
+            elif isinstance(resultado, dict):
+                op.devueltos, op.bytes = 1, tamano_bson(resultado)
+            return resultado
+
+        setattr(Collection, nombre, envoltura)
+
+    def _envolver_cursor(self, clase):
+        original = clase.__next__
+        self.originales[clase] = original
+        monitor = self
+
+        def siguiente(cursor):
+            op = getattr(cursor, "_operacion", None)
+            if op is not None and clase is Cursor and not op.examinados and not op.devueltos:
+                monitor.profundidad += 1
+                try:
+                    op.examinados = cursor._skip + len(cursor._compute_results(with_limit_and_skip=True))
+                finally:
+                    monitor.profundidad -= 1
+            doc = original(cursor)
+            if op is not None:
+                op.devueltos += 1
+                op.bytes += tamano_bson(doc)
+            return doc
+
+        clase.__next__ = siguiente
+        clase.next = siguiente
+
+    def instalar(self):
+        for nombre in OPERACIONES:
+            self._envolver(nombre)
+        self._envolver_cursor(Cursor)
+        self._envolver_cursor(CommandCursor)
+
+    def desinstalar(self):
+        for clave, original in self.originales.items():
+            if isinstance(clave, str):
+                setattr(Collection, clave, original)
+            else:
+                clave.__next__ = original
+                clave.next = original
+        self.originales = {}
+
+    @contextmanager
+    def medir(self):
+        self.medicion = Medicion()
+        try:
+            yield self.medicion
+        finally:
+            self.medicion = None
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from tests.conftest import USUARIO, bearer, datos_usuario
+
+ADMIN = datos_usuario(apellido="Torres", email="ana.admin@example.com", dni="20202020", edad=50, is_admin=True)
+USUARIOS = [
+    ("José", "Núñez", "Docente", 28),
+    ("Josefina", "Nuñez Paz", "Docente", 45),
+    ("María", "Josefa", "Abogada", 33),
+    ("Pedro", "Álvarez", "Docente", 61),
+]
+
+
+def registrar_directorio(api) -> dict:
+    """Registra al administrador y a USUARIOS; devuelve los headers del administrador"""
+    headers = bearer(api.post("/api/register", json=ADMIN).json()["access_token"])
+    for k, (nombre, apellido, ocupacion, edad) in enumerate(USUARIOS):
+        api.post("/api/register", json=datos_usuario(
+            nombre=nombre, apellido=apellido, ocupacion=ocupacion, edad=edad,
+            email=f"usuario{k}@example.com", dni=f"3000000{k}"
+        ))
+    return headers
+
+
+@pytest.fixture
+def headers(api):
+    return registrar_directorio(api)
+
+
+def buscar(api, headers, consulta: str) -> list:
+    respuesta = api.get(f"/api/admin/users?{consulta}", headers=headers)
+    assert respuesta.status_code == 200, respuesta.text
+    return [f"{u['nombre']} {u['apellido']}" for u in respuesta.json()]
+
+
+def test_busqueda_por_prefijo_sin_tildes(api, headers):
+    assert buscar(api, headers, "q=jose&orden=edad") == ["José Núñez", "María Josefa", "Josefina Nuñez Paz"]
+    assert buscar(api, headers, "q=NUNEZ jos&orden=edad") == ["José Núñez", "Josefina Nuñez Paz"]
+    assert buscar(api, headers, "q=usuario3") == ["Pedro Álvarez"]
+    assert buscar(api, headers, "q=osefa") == []
+
+
+def test_filtros_y_orden(api, headers):
+    assert buscar(api, headers, "ocupacion=Docente&edad_min=30&orden=edad&descendente=true") == ["Pedro Álvarez", "Josefina Nuñez Paz"]
+    assert api.get("/api/admin/users?orden=password_hash", headers=headers).status_code == 400
+
+
+def test_paginacion_por_cursor(api, headers):
+    vistos = []
+    consulta = "orden=edad&limite=2"
+    while True:
+        respuesta = api.get(f"/api/admin/users?{consulta}", headers=headers)
+        pagina = respuesta.json()
+        assert len(pagina) <= 2
+        vistos += [u["edad"] for u in pagina]
+        cursor = respuesta.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+        consulta = f"orden=edad&limite=2&cursor={cursor}"
+    assert vistos == [28, 33, 45, 50, 61]
+    assert api.get("/api/admin/users?cursor=no-es-un-cursor", headers=headers).status_code == 400
+
+
+def test_solo_administradores(api, headers):
+    token = api.post("/api/login", json={"email": "usuario0@example.com", "password": USUARIO["password"]}).json()["access_token"]
+    assert api.get("/api/admin/users", headers=bearer(token)).status_code == 403
+
+
+def test_resumen_por_usuario(api_mongo_real):
+    # $lookup con localField y pipeline (MongoDB 5.0+) no existe en mongomock
+    api = api_mongo_real
+    headers = registrar_directorio(api)
+    token = api.post("/api/login", json={"email": "usuario2@example.com", "password": USUARIO["password"]}).json()["access_token"]
+    usuario = bearer(token)
+    api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 3000, "frecuencia": "mensual"}, headers=usuario)
+    api.post("/api/gastos", json={"categoria": "vivienda", "descripcion": "Alquiler", "monto": 1200.5, "tipo": "fijo", "frecuencia": "mensual"}, headers=usuario)
+    api.post("/api/gastos", json={"categoria": "ocio", "descripcion": "Cine", "monto": 40, "tipo": "variable", "frecuencia": "semanal"}, headers=usuario)
+    api.post("/api/simulacion-credito", json={"tipo_credito": "personal", "monto_solicitado": 5000, "plazo_meses": 12}, headers=usuario)
+
+    # La simulación llega a Mongo con el siguiente flush del buffer
+    limite = time.monotonic() + 10
+    while (resumen := api.get("/api/admin/users?q=maria&resumen=true", headers=headers).json()[0]["resumen"])["ultima_simulacion"] is None:
+        assert time.monotonic() < limite
+        time.sleep(0.1)
+    assert (resumen["ingresos_mensuales"], resumen["gastos_mensuales"], resumen["flujo_neto"]) == (3000, 1373.7, 1626.3)
+    assert (resumen["cantidad_ingresos"], resumen["cantidad_gastos"]) == (1, 2)
+    assert resumen["ultima_simulacion"]["monto_solicitado"] == 5000
+
+    sin_movimientos = api.get("/api/admin/users?q=pedro&resumen=true", headers=headers).json()[0]["resumen"]
+    assert (sin_movimientos["ingresos_mensuales"], sin_movimientos["cantidad_gastos"], sin_movimientos["ultima_simulacion"]) == (0, 0, None)
+    assert api.get("/api/admin/users?q=pedro", headers=headers).json()[0]["resumen"] is None
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend import server
+
+ANTIGUO = (datetime.now(timezone.utc) - timedelta(days=400)).isoformat()
+
+
+@pytest.fixture
+def archivador(monkeypatch):
+    import archive_cold_data
+
+    monkeypatch.setattr(archive_cold_data, "db", server.db)
+    return lambda: asyncio.run(archive_cold_data.archivar(batch_size=2, dry_run=False))
+
+
+@pytest.fixture
+def usuario(api, headers):
+    for descripcion, activo in (("Sueldo", True), ("Trabajo anterior", False), ("Alquiler cobrado", False)):
+        api.post("/api/ingresos", json={"tipo": "salario", "descripcion": descripcion, "monto": 3000, "frecuencia": "mensual", "activo": activo}, headers=headers)
+    api.post("/api/gastos", json={"categoria": "vivienda", "descripcion": "Alquiler", "monto": 900, "tipo": "fijo", "frecuencia": "mensual"}, headers=headers)
+    reporte = api.post("/api/reporte-sunat?tipo_reporte=completo&periodo=2023", headers=headers).json()
+    user_id = api.get("/api/me", headers=headers).json()["id"]
+
+    async def envejecer():
+        await server.db.ingresos.update_many({}, {"$set": {"created_at": ANTIGUO}})
+        await server.db.gastos.update_many({}, {"$set": {"created_at": ANTIGUO}})
+        await server.db.reportes_sunat.update_many({}, {"$set": {"expira_at": datetime.now(timezone.utc) + timedelta(days=30)}})
+        simulacion = server.SimulacionCredito(
+            user_id=user_id, tipo_credito="personal", monto_solicitado=5000, plazo_meses=12, tasa_interes=0.2,
+            cuota_mensual=463.17, total_pagar=5558.04, score_crediticio=650, aprobado=True, observaciones=""
+        )
+        await server.db.simulaciones.insert_one(server.codificar_documento("simulaciones", {**server.prepare_for_mongo(simulacion.dict()), "created_at": ANTIGUO}))
+
+    asyncio.run(envejecer())
+    return headers, reporte["id"]
+
+
+def test_archiva_solo_los_documentos_frios(api, usuario, archivador):
+    headers, reporte_id = usuario
+    flujo = api.get("/api/flujo-dinero", headers=headers).json()["flujo_neto"]
+    etag = api.get("/api/ingresos", headers=headers).headers["etag"]
+
+    assert archivador() == {"ingresos": 2, "gastos": 0, "simulaciones": 1, "reportes_sunat": 1}
+
+    # Las consultas calientes no cambian de resultado
+    assert api.get("/api/flujo-dinero", headers=headers).json()["flujo_neto"] == flujo
+    respuesta = api.get("/api/ingresos", headers={**headers, "If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert [i["descripcion"] for i in respuesta.json()] == ["Sueldo"]
+    assert len(api.get("/api/gastos", headers=headers).json()) == 1
+    assert api.get("/api/simulaciones", headers=headers).json() == []
+    assert api.get("/api/reportes-sunat", headers=headers).json() == []
+    assert api.get(f"/api/reportes-sunat/{reporte_id}/download", headers=headers).status_code == 404
+
+    # Repetir no mueve nada más
+    assert set(archivador().values()) == {0}
+
+
+def test_archivo_se_lee_con_incluir_archivo(api, usuario, archivador, monkeypatch):
+    headers, reporte_id = usuario
+    archivador()
+
+    ingresos = api.get("/api/ingresos?incluir_archivo=true", headers=headers).json()
+    assert sorted(i["descripcion"] for i in ingresos) == ["Alquiler cobrado", "Sueldo", "Trabajo anterior"]
+    simulaciones = api.get("/api/simulaciones?incluir_archivo=true", headers=headers).json()
+    assert [s["monto_solicitado"] for s in simulaciones] == [5000]
+    assert [r["id"] for r in api.get("/api/reportes-sunat?incluir_archivo=true", headers=headers).json()] == [reporte_id]
+
+    # La limpieza de GridFS no borra el archivo de un reporte archivado
+    monkeypatch.setattr(server, "REPORT_CLEANUP_SECONDS", -60)
+    assert asyncio.run(server.limpiar_archivos_reporte()) == 0
+    descarga = api.get(f"/api/reportes-sunat/{reporte_id}/download?incluir_archivo=true", headers=headers)
+    assert descarga.status_code == 200
+    assert b"Sueldo" in descarga.content
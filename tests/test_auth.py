@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+
+from backend import server
+from tests.conftest import USUARIO, bearer
+
+
+@pytest.fixture
+def tokens(registrar):
+    return registrar()
+
+
+def test_refresh_rota_el_par_de_tokens(api, tokens):
+    nuevo = api.post("/api/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert nuevo.status_code == 200
+    nuevo = nuevo.json()
+    assert nuevo["refresh_token"] != tokens["refresh_token"]
+    assert api.get("/api/me", headers=bearer(nuevo["access_token"])).json()["email"] == USUARIO["email"]
+
+    # Cada refresh token se usa una sola vez
+    assert api.post("/api/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    assert api.post("/api/refresh", json={"refresh_token": nuevo["refresh_token"]}).status_code == 200
+    # Un access token no sirve como refresh token ni al revés
+    assert api.post("/api/refresh", json={"refresh_token": tokens["access_token"]}).status_code == 401
+    assert api.get("/api/me", headers=bearer(nuevo["refresh_token"])).status_code == 401
+
+
+def test_logout_revoca_access_y_refresh(api, tokens):
+    headers = bearer(tokens["access_token"])
+    assert api.post("/api/logout", json={"refresh_token": tokens["refresh_token"]}, headers=headers).status_code == 200
+
+    assert api.get("/api/me", headers=headers).status_code == 401
+    assert api.post("/api/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+    # Otro worker conoce la revocación al sincronizar con la colección
+    otro_worker = server.RevocationCache()
+    asyncio.run(otro_worker.sync())
+    jti = jwt.decode(tokens["access_token"], options={"verify_signature": False})["jti"]
+    assert otro_worker.is_revoked(jti)
+
+
+def test_token_expirado_se_rechaza(api, tokens, monkeypatch):
+    monkeypatch.setattr(server, "ACCESS_TOKEN_MINUTES", -1)
+    vencido = api.post("/api/refresh", json={"refresh_token": tokens["refresh_token"]}).json()["access_token"]
+    assert api.get("/api/me", headers=bearer(vencido)).status_code == 401
+
+
+def test_rotacion_de_claves_por_kid(api, tokens, monkeypatch):
+    monkeypatch.setattr(server, "JWT_KEYS", {**server.JWT_KEYS, "2024": "clave-anterior", "2025": "clave-nueva"})
+    monkeypatch.setattr(server, "JWT_ACTIVE_KID", "2024")
+    anterior = api.post("/api/refresh", json={"refresh_token": tokens["refresh_token"]}).json()
+    assert jwt.get_unverified_header(anterior["access_token"])["kid"] == "2024"
+
+    # Clave nueva activa: los tokens firmados con la anterior siguen valiendo
+    monkeypatch.setattr(server, "JWT_ACTIVE_KID", "2025")
+    assert api.get("/api/me", headers=bearer(anterior["access_token"])).status_code == 200
+    nuevo = api.post("/api/refresh", json={"refresh_token": anterior["refresh_token"]}).json()
+    assert jwt.get_unverified_header(nuevo["access_token"])["kid"] == "2025"
+
+    # Retirada la clave anterior, sus tokens dejan de verificarse
+    monkeypatch.setattr(server, "JWT_KEYS", {"2025": "clave-nueva"})
+    monkeypatch.setattr(server, "token_cache", server.TokenCache(16))
+    assert api.get("/api/me", headers=bearer(anterior["access_token"])).status_code == 401
+    assert api.get("/api/me", headers=bearer(nuevo["access_token"])).status_code == 200
+
+    # Un kid desconocido o una firma con otra clave no pasan
+    claims = jwt.decode(nuevo["access_token"], options={"verify_signature": False})
+    for clave, kid in (("clave-nueva", "1999"), ("otra", "2025")):
+        falso = jwt.encode(claims, clave, algorithm="HS256", headers={"kid": kid})
+        assert api.get("/api/me", headers=bearer(falso)).status_code == 401
+
+
+def test_cache_de_tokens_lru_con_expiracion():
+    cache = server.TokenCache(2)
+    vigente = {"exp": time.time() + 60}
+    cache.put("a", vigente)
+    cache.put("b", vigente)
+    assert cache.get("a") is vigente  # "a" pasa a ser el más reciente
+    cache.put("c", vigente)
+    assert cache.get("b") is None
+    assert cache.get("c") is vigente
+
+    cache.put("vencido", {"exp": time.time() - 1})
+    assert cache.get("vencido") is None
+    assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 2, "misses": 2, "evictions": 2, "hit_rate": 0.5}
+
+
+def test_token_verificado_una_vez_y_revocacion_en_cada_uso(api, tokens, monkeypatch):
+    monkeypatch.setattr(server, "token_cache", server.TokenCache(16))
+    verificaciones = []
+    verificar = server.verify_token_signature
+    monkeypatch.setattr(server, "verify_token_signature", lambda token: verificaciones.append(token) or verificar(token))
+
+    headers = bearer(tokens["access_token"])
+    for _ in range(3):
+        assert api.get("/api/me", headers=headers).status_code == 200
+    assert len(verificaciones) == 1
+    assert server.token_cache.stats()["hits"] == 2
+
+    # Un token en caché igual se rechaza tras revocarlo
+    api.post("/api/logout", json={}, headers=headers)
+    assert api.get("/api/me", headers=headers).status_code == 401
@@ -0,0 +1,80 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend import server
+from tests.conftest import bearer, datos_usuario
+
+# (edad, ingreso mensual, gasto en vivienda, gasto en alimentacion, score)
+USUARIOS = [(28, 3000, 1200, 600, 620), (31, 5000, 1500, 900, 700), (33, 8000, 2000, 1000, 780), (50, 4000, 1000, 500, 650)]
+
+
+def test_histograma_aproxima_percentiles_exactos():
+    rng = np.random.default_rng(7)
+    valores = rng.lognormal(7, 0.8, 5000)
+    bordes = server.BORDES_BENCHMARK["gasto_vivienda"]
+    conteos = np.bincount(server.indices_bin(bordes, valores), minlength=len(bordes) - 1)
+    for q in (0.25, 0.5, 0.75):
+        exacto = np.quantile(valores, q)
+        assert server.cuantil_de_histograma(conteos, bordes, q) == pytest.approx(exacto, rel=0.05)
+        assert server.percentil_en_histograma(conteos, bordes, exacto) == pytest.approx(q * 100, abs=1)
+
+
+def test_claves_cohorte_de_especifica_a_general():
+    claves = [clave for clave, _ in server.claves_cohorte("Ingeniería ", 67, 4)]
+    assert claves == ["ocupacion=ingenieria|edad=65+|dependientes=3+", "ocupacion=ingenieria|edad=65+", "edad=65+", "todos"]
+
+
+@pytest.fixture
+def usuarios(api, monkeypatch):
+    import rollup_benchmarks
+
+    monkeypatch.setattr(server, "BENCHMARK_MIN_COHORTE", 3)
+    monkeypatch.setattr(rollup_benchmarks, "BENCHMARK_MIN_COHORTE", 3)
+    monkeypatch.setattr(rollup_benchmarks, "db", server.db)
+    headers = []
+    for i, (edad, ingreso, vivienda, alimentacion, score) in enumerate(USUARIOS):
+        respuesta = api.post("/api/register", json=datos_usuario(
+            nombre=f"Usuario{i}", apellido="Prueba", email=f"u{i}@example.com", dni=f"1234567{i}", edad=edad
+        ))
+        assert respuesta.status_code == 200, respuesta.text
+        h = bearer(respuesta.json()["access_token"])
+        api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": ingreso, "frecuencia": "mensual"}, headers=h)
+        for categoria, monto in (("vivienda", vivienda), ("alimentacion", alimentacion)):
+            api.post("/api/gastos", json={"categoria": categoria, "descripcion": categoria, "monto": monto, "tipo": "fijo", "frecuencia": "mensual"}, headers=h)
+        user_id = api.get("/api/me", headers=h).json()["id"]
+
+        async def guardar_score(user_id=user_id, score=score):
+            await server.db.users.update_one({"id": user_id}, {"$set": {"score_actual": score}})
+            await server.cache.invalidar(f"usuario:{user_id}")
+
+        asyncio.run(guardar_score())
+        headers.append(h)
+    return headers, rollup_benchmarks
+
+
+def test_sin_rollup_responde_404(api, usuarios):
+    headers, _ = usuarios
+    assert api.get("/api/benchmark", headers=headers[0]).status_code == 404
+
+
+def test_benchmark_usa_la_cohorte_mas_especifica_con_datos(api, usuarios):
+    headers, rollup_benchmarks = usuarios
+    # 3 usuarios en ocupacion=ingenieria|edad=25-34|dependientes=1 y 4 en total
+    assert asyncio.run(rollup_benchmarks.rollup(chunk_size=2)) == 4
+
+    respuesta = api.get("/api/benchmark", headers=headers[1])
+    assert respuesta.status_code == 200, respuesta.text
+    datos = respuesta.json()
+    assert datos["cohorte"] == {"ocupacion": "ingeniera", "edad": "25-34", "dependientes": "1"}
+    assert datos["tamano_cohorte"] == 3
+    metricas = {m["metrica"]: m for m in datos["metricas"]}
+    assert metricas["porcentaje_ahorro"]["valor"] == 52
+    assert 33 < metricas["porcentaje_ahorro"]["percentil"] < 67
+    assert metricas["gasto_vivienda"]["p25"] < metricas["gasto_vivienda"]["mediana"] < metricas["gasto_vivienda"]["p75"]
+    assert metricas["score"]["valor"] == 700 and metricas["score"]["muestras"] == 3
+
+    # El de 50 años no tiene cohorte propia con el mínimo: se compara con todos
+    datos = api.get("/api/benchmark", headers=headers[3]).json()
+    assert datos["cohorte"] == {} and datos["tamano_cohorte"] == 4
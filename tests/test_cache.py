@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from backend import server
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class Valor(server.BaseModel):
+    n: int
+
+
+def workers(cantidad: int = 2):
+    """Cachés de varios workers que comparten un mismo Redis en memoria"""
+    redis_server = fakeredis.FakeServer()
+    return [
+        server.CacheDosNiveles(fakeredis.aioredis.FakeRedis(server=redis_server), 100, 30, 300)
+        for _ in range(cantidad)
+    ]
+
+
+def contador(retardo: float = 0):
+    llamadas = []
+
+    async def cargar():
+        llamadas.append(1)
+        await asyncio.sleep(retardo)
+        return Valor(n=len(llamadas))
+
+    return cargar, llamadas
+
+
+def test_nivel_compartido_evita_recargar_en_otro_worker():
+    async def prueba():
+        a, b = workers()
+        cargar, llamadas = contador()
+        assert (await a.obtener("k", cargar, Valor)).n == 1
+        assert (await b.obtener("k", cargar, Valor)).n == 1
+        assert (await b.obtener("k", cargar, Valor)).n == 1
+        assert len(llamadas) == 1
+        assert b.stats()["shared"]["hits"] == 1 and b.stats()["local"]["hits"] == 1
+
+    asyncio.run(prueba())
+
+
+def test_version_distinta_no_sirve_el_valor_guardado():
+    async def prueba():
+        a, b = workers()
+        cargar, llamadas = contador()
+        await a.obtener("k", cargar, Valor, version=1)
+        assert (await b.obtener("k", cargar, Valor, version=2)).n == 2
+        assert (await a.obtener("k", cargar, Valor, version=2)).n == 2  # desde Redis
+        assert len(llamadas) == 2
+
+    asyncio.run(prueba())
+
+
+def test_invalidacion_llega_a_los_demas_workers():
+    async def prueba():
+        a, b = workers()
+        escucha = asyncio.create_task(b.escuchar_invalidaciones())
+        await asyncio.sleep(0.05)
+        cargar, llamadas = contador()
+        await b.obtener("k", cargar, Valor)
+        await a.invalidar("k")
+        for _ in range(50):
+            if b.invalidations_received:
+                break
+            await asyncio.sleep(0.01)
+        assert "k" not in b.local
+        assert (await b.obtener("k", cargar, Valor)).n == 2
+        escucha.cancel()
+
+    asyncio.run(prueba())
+
+
+def test_una_sola_carga_ante_estampida():
+    async def prueba():
+        a, b = workers()
+        cargar, llamadas = contador(retardo=0.1)
+        resultados = await asyncio.gather(*(
+            cache.obtener("k", cargar, Valor) for cache in (a, b) for _ in range(10)
+        ))
+        assert {valor.n for valor in resultados} == {1}
+        assert len(llamadas) == 1
+        assert b.lock_waits + a.lock_waits == 1
+
+    asyncio.run(prueba())
+
+
+def test_sin_redis_funciona_solo_en_memoria():
+    async def prueba():
+        cache = server.CacheDosNiveles(None, 100, 30, 300)
+        cargar, llamadas = contador()
+        await cache.obtener("k", cargar, Valor)
+        await cache.obtener("k", cargar, Valor)
+        await cache.invalidar("k")
+        await cache.obtener("k", cargar, Valor)
+        assert len(llamadas) == 2
+        assert cache.stats()["backend"] == "local"
+
+    asyncio.run(prueba())
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from backend import server
+
+
+@pytest.mark.parametrize("tasa", [8.5, 25.0, 0.0])
+@pytest.mark.parametrize("capacidad", [150.0, 1234.56])
+def test_monto_maximo_es_el_mayor_aprobable(tasa, capacidad):
+    plazos = np.array([1, 12, 60, 360])
+    for plazo, monto in zip(plazos, server.montos_maximos_aprobables(capacidad, tasa, plazos)):
+        assert server.calcular_cuota_mensual(monto, tasa, int(plazo)) <= capacidad
+        assert server.calcular_cuota_mensual(round(monto + 0.01, 2), tasa, int(plazo)) > capacidad
+
+
+@pytest.mark.parametrize("tasa", [8.5, 25.0, 0.0])
+def test_plazo_minimo_coincide_con_la_busqueda_lineal(tasa):
+    capacidad = 900.0
+    montos = np.array([500.0, 10000.0, 45000.0, 10 ** 7])
+    for monto, plazo in zip(montos, server.plazos_minimos_aprobables(capacidad, tasa, montos)):
+        lineal = next(
+            (n for n in range(1, server.PLAZO_MAXIMO_MESES + 1) if server.calcular_cuota_mensual(float(monto), tasa, n) <= capacidad),
+            None
+        )
+        assert plazo == lineal
+
+
+def test_sin_capacidad_nada_es_aprobable():
+    assert server.montos_maximos_aprobables(0, 25.0, np.array([12, 24])).tolist() == [0, 0]
+    assert server.plazos_minimos_aprobables(-10, 25.0, np.array([1000.0])) == [None]
+
+
+def test_ruta_de_capacidad(api, headers):
+    api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 5000, "frecuencia": "mensual"}, headers=headers)
+    api.post("/api/gastos", json={"categoria": "vivienda", "descripcion": "Alquiler", "monto": 2000, "tipo": "fijo", "frecuencia": "mensual"}, headers=headers)
+
+    respuesta = api.get("/api/credito/capacidad?tipo_credito=vehicular&plazos=12&plazos=48&montos=20000", headers=headers)
+    assert respuesta.status_code == 200
+    capacidad = respuesta.json()
+    assert capacidad["capacidad_pago"] == 900
+    credito = capacidad["creditos"][0]
+    assert [m["plazo_meses"] for m in credito["montos_maximos"]] == [12, 48]
+    assert all(m["cuota_mensual"] <= 900 for m in credito["montos_maximos"])
+    assert credito["plazos_minimos"][0]["plazo_minimo"] == server.plazos_minimos_aprobables(900, 15.0, np.array([20000.0]))[0]
+
+    assert api.get("/api/credito/capacidad?plazos=0", headers=headers).status_code == 400
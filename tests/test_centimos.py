@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from backend import server
+
+
+@pytest.fixture
+def migrador(mongo_en_memoria, monkeypatch):
+    import migrate_centimos
+
+    monkeypatch.setattr(migrate_centimos, "db", mongo_en_memoria)
+    return lambda dry_run=False: asyncio.run(migrate_centimos.migrar(batch_size=2, dry_run=dry_run))
+
+
+@pytest.mark.parametrize("coleccion, doc", [
+    ("ingresos", {"tipo": "freelance", "monto": 1234.56, "frecuencia": "quincenal", "descripcion": "Diseño"}),
+    ("gastos", {"categoria": "salud", "monto": 0.1, "frecuencia": "anual", "tipo": "variable"}),
+    ("simulaciones", {"monto_solicitado": 8000.0, "cuota_mensual": 463.17, "total_pagar": 5558.04}),
+])
+def test_codificar_y_decodificar_es_ida_y_vuelta(coleccion, doc):
+    codificado = server.codificar_documento(coleccion, dict(doc))
+    assert not any(isinstance(valor, float) for valor in codificado.values())
+    assert server.decodificar_documento(coleccion, codificado) == doc
+
+
+def test_montos_se_guardan_y_devuelven_en_centimos(api, headers):
+
+    creado = api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 800.333, "frecuencia": "mensual"}, headers=headers).json()
+    assert creado["monto"] == 800.33
+    assert [i["monto"] for i in api.get("/api/ingresos", headers=headers).json()] == [800.33]
+
+    gasto = api.post("/api/gastos", json={"categoria": "vivienda", "descripcion": "Luz", "monto": 99.999, "tipo": "fijo", "frecuencia": "mensual"}, headers=headers).json()
+    assert gasto["monto"] == 100.0
+    assert [g["monto"] for g in api.get("/api/gastos", headers=headers).json()] == [100.0]
+
+    simulacion = api.post("/api/simulacion-credito", json={"tipo_credito": "personal", "monto_solicitado": 5000.005, "plazo_meses": 12}, headers=headers).json()
+    guardada = api.get("/api/simulaciones", headers=headers).json()[0]
+    assert {k: simulacion[k] for k in ("monto_solicitado", "total_pagar")} == {k: guardada[k] for k in ("monto_solicitado", "total_pagar")}
+
+
+def test_migracion_convierte_el_formato_anterior(mongo_en_memoria, migrador):
+    async def preparar():
+        await mongo_en_memoria.ingresos.insert_many([
+            {"id": "a", "user_id": "u", "tipo": "salario", "monto": 2500.5, "frecuencia": "mensual"},
+            {"id": "b", "user_id": "u", "tipo": "otro", "monto": 10, "frecuencia": "semanal"},
+            # Ya migrado
+            {"id": "c", "user_id": "u", "tipo": 0, "monto_centimos": 100, "frecuencia": 0},
+            # Monto nulo: solo se codifican las enumeraciones
+            {"id": "d", "user_id": "u", "tipo": "inversion", "monto": None, "frecuencia": "anual"},
+        ])
+        await mongo_en_memoria.gastos.insert_one({"id": "e", "user_id": "u", "categoria": "salud", "monto": None, "tipo": 1, "frecuencia": 3})
+
+    asyncio.run(preparar())
+    assert migrador(dry_run=True) == {"ingresos": 0, "gastos": 0, "simulaciones": 0, "movimientos": 0}
+
+    assert migrador()["ingresos"] == 3
+    documentos = asyncio.run(mongo_en_memoria.ingresos.find({}, {"_id": 0, "user_id": 0}).sort("id", 1).to_list(10))
+    assert documentos == [
+        {"id": "a", "tipo": 0, "monto_centimos": 250050, "frecuencia": 0},
+        {"id": "b", "tipo": 4, "monto_centimos": 1000, "frecuencia": 2},
+        {"id": "c", "tipo": 0, "monto_centimos": 100, "frecuencia": 0},
+        {"id": "d", "tipo": 2, "monto": None, "frecuencia": 3},
+    ]
+    gasto = asyncio.run(mongo_en_memoria.gastos.find_one({"id": "e"}, {"_id": 0}))
+    assert gasto["categoria"] == 3 and gasto["monto"] is None
+
+    # Repetir no encuentra nada pendiente
+    assert set(migrador().values()) == {0}
@@ -0,0 +1,59 @@
+import gzip
+
+import pytest
+
+from backend import server
+
+
+@pytest.fixture
+def headers(api, headers):
+    for i in range(30):
+        api.post("/api/ingresos", json={"tipo": "freelance", "descripcion": f"Proyecto {i}", "monto": 100 + i, "frecuencia": "mensual"}, headers=headers)
+    return headers
+
+
+@pytest.mark.parametrize("cabecera, esperado", [
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0", "gzip"),
+    ("*", "br"),
+    ("identity", None),
+    ("gzip;q=0, *;q=0", None),
+    ("", None),
+])
+def test_negociacion_de_codificacion(cabecera, esperado):
+    assert server.negotiate_encoding(cabecera) == esperado
+
+
+@pytest.mark.parametrize("codificacion", ["gzip", "br"])
+def test_respuestas_grandes_se_comprimen(api, headers, codificacion):
+    respuesta = api.get("/api/ingresos", headers={**headers, "Accept-Encoding": codificacion})
+    assert respuesta.headers["content-encoding"] == codificacion
+    assert "Accept-Encoding" in respuesta.headers["vary"]
+    assert len(respuesta.json()) == 30
+    # El ETag pasa a débil y sigue sirviendo para revalidar
+    etag = respuesta.headers["etag"]
+    assert etag.startswith("W/")
+    assert api.get("/api/ingresos", headers={**headers, "Accept-Encoding": codificacion, "If-None-Match": etag}).status_code == 304
+
+
+def test_respuestas_pequenas_o_sin_accept_encoding_van_sin_comprimir(api, headers):
+    pequena = api.get("/api/me", headers={**headers, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in pequena.headers
+    identidad = api.get("/api/ingresos", headers={**headers, "Accept-Encoding": "identity"})
+    assert "content-encoding" not in identidad.headers
+    assert not identidad.headers["etag"].startswith("W/")
+
+
+def test_reporte_precomprimido_se_sirve_sin_recomprimir(api, headers):
+    reporte = api.post("/api/reporte-sunat?tipo_reporte=completo&periodo=2024", headers=headers).json()
+    ruta = f"/api/reportes-sunat/{reporte['id']}/download"
+
+    with api.stream("GET", ruta, headers={**headers, "Accept-Encoding": "gzip, br"}) as respuesta:
+        assert respuesta.headers["content-encoding"] == "gzip"
+        crudo = b"".join(respuesta.iter_raw())
+    contenido = gzip.decompress(crudo)
+    assert b"Proyecto 29" in contenido
+
+    sin_gzip = api.get(ruta, headers={**headers, "Accept-Encoding": "identity"})
+    assert "content-encoding" not in sin_gzip.headers
+    assert sin_gzip.content == contenido
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from backend import server
+from tests.conftest import USUARIO
+
+
+@pytest.fixture
+def headers(api, headers):
+    api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 4000, "frecuencia": "mensual"}, headers=headers)
+    api.post("/api/gastos", json={"categoria": "vivienda", "descripcion": "Alquiler", "monto": 1200, "tipo": "fijo", "frecuencia": "mensual"}, headers=headers)
+    api.post("/api/gastos", json={"categoria": "alimentacion", "descripcion": "Mercado", "monto": 200, "tipo": "variable", "frecuencia": "semanal"}, headers=headers)
+    return headers
+
+
+@pytest.mark.parametrize("edad, dependientes", [(20, 0), (38, 1), (60, 4), (70, 2)])
+def test_scores_vectorizados_igualan_al_calculo_escalar(edad, dependientes):
+    ingresos = np.array([0, 1000, 1000, 1000, 1000, 1000, 5000, 2500.5])
+    gastos = np.array([100, 0, 700, 850, 1000, 1500, 3499.99, 2500.5])
+    esperado = [server.calcular_score_crediticio(i, g, edad, dependientes) for i, g in zip(ingresos, gastos)]
+    assert server.calcular_scores_vectorizado(ingresos, gastos, edad, dependientes).tolist() == esperado
+
+
+def test_evalua_escenarios_sobre_los_datos_actuales(api, headers):
+    gasto_id = next(g["id"] for g in api.get("/api/gastos", headers=headers).json() if g["categoria"] == "alimentacion")
+    respuesta = api.post("/api/escenarios", json={"escenarios": [
+        {"nombre": "menos vivienda", "cambios": [{"accion": "escalar_categoria", "categoria": "vivienda", "factor": 0.5}]},
+        {"nombre": "mercado mensual", "cambios": [{"accion": "cambiar_frecuencia", "id": gasto_id, "frecuencia": "mensual"}]},
+        {"nombre": "préstamo", "cambios": [{"accion": "agregar_gasto", "monto": 600, "frecuencia": "quincenal"}]},
+    ]}, headers=headers)
+    assert respuesta.status_code == 200
+    resultados = {r["nombre"]: r for r in respuesta.json()}
+
+    assert resultados["actual"]["gastos_totales"] == 2066.0
+    assert resultados["menos vivienda"]["diferencia_flujo"] == 600.0
+    assert resultados["mercado mensual"]["gastos_totales"] == 1400.0
+    assert resultados["préstamo"]["flujo_neto"] == 734.0
+    for resultado in resultados.values():
+        assert resultado["score_crediticio"] == server.calcular_score_crediticio(
+            resultado["ingresos_totales"], resultado["gastos_totales"], USUARIO["edad"], USUARIO["dependientes"]
+        )
+
+
+def test_frecuencia_desconocida_se_rechaza(api, headers):
+    respuesta = api.post("/api/escenarios", json={"escenarios": [
+        {"nombre": "typo", "cambios": [{"accion": "agregar_ingreso", "monto": 500, "frecuencia": "mesual"}]},
+    ]}, headers=headers)
+    assert respuesta.status_code == 422
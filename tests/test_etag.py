@@ -0,0 +1,48 @@
+import pytest
+
+from backend import server
+from tests.conftest import bearer
+
+INGRESO = {"tipo": "salario", "descripcion": "Sueldo", "monto": 3500, "frecuencia": "mensual"}
+
+
+@pytest.fixture
+def headers(api, headers):
+    api.post("/api/ingresos", json=INGRESO, headers=headers)
+    return headers
+
+
+@pytest.mark.parametrize("ruta", ["/api/ingresos", "/api/gastos", "/api/flujo-dinero", "/api/calculo-tributario", "/api/sugerencias"])
+def test_etag_vigente_responde_304(api, headers, ruta):
+    primera = api.get(ruta, headers=headers)
+    assert primera.status_code == 200
+    etag = primera.headers["etag"]
+    assert primera.headers["cache-control"] == "private, no-cache"
+
+    segunda = api.get(ruta, headers={**headers, "If-None-Match": etag})
+    assert segunda.status_code == 304
+    assert segunda.content == b""
+    assert segunda.headers["etag"] == etag
+    # Comparación débil y listas de ETags
+    assert api.get(ruta, headers={**headers, "If-None-Match": f'"otro", W/{etag}'}).status_code == 304
+
+
+def test_escritura_cambia_el_etag(api, headers):
+    etag = api.get("/api/ingresos", headers=headers).headers["etag"]
+    api.post("/api/ingresos", json={**INGRESO, "descripcion": "Extra"}, headers=headers)
+
+    respuesta = api.get("/api/ingresos", headers={**headers, "If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["etag"] != etag
+    assert len(respuesta.json()) == 2
+
+
+def test_etag_depende_de_la_consulta_y_del_usuario(api, headers, registrar):
+    etag = api.get("/api/calculo-tributario", headers=headers).headers["etag"]
+    otro_anio = api.get(f"/api/calculo-tributario?anio={server.ANIO_FISCAL_DEFAULT}", headers={**headers, "If-None-Match": etag})
+    assert otro_anio.status_code == 200
+
+    # El ETag de un usuario no valida el mismo recurso de otro
+    etag = api.get("/api/gastos", headers=headers).headers["etag"]
+    headers_otro = bearer(registrar(email="otra@example.com", dni="13131313")["access_token"])
+    assert api.get("/api/gastos", headers={**headers_otro, "If-None-Match": etag}).status_code == 200
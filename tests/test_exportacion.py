@@ -0,0 +1,60 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from backend import server
+from tests.conftest import bearer
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+
+def insertar(db):
+    async def insertar():
+        await db.users.insert_one({"id": "u1", "email": "u1@example.com", "password_hash": "x", "dni": "1", "edad": 30, "created_at": "2024-01-05T10:00:00+00:00"})
+        await db.ingresos.insert_many([
+            server.codificar_documento("ingresos", {
+                "id": f"i{k}", "user_id": "u1", "tipo": "salario", "descripcion": f"Pago {k}",
+                "monto": 1000 + k / 100, "frecuencia": "mensual", "activo": True, "created_at": f"2024-0{mes}-10T00:00:00+00:00"
+            }) for k, mes in enumerate([1, 1, 1, 2, 2])
+        ])
+
+    asyncio.run(insertar())
+
+
+def test_exporta_particionado_por_mes(mongo_en_memoria, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_BATCH_SIZE", 2)
+    insertar(mongo_en_memoria)
+
+    manifiesto = asyncio.run(server.exportar_colecciones(["users", "ingresos"], tmp_path, "prueba"))
+    assert manifiesto["colecciones"]["ingresos"] == {"filas": 5, "particiones": ["2024-01", "2024-02"]}
+    assert json.loads((tmp_path / "prueba" / "manifest.json").read_text())["export_id"] == "prueba"
+
+    ingresos = pq.read_table(tmp_path / "prueba" / "ingresos").to_pandas()
+    assert sorted(ingresos["monto"]) == [1000, 1000.01, 1000.02, 1000.03, 1000.04]
+    assert set(ingresos["tipo"]) == {"salario"} and set(ingresos["frecuencia"]) == {"mensual"}
+    # Los datos de contacto y credenciales no se exportan
+    usuarios = pq.read_table(tmp_path / "prueba" / "users")
+    assert {"email", "password_hash", "dni"}.isdisjoint(usuarios.column_names)
+    assert usuarios.column("edad").to_pylist() == [30]
+
+
+def test_exportacion_desde_la_api(api, registrar, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_DIR", tmp_path)
+    insertar(server.db)
+    headers = bearer(registrar(is_admin=True)["access_token"])
+
+    assert api.post("/api/admin/export?colecciones=rate_limits", headers=headers).status_code == 400
+    export_id = api.post("/api/admin/export?colecciones=ingresos", headers=headers).json()["export_id"]
+    limite = time.monotonic() + 10
+    while (estado := api.get(f"/api/admin/export/{export_id}", headers=headers).json())["estado"] == "en_proceso":
+        assert time.monotonic() < limite
+        time.sleep(0.05)
+    assert estado["estado"] == "completado"
+    assert estado["colecciones"]["ingresos"]["filas"] == 5
+
+    assert api.get("/api/admin/export/..", headers=headers).status_code == 404
+    headers_usuario = bearer(registrar(email="comun@example.com", dni="19191919")["access_token"])
+    assert api.post("/api/admin/export", headers=headers_usuario).status_code == 403
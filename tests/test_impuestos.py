@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from backend import server
+
+
+def impuesto_escalar(base_imponible: float, uit: float) -> tuple:
+    """Cálculo por tramos previo a la tabla vectorizada: (impuesto, porcentaje, tramo)"""
+    if base_imponible <= 5 * uit:
+        return 0, 0, "Exonerado (hasta 5 UIT)"
+    if base_imponible <= 20 * uit:
+        return (base_imponible - 5 * uit) * 0.08, 8, "Primer tramo (8%)"
+    base_8 = 15 * uit * 0.08
+    if base_imponible <= 35 * uit:
+        return base_8 + (base_imponible - 20 * uit) * 0.14, 14, "Segundo tramo (14%)"
+    base_14 = 15 * uit * 0.14
+    if base_imponible <= 45 * uit:
+        return base_8 + base_14 + (base_imponible - 35 * uit) * 0.17, 17, "Tercer tramo (17%)"
+    base_17 = 10 * uit * 0.17
+    return base_8 + base_14 + base_17 + (base_imponible - 45 * uit) * 0.30, 30, "Cuarto tramo (30%)"
+
+
+def bases_de_prueba(uit: float) -> np.ndarray:
+    limites = np.array([5, 20, 35, 45]) * uit
+    aleatorias = np.random.default_rng(2024).uniform(0, 60 * uit, 500)
+    return np.concatenate(([0, 0.01], limites - 0.01, limites, limites + 0.01, aleatorias))
+
+
+@pytest.mark.parametrize("anio", list(server.TABLAS_IMPUESTO_RENTA))
+def test_tabla_vectorizada_igual_al_calculo_escalar(anio):
+    uit = server.TABLAS_IMPUESTO_RENTA[anio]["uit"]
+    bases = bases_de_prueba(uit)
+    impuestos, tramos = server.calcular_impuestos_vectorizado(bases, anio)
+    tabla = server.TABLAS_IMPUESTO_RENTA[anio]
+
+    for base, impuesto, tramo in zip(bases, impuestos, tramos):
+        esperado, porcentaje, nombre = impuesto_escalar(base, uit)
+        assert round(float(impuesto), 2) == round(esperado, 2)
+        assert (round(tabla["tasas"][tramo] * 100), tabla["tramos"][tramo]) == (porcentaje, nombre)
+
+
+def test_calculo_individual_usa_la_misma_tabla():
+    uit = server.TABLAS_IMPUESTO_RENTA[server.ANIO_FISCAL_DEFAULT]["uit"]
+    calculo = server.calcular_impuesto_renta(30 * uit, 2 * uit)
+    impuesto, porcentaje, tramo = impuesto_escalar(28 * uit, uit)
+    assert (calculo["impuesto_renta"], calculo["porcentaje_impuesto"], calculo["tramo_tributario"]) == (round(impuesto, 2), porcentaje, tramo)
+    # Sin base negativa
+    assert server.calcular_impuesto_renta(1000, 5000)["base_imponible"] == 0
+
+
+def test_anio_no_soportado():
+    with pytest.raises(server.HTTPException) as error:
+        server.calcular_impuestos_vectorizado(np.array([1000.0]), 1990)
+    assert error.value.status_code == 400
+
+
+def test_calculo_tributario_por_anio(api, headers):
+    api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 9000, "frecuencia": "mensual"}, headers=headers)
+
+    por_anio = {c["anio_fiscal"]: c for c in api.get("/api/calculo-tributario/anios", headers=headers).json()}
+    for anio, esperado in por_anio.items():
+        calculo = api.get(f"/api/calculo-tributario?anio={anio}", headers=headers).json()
+        assert (calculo["anio_fiscal"], calculo["impuesto_renta"]) == (anio, esperado["impuesto_renta"])
+    assert api.get("/api/calculo-tributario?anio=1990", headers=headers).status_code == 400
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from backend import server
+
+
+@pytest.mark.parametrize("frecuencia, inicio, desde, hasta, esperado", [
+    ("semanal", date(2024, 1, 3), date(2024, 1, 1), date(2024, 1, 31), [3, 10, 17, 24, 31]),
+    ("semanal", date(2023, 12, 29), date(2024, 1, 1), date(2024, 1, 31), [5, 12, 19, 26]),
+    ("quincenal", date(2024, 1, 1), date(2024, 2, 1), date(2024, 2, 29), [15, 29]),
+    ("quincenal", date(2024, 3, 20), date(2024, 3, 1), date(2024, 3, 31), [31]),
+    ("mensual", date(2024, 1, 31), date(2024, 2, 1), date(2024, 2, 29), [29]),
+    ("anual", date(2023, 6, 10), date(2024, 1, 1), date(2024, 12, 31), [10]),
+    ("anual", date(2023, 6, 10), date(2024, 1, 1), date(2024, 5, 31), []),
+    ("mensual", date(2024, 3, 1), date(2024, 1, 1), date(2024, 2, 29), []),
+])
+def test_fechas_de_ocurrencia_por_frecuencia(frecuencia, inicio, desde, hasta, esperado):
+    assert [f.day for f in server.fechas_ocurrencia(frecuencia, inicio, desde, hasta)] == esperado
+
+
+def test_expande_definiciones_en_movimientos_por_mes():
+    alta = "2024-01-01T00:00:00+00:00"
+    ingresos = [{"id": "sueldo", "monto": 3000.5, "frecuencia": "quincenal", "created_at": alta}]
+    gastos = [
+        {"id": "menu", "monto": 12.3, "frecuencia": "semanal", "created_at": alta},
+        {"id": "seguro", "monto": 600, "frecuencia": "anual", "created_at": "2023-02-10T00:00:00+00:00"},
+    ]
+    por_mes = server.expandir_movimientos(ingresos, gastos, date(2024, 1, 1), date(2024, 2, 29))
+
+    assert list(por_mes) == ["2024-01", "2024-02"]
+    enero = por_mes["2024-01"]
+    assert [m["dia"] for m in enero] == sorted(m["dia"] for m in enero)
+    assert sum(m["monto_centimos"] for m in enero if m["tipo"] == "ingreso") == 2 * 300050
+    assert sum(1 for m in enero if m["origen"] == "menu") == 5
+    assert [(m["dia"], m["monto_centimos"]) for m in por_mes["2024-02"] if m["origen"] == "seguro"] == [(10, 60000)]
+
+
+def test_flujo_historico_desde_el_ledger(api, headers):
+    api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 2000, "frecuencia": "mensual"}, headers=headers)
+    api.post("/api/gastos", json={"categoria": "transporte", "descripcion": "Pasajes", "monto": 25, "tipo": "variable", "frecuencia": "semanal"}, headers=headers)
+
+    async def dar_de_alta_en(fecha: str):
+        for coleccion in ("ingresos", "gastos"):
+            await server.db[coleccion].update_many({}, {"$set": {"created_at": fecha}})
+
+    asyncio.run(dar_de_alta_en("2024-01-15T00:00:00+00:00"))
+    flujo = api.get("/api/flujo-dinero?desde=2023-12&hasta=2024-02", headers=headers).json()
+
+    assert [m["mes"] for m in flujo["meses"]] == ["2023-12", "2024-01", "2024-02"]
+    assert [m["ingresos"] for m in flujo["meses"]] == [0, 2000, 2000]
+    # Semanal desde el lunes 15: 3 pasajes en enero y 4 en febrero
+    assert [m["gastos"] for m in flujo["meses"]] == [0, 75, 100]
+    assert flujo["flujo_neto"] == 3825
+
+    # Meses ya cerrados no cambian al eliminar la definición
+    gasto_id = api.get("/api/gastos", headers=headers).json()[0]["id"]
+    api.delete(f"/api/gastos/{gasto_id}", headers=headers)
+    assert api.get("/api/flujo-dinero?desde=2023-12&hasta=2024-02", headers=headers).json()["gastos_totales"] == 175
+
+
+def test_rango_abierto_avanza_con_el_mes(api, headers, monkeypatch):
+    api.post("/api/ingresos", json={"tipo": "salario", "descripcion": "Sueldo", "monto": 2000, "frecuencia": "mensual"}, headers=headers)
+
+    def hoy(dia: date):
+        monkeypatch.setattr(server, "date", type("Fecha", (date,), {"today": staticmethod(lambda: dia)}))
+
+    hoy(date(2024, 2, 10))
+    respuesta = api.get("/api/flujo-dinero?desde=2024-01", headers=headers)
+    assert respuesta.json()["hasta"] == "2024-02"
+    etag = respuesta.headers["etag"]
+    assert api.get("/api/flujo-dinero?desde=2024-01", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    # Al cambiar de mes el rango resuelto es otro: ni 304 ni la entrada de caché anterior
+    hoy(date(2024, 3, 5))
+    respuesta = api.get("/api/flujo-dinero?desde=2024-01", headers={**headers, "If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.json()["hasta"] == "2024-03"
+    assert api.get("/api/flujo-dinero?desde=2024-01&hasta=2024-03", headers={**headers, "If-None-Match": respuesta.headers["etag"]}).status_code == 304
@@ -0,0 +1,104 @@
+"""Presupuestos de acceso a Mongo por endpoint.
+
+Cada caso declara cuántos round trips, documentos examinados y bytes devueltos
+puede costar la request con los datos de la fixture `usuario`. Si un cambio los
+supera (una consulta N+1, una lectura repetida, una proyección perdida) el test
+falla y muestra las operaciones que se ejecutaron.
+"""
+from dataclasses import dataclass
+
+import pytest
+
+from tests.conftest import USUARIO, bearer
+
+
+@dataclass(frozen=True)
+class Presupuesto:
+    round_trips: int
+    examinados: int
+    bytes: int
+
+
+INGRESOS = [
+    {"tipo": "salario", "descripcion": "Sueldo", "monto": 4500, "frecuencia": "mensual"},
+    {"tipo": "freelance", "descripcion": "Proyectos", "monto": 800, "frecuencia": "quincenal"},
+    {"tipo": "inversion", "descripcion": "Dividendos", "monto": 1200, "frecuencia": "anual"},
+]
+GASTOS = [
+    {"categoria": "vivienda", "descripcion": "Alquiler", "monto": 1500, "tipo": "fijo", "frecuencia": "mensual"},
+    {"categoria": "alimentacion", "descripcion": "Mercado", "monto": 150, "tipo": "variable", "frecuencia": "semanal"},
+    {"categoria": "transporte", "descripcion": "Pasajes", "monto": 60, "tipo": "variable", "frecuencia": "semanal"},
+    {"categoria": "salud", "descripcion": "Seguro", "monto": 180, "tipo": "fijo", "frecuencia": "mensual"},
+]
+SIMULACION = {"tipo_credito": "personal", "monto_solicitado": 10000, "plazo_meses": 24}
+REPORTE = "/api/reporte-sunat?tipo_reporte=completo&periodo=2024"
+
+# (método, ruta, cuerpo, presupuesto) con 3 ingresos y 4 gastos activos
+PRESUPUESTOS = [
+    ("POST", "/api/login", {"email": USUARIO["email"], "password": USUARIO["password"]}, Presupuesto(1, 1, 600)),
+    ("GET", "/api/me", None, Presupuesto(1, 1, 600)),
+    ("GET", "/api/ingresos", None, Presupuesto(2, 4, 900)),
+    ("GET", "/api/gastos", None, Presupuesto(2, 5, 1200)),
+    ("POST", "/api/ingresos", INGRESOS[0], Presupuesto(2, 1, 0)),
+    ("POST", "/api/gastos", GASTOS[0], Presupuesto(2, 1, 0)),
+    ("GET", "/api/flujo-dinero", None, Presupuesto(3, 8, 2100)),
+    ("GET", "/api/calculo-tributario", None, Presupuesto(3, 8, 2100)),
+    ("GET", "/api/sugerencias", None, Presupuesto(3, 8, 2100)),
+    ("GET", "/api/credito/capacidad", None, Presupuesto(3, 8, 2100)),
+    ("POST", "/api/simulacion-credito", SIMULACION, Presupuesto(3, 8, 2100)),
+    ("GET", "/api/simulaciones", None, Presupuesto(1, 0, 0)),
+    ("POST", "/api/proyeccion", {}, Presupuesto(2, 7, 2100)),
+    # Reportes: resumen con un $group por colección y detalle en streaming desde los cursores
+    ("POST", REPORTE, None, Presupuesto(12, 16, 2700)),
+    ("GET", REPORTE.replace("reporte-sunat", "reporte-sunat/stream"), None, Presupuesto(5, 15, 2700)),
+    ("GET", "/api/reportes-sunat", None, Presupuesto(1, 0, 0)),
+    ("GET", "/api/admin/stats", None, Presupuesto(4, 8, 0)),
+    ("GET", "/api/admin/users", None, Presupuesto(1, 1, 600)),
+]
+
+
+@pytest.fixture
+def usuario(api, registrar):
+    """Headers de un administrador con ingresos y gastos cargados"""
+    headers = bearer(registrar(is_admin=True)["access_token"])
+    for ingreso in INGRESOS:
+        assert api.post("/api/ingresos", json=ingreso, headers=headers).status_code == 200
+    for gasto in GASTOS:
+        assert api.post("/api/gastos", json=gasto, headers=headers).status_code == 200
+    return headers
+
+
+def verificar(medicion, presupuesto: Presupuesto, descripcion: str):
+    detalle = f"{descripcion}\n{medicion.detalle()}"
+    assert medicion.round_trips <= presupuesto.round_trips, f"round trips {medicion.round_trips} > {presupuesto.round_trips}: {detalle}"
+    assert medicion.examinados <= presupuesto.examinados, f"examinados {medicion.examinados} > {presupuesto.examinados}: {detalle}"
+    assert medicion.bytes <= presupuesto.bytes, f"bytes {medicion.bytes} > {presupuesto.bytes}: {detalle}"
+
+
+@pytest.mark.parametrize(
+    "metodo, ruta, cuerpo, presupuesto", PRESUPUESTOS,
+    ids=[f"{metodo} {ruta}" for metodo, ruta, _, _ in PRESUPUESTOS]
+)
+def test_presupuesto_endpoint(api, usuario, monitor_mongo, metodo, ruta, cuerpo, presupuesto):
+    with monitor_mongo.medir() as medicion:
+        respuesta = api.request(metodo, ruta, json=cuerpo, headers=usuario)
+    assert respuesta.status_code < 400, respuesta.text
+    verificar(medicion, presupuesto, f"{metodo} {ruta}")
+
+
+def test_presupuesto_get_condicional(api, usuario, monitor_mongo):
+    # Con el ETag vigente solo se lee la versión de datos
+    etag = api.get("/api/flujo-dinero", headers=usuario).headers["etag"]
+    with monitor_mongo.medir() as medicion:
+        respuesta = api.get("/api/flujo-dinero", headers={**usuario, "If-None-Match": etag})
+    assert respuesta.status_code == 304
+    verificar(medicion, Presupuesto(1, 1, 100), "GET /api/flujo-dinero (304)")
+
+
+def test_presupuesto_reporte_repetido(api, usuario, monitor_mongo):
+    # Con la misma versión de datos se devuelve el reporte guardado sin leer ingresos, gastos ni GridFS
+    assert api.post(REPORTE, headers=usuario).status_code == 200
+    with monitor_mongo.medir() as medicion:
+        respuesta = api.post(REPORTE, headers=usuario)
+    assert respuesta.status_code == 200
+    verificar(medicion, Presupuesto(2, 2, 1000), f"POST {REPORTE} (repetido)")
@@ -0,0 +1,55 @@
+import pytest
+
+from backend import server
+
+INGRESOS = [
+    {"tipo": "salario", "monto": 3000, "frecuencia": "mensual"},
+    {"tipo": "freelance", "monto": 400, "frecuencia": "quincenal"},
+]
+GASTOS = [
+    {"categoria": "vivienda", "monto": 1000, "frecuencia": "mensual", "tipo": "fijo"},
+    {"categoria": "alimentacion", "monto": 150, "frecuencia": "semanal", "tipo": "variable"},
+]
+
+
+@pytest.fixture
+def headers(api, headers):
+    for ingreso in INGRESOS:
+        api.post("/api/ingresos", json={**ingreso, "descripcion": ingreso["tipo"]}, headers=headers)
+    for gasto in GASTOS:
+        api.post("/api/gastos", json={**gasto, "descripcion": gasto["categoria"]}, headers=headers)
+    return headers
+
+
+def proyectar(semilla: int, **params) -> dict:
+    return server.proyectar_flujo(INGRESOS, GASTOS, server.ProyeccionCreate(simulaciones=500, meses=12, **params), semilla)
+
+
+def test_misma_semilla_misma_proyeccion():
+    assert proyectar(7) == proyectar(7)
+    assert proyectar(7)["percentiles_saldo"] != proyectar(8)["percentiles_saldo"]
+
+
+def test_sin_volatilidad_el_saldo_es_determinista():
+    resultado = proyectar(1, volatilidad_gastos=0, volatilidad_ingresos=0, saldo_inicial=100)
+    flujo = 3000 + 800 - 1000 - 150 * 4.33
+    assert resultado["flujo_mensual_esperado"] == round(flujo, 2)
+    esperado = [round(100 + flujo * mes, 2) for mes in range(1, 13)]
+    assert all(banda == esperado for banda in resultado["percentiles_saldo"].values())
+    assert resultado["probabilidad_saldo_negativo"] == 0
+
+
+def test_bandas_ordenadas_y_riesgo_de_impago():
+    resultado = proyectar(3, tipo_credito="personal", monto_credito=60000, plazo_meses=24)
+    bandas = [resultado["percentiles_saldo"][f"p{p}"] for p in server.PERCENTILES_PROYECCION]
+    for mes in range(12):
+        assert [banda[mes] for banda in bandas] == sorted(banda[mes] for banda in bandas)
+    assert resultado["cuota_mensual"] == server.calcular_cuota_mensual(60000, server.TASAS_CREDITO["personal"], 24)
+    assert 0 < resultado["probabilidad_impago"] <= 1
+
+
+def test_ruta_reproduce_la_semilla_devuelta(api, headers):
+    primera = api.post("/api/proyeccion", json={"simulaciones": 200, "meses": 12}, headers=headers).json()
+    repetida = api.post("/api/proyeccion", json={"simulaciones": 200, "meses": 12, "semilla": primera["semilla"]}, headers=headers).json()
+    assert repetida["percentiles_saldo"] == primera["percentiles_saldo"]
+    assert repetida["probabilidad_saldo_negativo"] == primera["probabilidad_saldo_negativo"]
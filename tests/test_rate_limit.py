@@ -0,0 +1,46 @@
+import pytest
+
+from backend import server
+from tests.conftest import USUARIO, bearer
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def limitador(request, api, monkeypatch):
+    """Rate limiting activo con capacidad para dos logins (costo 5) y 0.5 fichas por segundo"""
+    backend = server.MongoRateLimitBackend() if request.param == "mongo" else server.MemoryRateLimitBackend(100)
+    limitador = server.RateLimiter(backend, 10, 0.5)
+    monkeypatch.setattr(server, "rate_limiter", limitador)
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    return limitador
+
+
+@pytest.mark.parametrize("capacidad, reposicion", [(0, 0.5), (10, 0), (10, -1)])
+def test_configuracion_invalida_se_rechaza_al_crear(capacidad, reposicion):
+    with pytest.raises(ValueError):
+        server.RateLimiter(server.MemoryRateLimitBackend(10), capacidad, reposicion)
+
+
+def test_exceso_responde_429_con_retry_after(api, limitador, registrar):
+    # El registro consume 5 de las 10 fichas de la IP
+    registrar()
+    login = {"email": USUARIO["email"], "password": USUARIO["password"]}
+
+    assert api.post("/api/login", json=login).status_code == 200
+    respuesta = api.post("/api/login", json=login)
+    assert respuesta.status_code == 429
+    # Faltan 5 fichas a 0.5 por segundo
+    assert respuesta.headers["Retry-After"] == "10"
+    assert limitador.stats()["throttled_by_route"] == {"login": 1}
+
+
+def test_buckets_separados_por_usuario(api, limitador, registrar):
+    headers = [
+        bearer(registrar(**campos)["access_token"])
+        for campos in ({}, {"email": "otra@example.com", "dni": "22334466"})
+    ]
+
+    simulacion = {"tipo_credito": "personal", "monto_solicitado": 5000, "plazo_meses": 12}
+    codigos = [api.post("/api/simulacion-credito", json=simulacion, headers=headers[0]).status_code for _ in range(4)]
+    assert codigos == [200, 200, 200, 429]
+    # El otro usuario conserva su saldo aunque comparta IP
+    assert api.post("/api/simulacion-credito", json=simulacion, headers=headers[1]).status_code == 200
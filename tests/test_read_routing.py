@@ -0,0 +1,64 @@
+import asyncio
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from backend import server
+
+
+class RegistroComandos(monitoring.CommandListener):
+    def __init__(self):
+        self.comandos = []
+
+    def started(self, event):
+        self.comandos.append((event.command_name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def preferencias(self, nombre: str):
+        return [comando.get("$readPreference") for comando_nombre, comando in self.comandos if comando_nombre == nombre]
+
+
+def ejecutar(mongo_url, prueba):
+    """Corre la prueba con server.db apuntando a una base temporal del replica set"""
+    registro = RegistroComandos()
+
+    async def main():
+        client = AsyncIOMotorClient(mongo_url, event_listeners=[registro])
+        db_anterior = server.db
+        server.db = client[f"test_{uuid.uuid4().hex[:8]}"]
+        try:
+            await prueba()
+        finally:
+            await client.drop_database(server.db.name)
+            server.db = db_anterior
+            client.close()
+
+    asyncio.run(main())
+    return registro
+
+
+def test_lecturas_analiticas_van_a_secundarios(mongo_replica_set):
+    async def prueba():
+        await server.db.users.insert_one({"id": "u1", "nombre": "Ana"})
+        stats = await server.get_admin_stats(admin_user=None)
+        # En un replica set de un nodo secondaryPreferred cae al primario
+        assert stats["total_usuarios"] == 1
+
+    registro = ejecutar(mongo_replica_set, prueba)
+    esperado = {"mode": "secondaryPreferred", "maxStalenessSeconds": server.ANALYTICS_MAX_STALENESS_SECONDS}
+    assert registro.preferencias("aggregate") == [esperado] * 4
+
+
+def test_lecturas_transaccionales_van_al_primario(mongo_replica_set):
+    async def prueba():
+        await server.db.users.insert_one({"id": "u1", "nombre": "Ana"})
+        assert await server.coleccion_lectura("users").find_one({"id": "u1"}) is not None
+
+    registro = ejecutar(mongo_replica_set, prueba)
+    assert registro.preferencias("find") == [None]
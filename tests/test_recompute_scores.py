@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from backend import server
+
+# (id, edad, dependientes, ingreso mensual, gasto mensual)
+USUARIOS = [
+    ("u1", 30, 0, 4000, 1000),
+    ("u2", 22, 3, 1500, 1400),
+    ("u3", 60, 1, 0, 300),
+    ("u4", 45, 2, 2500, 2600),
+    ("u5", 35, 0, 3000, 0),
+]
+
+
+@pytest.fixture
+def recalcular(mongo_en_memoria, monkeypatch):
+    import recompute_scores
+
+    monkeypatch.setattr(recompute_scores, "db", mongo_en_memoria)
+
+    async def preparar():
+        await mongo_en_memoria.users.insert_many([{"id": i, "edad": edad, "dependientes": dep} for i, edad, dep, _, _ in USUARIOS])
+        for user_id, _, _, ingreso, gasto in USUARIOS:
+            if ingreso:
+                await mongo_en_memoria.ingresos.insert_one(server.codificar_documento("ingresos", {
+                    "user_id": user_id, "tipo": "salario", "monto": ingreso, "frecuencia": "mensual", "activo": True
+                }))
+            if gasto:
+                await mongo_en_memoria.gastos.insert_one(server.codificar_documento("gastos", {
+                    "user_id": user_id, "categoria": "vivienda", "tipo": "fijo", "monto": gasto, "frecuencia": "mensual", "activo": True
+                }))
+
+    asyncio.run(preparar())
+    return lambda resume=False: asyncio.run(recompute_scores.recompute_scores(chunk_size=2, workers=2, resume=resume))
+
+
+def scores(db) -> dict:
+    return {u["id"]: u.get("score_actual") for u in asyncio.run(db.users.find({}).to_list(100))}
+
+
+def test_recalcula_todos_los_usuarios(mongo_en_memoria, recalcular):
+    resumen = recalcular()
+
+    assert resumen["usuarios"] == len(USUARIOS)
+    assert scores(mongo_en_memoria) == {
+        user_id: server.calcular_score_crediticio(ingreso, gasto, edad, dep)
+        for user_id, edad, dep, ingreso, gasto in USUARIOS
+    }
+    historial = asyncio.run(mongo_en_memoria.scores_historial.find({"run_id": resumen["run_id"]}).to_list(100))
+    assert len(historial) == len(USUARIOS)
+    checkpoint = asyncio.run(mongo_en_memoria.batch_checkpoints.find_one({"_id": "recompute_scores"}))
+    assert checkpoint["completado"] and checkpoint["procesados"] == len(USUARIOS)
+
+
+def test_retoma_una_ejecucion_interrumpida(mongo_en_memoria, recalcular):
+    asyncio.run(mongo_en_memoria.batch_checkpoints.insert_one({
+        "_id": "recompute_scores", "run_id": "interrumpida", "ultimo_user_id": "u2", "procesados": 2, "completado": False
+    }))
+
+    resumen = recalcular(resume=True)
+    assert (resumen["run_id"], resumen["usuarios"]) == ("interrumpida", 3)
+    recalculados = {u for u, score in scores(mongo_en_memoria).items() if score is not None}
+    assert recalculados == {"u3", "u4", "u5"}
+
+    # Con la ejecución completa, --resume empieza una nueva
+    assert recalcular(resume=True)["run_id"] != "interrumpida"
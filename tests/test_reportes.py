@@ -0,0 +1,122 @@
+import asyncio
+import csv
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from backend import server
+
+STREAM = "/api/reporte-sunat/stream?tipo_reporte=completo&periodo=2024"
+
+
+@pytest.fixture
+def usuario(api, headers):
+    return headers, api.get("/api/me", headers=headers).json()["id"]
+
+
+def insertar_ingresos(user_id: str, cantidad: int, monto: float = 10):
+    async def insertar():
+        await server.db.ingresos.insert_many([
+            server.codificar_documento("ingresos", server.prepare_for_mongo(server.Ingreso(
+                user_id=user_id, tipo="otro", descripcion=f"Ingreso {i}", monto=monto, frecuencia="mensual"
+            ).dict()))
+            for i in range(cantidad)
+        ])
+
+    asyncio.run(insertar())
+
+
+def filas_csv(contenido: bytes) -> list:
+    return list(csv.reader(io.StringIO(contenido.decode("utf-8"))))
+
+
+def test_reporte_csv_incluye_todas_las_filas(api, usuario):
+    headers, user_id = usuario
+    insertar_ingresos(user_id, 1500)
+
+    respuesta = api.get(STREAM, headers=headers)
+    assert respuesta.status_code == 200
+    filas = filas_csv(respuesta.content)
+    assert ["Ingresos Totales", "15000.0"] in filas
+    assert sum(1 for fila in filas if fila and fila[0] == "otro") == 1500
+
+
+def test_reporte_repetido_reutiliza_el_guardado(api, usuario):
+    pytest.importorskip("openpyxl")
+    headers, user_id = usuario
+    insertar_ingresos(user_id, 3)
+    ruta = "/api/reporte-sunat?tipo_reporte=completo&periodo=2024"
+
+    primero = api.post(ruta, headers=headers).json()
+    assert api.post(ruta, headers=headers).json()["id"] == primero["id"]
+    # Otro formato o datos nuevos generan otro reporte
+    assert api.post(ruta + "&formato=xlsx", headers=headers).json()["id"] != primero["id"]
+    api.post("/api/gastos", json={"categoria": "salud", "descripcion": "Consulta", "monto": 80, "tipo": "variable", "frecuencia": "mensual"}, headers=headers)
+    nuevo = api.post(ruta, headers=headers).json()
+    assert nuevo["id"] != primero["id"]
+    assert nuevo["datos"]["resumen_financiero"]["gastos_totales"] == 80
+    assert len(api.get("/api/reportes-sunat", headers=headers).json()) == 3
+
+
+def test_limpieza_borra_solo_archivos_sin_reporte(api, usuario, monkeypatch):
+    headers, user_id = usuario
+    insertar_ingresos(user_id, 3)
+    ruta = "/api/reporte-sunat?tipo_reporte=completo&periodo=2024"
+    vencido = api.post(ruta, headers=headers).json()["id"]
+    api.post("/api/gastos", json={"categoria": "salud", "descripcion": "Consulta", "monto": 80, "tipo": "variable", "frecuencia": "mensual"}, headers=headers)
+    vigente = api.post(ruta, headers=headers).json()["id"]
+
+    async def expirar() -> set:
+        # Lo que haría el índice TTL con el primer reporte
+        await server.db.reportes_sunat.delete_one({"id": vencido})
+        return {archivo["_id"] async for archivo in server.db[f"{server.REPORT_BUCKET}.files"].find({}, {"_id": 1})}
+
+    assert len(asyncio.run(expirar())) == 2
+    monkeypatch.setattr(server, "REPORT_CLEANUP_SECONDS", -60)
+    assert asyncio.run(server.limpiar_archivos_reporte()) == 1
+    assert asyncio.run(server.limpiar_archivos_reporte()) == 0
+    assert api.get(f"/api/reportes-sunat/{vigente}/download", headers=headers).status_code == 200
+
+
+def test_modulo_de_renderizado_no_importa_el_servidor():
+    comprobacion = "import sys, backend.render_reportes; assert 'backend.server' not in sys.modules and 'motor' not in sys.modules"
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", comprobacion], cwd=raiz, check=True)
+
+
+@pytest.mark.parametrize("formato, firma", [("xlsx", b"PK"), ("pdf", b"%PDF")])
+def test_renderiza_en_el_pool_sin_fork(api, usuario, formato, firma):
+    if not server.FORMATOS_REPORTE[formato]["disponible"]:
+        pytest.skip(f"{formato} no disponible")
+    headers, user_id = usuario
+    insertar_ingresos(user_id, 3)
+
+    reporte = api.post(f"/api/reporte-sunat?tipo_reporte=completo&periodo=2024&formato={formato}", headers=headers).json()
+    assert server.get_render_pool()._mp_context.get_start_method() == "forkserver"
+    descarga = api.get(f"/api/reportes-sunat/{reporte['id']}/download", headers=headers)
+    assert descarga.status_code == 200
+    assert descarga.content.startswith(firma)
+
+
+def test_csv_se_genera_en_bloques_acotados(api, usuario, monkeypatch):
+    _, user_id = usuario
+    insertar_ingresos(user_id, 200)
+    monkeypatch.setattr(server, "REPORT_CHUNK_SIZE", 512)
+
+    async def generar():
+        conteo = {}
+        resumen = {"ingresos_totales": 2000, "gastos_totales": 0, "flujo_neto": 2000}
+        bloques = [bloque async for bloque in server.iter_reporte_csv(user_id, "ingresos", resumen, conteo)]
+        return bloques, conteo
+
+    bloques, conteo = asyncio.run(generar())
+    assert len(bloques) > 1
+    # Cada bloque se entrega apenas supera el umbral, salvo el último
+    assert all(len(bloque) < 512 + 100 for bloque in bloques)
+    filas = filas_csv(b"".join(bloques))
+    assert filas[0] == server.SECCIONES_REPORTE["ingresos"]["cabecera"]
+    assert len(filas) == 201
+    assert conteo == {"cantidad_ingresos": 200}
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from backend import server
+from tests.conftest import bearer, datos_usuario
+
+SIMULACION = {"tipo_credito": "personal", "monto_solicitado": 8000, "plazo_meses": 18}
+
+
+def documentos(cantidad: int, desde: int = 0):
+    return [{"_id": i, "id": f"sim-{i}"} for i in range(desde, desde + cantidad)]
+
+
+def test_flush_inserta_por_lotes(mongo_en_memoria):
+    async def prueba():
+        buffer = server.WriteBehindBuffer("simulaciones", 2, 500, 10)
+        for doc in documentos(5):
+            assert buffer.add(doc)
+        assert len(buffer.pendientes()) == 5
+        await buffer.flush()
+        assert await mongo_en_memoria.simulaciones.count_documents({}) == 5
+        assert (buffer.flushed, buffer.flushes, buffer.pendientes()) == (5, 3, [])
+
+    asyncio.run(prueba())
+
+
+def test_buffer_lleno_rechaza_y_el_llamador_inserta(mongo_en_memoria):
+    buffer = server.WriteBehindBuffer("simulaciones", 10, 500, 2)
+    assert [buffer.add(doc) for doc in documentos(3)] == [True, True, False]
+    assert buffer.stats()["overflow"] == 1
+
+
+def test_rechazados_van_a_dead_letter_sin_contarse_como_guardados(mongo_en_memoria):
+    async def prueba():
+        coleccion = mongo_en_memoria.simulaciones
+        await coleccion.create_index("id", unique=True)
+        # _id 0 ya guardado por un intento anterior; sim-1 choca con otro documento por id
+        await coleccion.insert_many([{"_id": 0, "id": "sim-0"}, {"_id": 99, "id": "sim-1"}])
+        buffer = server.WriteBehindBuffer("simulaciones", 10, 500, 10)
+        for doc in documentos(3):
+            buffer.add(doc)
+        await buffer.flush()
+
+        stats = buffer.stats()
+        assert (stats["flushed"], stats["duplicates"], stats["dead_lettered"], stats["errors"]) == (1, 1, 1, 1)
+        assert stats["pending"] == 0
+        rechazados = await mongo_en_memoria.simulaciones_dead_letter.find({}).to_list(10)
+        assert [r["documento"]["_id"] for r in rechazados] == [1]
+        assert rechazados[0]["error"]["code"] == 11000
+
+    asyncio.run(prueba())
+
+
+def test_error_de_conexion_devuelve_el_lote_a_la_cola(mongo_en_memoria, monkeypatch):
+    async def prueba():
+        buffer = server.WriteBehindBuffer("simulaciones", 10, 500, 10)
+        for doc in documentos(2):
+            buffer.add(doc)
+
+        async def caido(*args, **kwargs):
+            raise ConnectionError("sin conexión")
+
+        with monkeypatch.context() as parche, pytest.raises(ConnectionError):
+            parche.setattr(type(mongo_en_memoria.simulaciones), "insert_many", caido)
+            await buffer.flush()
+        assert len(buffer.pendientes()) == 2 and buffer.flushed == 0
+        await buffer.flush()
+        assert await mongo_en_memoria.simulaciones.count_documents({}) == 2
+
+    asyncio.run(prueba())
+
+
+def test_al_cerrar_se_vacia_el_buffer(mongo_en_memoria, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    # Sin vaciados periódicos: lo que quede en memoria solo se guarda al cerrar
+    monkeypatch.setattr(server.simulaciones_buffer, "flush_interval", 3600)
+    monkeypatch.setattr(server.simulaciones_buffer, "flush_size", 1000)
+    with TestClient(server.app) as api:
+        headers = bearer(api.post("/api/register", json=datos_usuario()).json()["access_token"])
+        for _ in range(3):
+            assert api.post("/api/simulacion-credito", json=SIMULACION, headers=headers).status_code == 200
+        # Se leen las propias escrituras aunque aún no estén en Mongo
+        assert len(api.get("/api/simulaciones", headers=headers).json()) == 3
+        assert asyncio.run(mongo_en_memoria.simulaciones.count_documents({})) == 0
+
+    assert asyncio.run(mongo_en_memoria.simulaciones.count_documents({})) == 3
+    assert server.simulaciones_buffer.pendientes() == []
@@ -0,0 +1,49 @@
+import asyncio
+import uuid
+
+from backend import server
+
+
+def test_calculos_concurrentes_se_ejecutan_una_vez(api):
+    user_id = uuid.uuid4().hex
+    llamadas = []
+
+    async def calcular():
+        llamadas.append(1)
+        await asyncio.sleep(0.05)
+        return server.flujo_desde_totales(user_id, 1000, 400)
+
+    async def prueba():
+        server.version_datos_request.set((user_id, 0))
+        return await asyncio.gather(*(
+            server.calculo_compartido(user_id, "flujo", calcular, server.FlujoDinero) for _ in range(5)
+        ))
+
+    antes = server.cache.cargas_en_curso.stats()["coalesced_by_computation"].get("flujo", 0)
+    resultados = asyncio.run(prueba())
+    assert len(llamadas) == 1
+    assert {r.flujo_neto for r in resultados} == {600}
+
+    # Las métricas reflejan la ejecución agrupada
+    metricas = api.get("/debug/metrics").json()["singleflight"]
+    assert metricas["executions"] >= 1
+    assert metricas["coalesced_by_computation"]["flujo"] - antes == 4
+    assert metricas["coalesced"] == server.cache.stats()["coalesced"]
+
+
+def test_nueva_version_de_datos_recalcula(api):
+    user_id = uuid.uuid4().hex
+    llamadas = []
+
+    async def calcular():
+        llamadas.append(1)
+        return server.flujo_desde_totales(user_id, 1000, 400 + len(llamadas))
+
+    async def con_version(version: int):
+        server.version_datos_request.set((user_id, version))
+        return await server.calculo_compartido(user_id, "flujo", calcular, server.FlujoDinero)
+
+    assert asyncio.run(con_version(0)).gastos_totales == 401
+    assert asyncio.run(con_version(0)).gastos_totales == 401
+    assert asyncio.run(con_version(1)).gastos_totales == 402
+    assert len(llamadas) == 2
@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+from backend import server
+from tests.conftest import bearer
+
+
+@pytest.fixture
+def heartbeat_corto(monkeypatch):
+    monkeypatch.setattr(server, "SSE_HEARTBEAT_SECONDS", 0.05)
+
+
+def leer_stream(api, token: str) -> list:
+    """Líneas del stream; TestClient solo devuelve la respuesta cuando el servidor la cierra"""
+    respuesta = api.get(f"/api/stream?token={token}")
+    assert respuesta.status_code == 200
+    return respuesta.text.splitlines()
+
+
+def test_stream_se_cierra_al_revocar_el_token(api, heartbeat_corto, registrar):
+    tokens = registrar()
+    headers = bearer(tokens["access_token"])
+
+    # Logout mientras el stream sigue abierto
+    logout = threading.Timer(0.3, lambda: api.post("/api/logout", json={}, headers=headers))
+    logout.start()
+    lineas = leer_stream(api, tokens["access_token"])
+    logout.join()
+    assert "event: flujo" in lineas
+    assert ": ping" in lineas
+
+    # Reconectar con el token revocado ya no es posible
+    assert api.get(f"/api/stream?token={tokens['access_token']}").status_code == 401
+
+
+def test_stream_se_cierra_al_expirar_el_token(api, heartbeat_corto, registrar, monkeypatch):
+    monkeypatch.setattr(server, "ACCESS_TOKEN_MINUTES", 1 / 60)
+    token = registrar()["access_token"]
+
+    lineas = leer_stream(api, token)
+    assert "event: flujo" in lineas
+    assert ": ping" in lineas